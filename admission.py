@@ -0,0 +1,280 @@
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+
+class Limit:
+    """Token bucket: rate токенов в секунду, не больше capacity подряд"""
+    __slots__ = ('key', 'rate', 'capacity')
+
+    def __init__(self, key: str, rate: float, capacity: float):
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+
+
+class Decision:
+    """Результат проверки: allowed, через сколько секунд повторить, какой лимит сработал и занятый слот"""
+    __slots__ = ('allowed', 'retry_after', 'reason', 'slot')
+
+    def __init__(self, allowed: bool, retry_after: float = 0.0, reason: str = None, slot: str = None):
+        self.allowed = allowed
+        self.retry_after = retry_after
+        self.reason = reason
+        self.slot = slot
+
+    def __bool__(self):
+        return self.allowed
+
+
+def refill(tokens: float, updated_at: float, limit: Limit, now: float) -> float:
+    return min(limit.capacity, tokens + (now - updated_at) * limit.rate)
+
+
+class AdmissionStore(ABC):
+    """Общий интерфейс хранилища лимитов: token buckets и занятые слоты run Assistant"""
+
+    @abstractmethod
+    def take(self, limits: list, now: float) -> Decision:
+        """Забирает по токену из всех bucket сразу или ни из одного"""
+
+    @abstractmethod
+    def acquire_slot(self, cap: int, ttl: float, now: float):
+        """Занимает слот из cap; возвращает id слота или None. Слот истекает через ttl секунд"""
+
+    @abstractmethod
+    def release_slot(self, slot_id: str):
+        ...
+
+    @abstractmethod
+    def inflight(self, now: float) -> int:
+        ...
+
+    @abstractmethod
+    def cleanup(self, idle: float, now: float):
+        """Удаляет давно не использованные bucket и истёкшие слоты"""
+
+
+class MemoryAdmissionStore(AdmissionStore):
+    """Лимиты в памяти процесса (действуют только на этот процесс)"""
+
+    def __init__(self):
+        self._buckets = {}  # key -> [tokens, updated_at]
+        self._slots = {}  # slot_id -> expires_at
+        self._lock = threading.Lock()
+
+    def take(self, limits: list, now: float) -> Decision:
+        with self._lock:
+            levels = []
+            for limit in limits:
+                tokens, updated_at = self._buckets.get(limit.key, (limit.capacity, now))
+                tokens = refill(tokens, updated_at, limit, now)
+                if tokens < 1:
+                    return Decision(False, (1 - tokens) / limit.rate, limit.key)
+                levels.append((limit.key, tokens))
+            for key, tokens in levels:
+                self._buckets[key] = [tokens - 1, now]
+        return Decision(True)
+
+    def acquire_slot(self, cap: int, ttl: float, now: float):
+        with self._lock:
+            self._expire(now)
+            if len(self._slots) >= cap:
+                return None
+            slot_id = uuid.uuid4().hex
+            self._slots[slot_id] = now + ttl
+            return slot_id
+
+    def release_slot(self, slot_id: str):
+        with self._lock:
+            self._slots.pop(slot_id, None)
+
+    def _expire(self, now: float):
+        for slot_id in [slot_id for slot_id, expires_at in self._slots.items() if expires_at < now]:
+            del self._slots[slot_id]
+
+    def inflight(self, now: float) -> int:
+        with self._lock:
+            self._expire(now)
+            return len(self._slots)
+
+    def cleanup(self, idle: float, now: float):
+        with self._lock:
+            for key in [key for key, (_, updated_at) in self._buckets.items() if updated_at < now - idle]:
+                del self._buckets[key]
+            self._expire(now)
+
+
+class SqliteAdmissionStore(AdmissionStore):
+    """Лимиты в локальном файле SQLite: общие для всех процессов-воркеров"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets ("
+            " key TEXT PRIMARY KEY,"
+            " tokens REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS inflight_slots ("
+            " id TEXT PRIMARY KEY,"
+            " expires_at REAL NOT NULL)"
+        )
+
+    def _transaction(self, func):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def take(self, limits: list, now: float) -> Decision:
+        def take():
+            levels = []
+            for limit in limits:
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at FROM rate_buckets WHERE key = ?", (limit.key,)
+                ).fetchone()
+                tokens = refill(*row, limit, now) if row else limit.capacity
+                if tokens < 1:
+                    return Decision(False, (1 - tokens) / limit.rate, limit.key)
+                levels.append((limit.key, tokens - 1, now))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)", levels
+            )
+            return Decision(True)
+
+        return self._transaction(take)
+
+    def acquire_slot(self, cap: int, ttl: float, now: float):
+        def acquire():
+            self._conn.execute("DELETE FROM inflight_slots WHERE expires_at < ?", (now,))
+            if self._conn.execute("SELECT COUNT(*) FROM inflight_slots").fetchone()[0] >= cap:
+                return None
+            slot_id = uuid.uuid4().hex
+            self._conn.execute("INSERT INTO inflight_slots (id, expires_at) VALUES (?, ?)", (slot_id, now + ttl))
+            return slot_id
+
+        return self._transaction(acquire)
+
+    def release_slot(self, slot_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM inflight_slots WHERE id = ?", (slot_id,))
+
+    def inflight(self, now: float) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM inflight_slots WHERE expires_at >= ?", (now,)
+            ).fetchone()[0]
+
+    def cleanup(self, idle: float, now: float):
+        with self._lock:
+            self._conn.execute("DELETE FROM rate_buckets WHERE updated_at < ?", (now - idle,))
+            self._conn.execute("DELETE FROM inflight_slots WHERE expires_at < ?", (now,))
+
+
+class AdmissionController:
+    """Допуск запросов к Assistant: token buckets по клиентам и общий лимит одновременных run.
+
+    Лишний запрос сразу получает отказ с временем, через которое стоит повторить,
+    а не ждёт в очереди. Слот run занимается на время ответа и освобождается
+    явно; если процесс упал, слот истекает через slot_ttl секунд. Ошибка
+    хранилища лимитов не блокирует клиентов: запрос пропускается.
+    """
+
+    def __init__(self, store: AdmissionStore, max_inflight: int = 32, slot_ttl: float = 180,
+                 busy_retry_after: float = 5, idle_ttl: float = 3600, cleanup_every: int = 500):
+        self.store = store
+        self.max_inflight = max_inflight
+        self.slot_ttl = slot_ttl
+        self.busy_retry_after = busy_retry_after
+        self.idle_ttl = idle_ttl
+        self.cleanup_every = cleanup_every
+        self.rejected = {}  # причина -> количество отказов
+        self._checks = 0
+        self._lock = threading.Lock()
+
+    def _reject(self, reason: str):
+        with self._lock:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def check(self, limits: list) -> Decision:
+        """Проверяет и расходует token buckets. reason отказа — вид ключа (ip, thread, user)"""
+        now = time.time()
+        with self._lock:
+            self._checks += 1
+            cleanup = self._checks % self.cleanup_every == 0
+        if cleanup:
+            self.store.cleanup(self.idle_ttl, now)
+        decision = self.store.take(limits, now)
+        if not decision:
+            decision.reason = decision.reason.split(':', 1)[0]
+            self._reject(decision.reason)
+        return decision
+
+    def acquire(self):
+        """Занимает слот run Assistant; None — все слоты заняты"""
+        slot_id = self.store.acquire_slot(self.max_inflight, self.slot_ttl, time.time())
+        if slot_id is None:
+            self._reject('inflight')
+        return slot_id
+
+    def admit(self, limits: list) -> Decision:
+        """Лимиты клиента и слот run за один вызов; слот отказа освобождать не нужно.
+
+        Сначала занимается слот: отказ из-за загрузки сервиса не должен расходовать
+        токены клиента, иначе после перегрузки его запросы отклонялись бы ещё и по ip/thread.
+        """
+        slot = None
+        try:
+            slot = self.acquire()
+            if slot is None:
+                return Decision(False, self.busy_retry_after, 'inflight')
+            decision = self.check(limits)
+            if not decision:
+                self.release(slot)
+                return decision
+            decision.slot = slot
+            return decision
+        except Exception as e:
+            logger.error(f"Ошибка хранилища лимитов, запрос пропущен: {e}")
+            self.release(slot)
+            return Decision(True)
+
+    def release(self, slot_id):
+        if slot_id is None:
+            return
+        try:
+            self.store.release_slot(slot_id)
+        except Exception as e:
+            logger.error(f"Не удалось освободить слот run {slot_id}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            'inflight': self.store.inflight(time.time()),
+            'max_inflight': self.max_inflight,
+            'rejected': dict(self.rejected),
+        }
+
+
+def create_admission_store(backend: str = 'sqlite', path: str = 'rate_limits.db') -> AdmissionStore:
+    """Создаёт хранилище лимитов по имени: 'sqlite' (общее для процессов) или 'memory'"""
+    if backend == 'sqlite':
+        return SqliteAdmissionStore(path)
+    if backend == 'memory':
+        return MemoryAdmissionStore()
+    raise ValueError(f"Неизвестное хранилище лимитов: {backend}")
@@ -0,0 +1,107 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from normalizer import question_key
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """LRU + TTL кэш ответов Assistant на первые вопросы без контекста.
+
+    Ключ — нормализованная форма вопроса (см. normalizer.question_key).
+    Кэш сбрасывается целиком, если изменился любой из отслеживаемых файлов
+    (база знаний, промпт), — проверка не чаще раза в check_interval секунд.
+    """
+
+    def __init__(self, maxsize: int = 500, ttl: float = 6 * 3600, watch_files=(), check_interval: float = 1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.watch_files = list(watch_files)
+        self.check_interval = check_interval
+        self._data = OrderedDict()  # key -> (expires_at, answer)
+        self._lock = threading.Lock()
+        self._signature = self._files_signature()
+        self._checked_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.avg_miss_latency = 0.0  # скользящее среднее времени ответа Assistant без кэша, сек
+
+    def _files_signature(self):
+        signature = []
+        for path in self.watch_files:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _check_files(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        signature = self._files_signature()
+        if signature != self._signature:
+            self._signature = signature
+            self._data.clear()
+            self.invalidations += 1
+            logger.info("Кэш ответов сброшен: изменились база знаний или промпт")
+
+    def get(self, message: str):
+        """Возвращает ответ из кэша или None"""
+        key = question_key(message)
+        if not key:
+            return None
+        with self._lock:
+            self._check_files()
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, message: str, answer: str, latency: float = None):
+        """Сохраняет ответ на вопрос, вытесняя самые старые записи сверх maxsize.
+
+        latency — сколько занял ответ Assistant; нужен для оценки сэкономленного времени.
+        """
+        key = question_key(message)
+        if not key:
+            return
+        with self._lock:
+            if latency is not None:
+                if self.avg_miss_latency:
+                    self.avg_miss_latency = 0.9 * self.avg_miss_latency + 0.1 * latency
+                else:
+                    self.avg_miss_latency = latency
+            self._data[key] = (time.monotonic() + self.ttl, answer)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """Счётчики попаданий для /health"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'invalidations': self.invalidations,
+            'avg_miss_latency': round(self.avg_miss_latency, 3),
+            'estimated_saved_seconds': round(self.hits * self.avg_miss_latency, 1),
+        }
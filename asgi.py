@@ -0,0 +1,439 @@
+# Асинхронный режим сервера: HTTP API и Telegram Application в одном event loop.
+#
+# В режиме Flask (main.py) запросы обслуживаются потоками WSGI и передаются в отдельный
+# telegram_loop через run_coroutine_threadsafe; каждый медленный ответ Assistant занимает поток.
+# Здесь те же эндпоинты — ASGI приложение, работающее прямо в loop PTB: ожидание
+# Assistant не занимает потоков, блокирующие вызовы (SQLite лимитов и заявок, Sheets) уходят
+# в пул потоков: loop общий для всех HTTP запросов и Telegram.
+#
+# Запуск: python asgi.py или uvicorn asgi:app --port 5000
+import os
+import json
+import time
+import asyncio
+import threading
+from urllib.parse import parse_qs
+
+import telegram
+
+import main
+from main import (
+    application, update_queue, http_request_seconds, METRIC_ENDPOINTS, WEBHOOK_MODE, CHAT_TIMEOUT,
+    TRUST_PROXY, ADMIN_TOKEN, WARM_UP_CLIENTS, parse_booking, booking_response, rate_limit_payload, sse_event,
+    slots_report
+)
+from functions import (
+    logger, NGROK_URL, save_application_to_sheets, get_assistant_response_async, assistant_pool, sheets_spool,
+    thread_prewarmer, metrics, admission, admit_assistant_request, warm_up_clients, start_bookings_sync
+)
+from metrics import MetricsRegistry
+from structured_logging import request_id_var, new_request_id, log_settings
+
+# Максимальный размер тела запроса (Telegram update, сообщение виджета, заявка)
+MAX_BODY = int(os.getenv('ASGI_MAX_BODY', str(1024 * 1024)))
+# Сколько ждать обработки update в режиме webhook 'sync' (сек)
+WEBHOOK_TIMEOUT = 10
+
+# Фоновые задачи стрима: ссылки держатся до завершения, иначе задачу может собрать GC
+background_tasks = set()
+
+
+class Request:
+    """Входящий HTTP запрос ASGI с уже прочитанным телом"""
+    __slots__ = ('method', 'path', 'query', 'headers', 'body', 'client')
+
+    def __init__(self, scope: dict, body: bytes):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.body = body
+        self.client = scope['client'][0] if scope.get('client') else None
+
+    def json(self):
+        """Тело как JSON; None, если тело пустое или не JSON"""
+        try:
+            return json.loads(self.body) if self.body else None
+        except ValueError:
+            return None
+
+
+class Response:
+    """Ответ целиком"""
+
+    def __init__(self, body=b'', status: int = 200, content_type: str = 'text/plain; charset=utf-8', headers=None):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.status = status
+        self.content_type = content_type
+        self.headers = dict(headers or {})
+
+
+class StreamingResponse(Response):
+    """Ответ по частям из асинхронного генератора (Server-Sent Events)"""
+
+    def __init__(self, chunks, status: int = 200, content_type: str = 'text/event-stream; charset=utf-8',
+                 headers=None):
+        super().__init__(b'', status, content_type, headers)
+        self.chunks = chunks
+
+
+def json_response(data, status: int = 200, headers=None) -> Response:
+    return Response(json.dumps(data, ensure_ascii=False), status, 'application/json', headers)
+
+
+def client_ip(request: Request):
+    """IP клиента виджета для лимитов (как main.client_ip)"""
+    if TRUST_PROXY and request.headers.get('x-forwarded-for'):
+        return request.headers['x-forwarded-for'].split(',')[0].strip()
+    return request.client
+
+
+def too_many_requests(decision) -> Response:
+    payload, headers = rate_limit_payload(decision)
+    return json_response(payload, 429, headers)
+
+
+# === Эндпоинты ===
+
+async def webhook(request: Request) -> Response:
+    """Webhook endpoint для Telegram: update обрабатывается в этом же loop"""
+    data = request.json()
+    if not data:
+        logger.error('Нет данных в webhook запросе')
+        return Response('No data', 400)
+
+    # Полный update пишется в лог только при включённом логировании payload
+    if log_settings.payload():
+        logger.info('Webhook данные: %s', data)
+
+    update = telegram.Update.de_json(data, application.bot)
+    if update is None or not update.update_id:
+        logger.error('Некорректный update в webhook запросе')
+        return Response('Bad update', 400)
+
+    # Режим ack: кладём update в очередь и сразу отвечаем Telegram
+    if WEBHOOK_MODE == 'ack':
+        if not update_queue.offer(update):
+            logger.warning('Очередь webhook переполнена (%d), update %s отклонён', update_queue.depth, update.update_id)
+            return Response('Busy', 503, headers={'Retry-After': '5'})
+        return Response('OK')
+
+    # Режим sync: ждём обработку не дольше WEBHOOK_TIMEOUT; по таймауту обработка продолжается
+    try:
+        await asyncio.wait_for(asyncio.shield(application.process_update(update)), WEBHOOK_TIMEOUT)
+    except Exception as e:
+        logger.error("Ошибка обработки update: %s", e)
+    return Response('OK')
+
+
+async def chat(request: Request) -> Response:
+    """Консультация через OpenAI Assistant: ожидание ответа не занимает поток"""
+    data = request.json() or {}
+    message = data.get('message', '')
+    thread_id = data.get('thread_id')
+    if not message:
+        return json_response({'error': 'Сообщение не может быть пустым'}, 400)
+
+    decision = await assistant_pool.run_blocking(admit_assistant_request, ip=client_ip(request), thread=thread_id)
+    if not decision:
+        return too_many_requests(decision)
+    try:
+        answer, new_thread_id = await asyncio.wait_for(
+            assistant_pool.run(get_assistant_response_async(message, thread_id, 'Виджет')), CHAT_TIMEOUT
+        )
+        # answer=None: сообщение объединено с более поздним, ответ придёт на него
+        return json_response({'response': answer, 'thread_id': new_thread_id, 'merged': answer is None})
+    except Exception as e:
+        logger.error(f'Ошибка API чата: {e}')
+        return json_response({'error': 'Внутренняя ошибка сервера'}, 500)
+    finally:
+        # shield: слот освобождается и при отмене запроса (таймаут сервера, разрыв соединения)
+        await asyncio.shield(assistant_pool.run_blocking(admission.release, decision.slot))
+
+
+async def chat_stream(request: Request) -> Response:
+    """Ответ Assistant по частям (Server-Sent Events) без промежуточного потока"""
+    data = request.json() or {}
+    message = data.get('message', '')
+    thread_id = data.get('thread_id')
+    if not message:
+        return json_response({'error': 'Сообщение не может быть пустым'}, 400)
+
+    decision = await assistant_pool.run_blocking(admit_assistant_request, ip=client_ip(request), thread=thread_id)
+    if not decision:
+        return too_many_requests(decision)
+
+    events = asyncio.Queue()
+
+    async def on_delta(text):
+        events.put_nowait(('delta', {'text': text}))
+
+    async def produce():
+        try:
+            answer, new_thread_id = await assistant_pool.run(
+                get_assistant_response_async(message, thread_id, 'Виджет', on_delta=on_delta)
+            )
+            events.put_nowait(('thread_id', {'thread_id': new_thread_id}))
+            events.put_nowait(('done', {'response': answer, 'merged': answer is None}))
+        except Exception as e:
+            logger.error(f'Ошибка стрима чата: {e}')
+            events.put_nowait(('error', {'error': 'Внутренняя ошибка сервера'}))
+        finally:
+            # Слот занят до конца run, даже если клиент уже закрыл соединение
+            await assistant_pool.run_blocking(admission.release, decision.slot)
+
+    task = asyncio.create_task(produce())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    async def generate():
+        while True:
+            try:
+                event, payload = await asyncio.wait_for(events.get(), CHAT_TIMEOUT)
+            except asyncio.TimeoutError:
+                yield sse_event('error', {'error': 'Превышено время ожидания ответа'})
+                return
+            yield sse_event(event, payload)
+            if event in ('done', 'error'):
+                return
+
+    return StreamingResponse(generate(), headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def booking(request: Request) -> Response:
+    """Быстрая запись к адвокату: запись в Sheets/очередь — в пуле потоков, уведомление — в этом loop"""
+    data = request.json()
+    if not isinstance(data, dict):
+        return json_response({'error': 'Некорректный запрос'}, 400)
+    booking_data, error = parse_booking(data)
+    if error:
+        return json_response({'error': error}, 400)
+    try:
+        idempotency_key = request.headers.get('idempotency-key') or data.get('idempotency_key')
+        result = await assistant_pool.run_blocking(
+            save_application_to_sheets, booking_data,
+            idempotency_key=f"api:{idempotency_key}" if idempotency_key else None
+        )
+        payload, status = booking_response(booking_data, result)
+        return json_response(payload, status)
+    except Exception as e:
+        logger.error(f'Ошибка API записи: {e}')
+        return json_response({'error': 'Внутренняя ошибка сервера'}, 500)
+
+
+async def services(request: Request) -> Response:
+    from functions import services
+    return json_response({'services': services})
+
+
+async def slots(request: Request) -> Response:
+    payload, status = slots_report({name: values[-1] for name, values in request.query.items()})
+    return json_response(payload, status)
+
+
+async def health(request: Request) -> Response:
+    # Отчёт собирается в пуле потоков: задержка loop меряется так же, как в режиме Flask
+    payload, status = await asyncio.to_thread(main.health_report, 'asgi')
+    return json_response(payload, status)
+
+
+async def ready(request: Request) -> Response:
+    payload, status = await asyncio.to_thread(main.readiness_report)
+    return json_response(payload, status)
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    body = await asyncio.to_thread(metrics.render)
+    return Response(body, content_type=MetricsRegistry.CONTENT_TYPE)
+
+
+async def logging_settings(request: Request) -> Response:
+    """Переключение подробного логирования без перезапуска (только с ADMIN_TOKEN)"""
+    if not ADMIN_TOKEN or request.headers.get('x-admin-token') != ADMIN_TOKEN:
+        return json_response({'error': 'Доступ запрещён'}, 403)
+    if request.method == 'POST':
+        data = request.json() or {}
+        try:
+            log_settings.update(
+                payloads=data.get('payloads'), sample_rate=data.get('sample_rate'), level=data.get('level')
+            )
+        except (TypeError, ValueError) as e:
+            return json_response({'error': f'Некорректные настройки: {e}'}, 400)
+        logger.warning('Настройки логирования изменены: %s', log_settings.stats())
+    return json_response(log_settings.stats())
+
+
+# Путь -> (методы, обработчик)
+ROUTES = {
+    '/webhook': (('POST',), webhook),
+    '/api/chat': (('POST',), chat),
+    '/api/chat/stream': (('POST',), chat_stream),
+    '/api/booking': (('POST',), booking),
+    '/api/services': (('GET',), services),
+    '/api/slots': (('GET',), slots),
+    '/health': (('GET',), health),
+    '/ready': (('GET',), ready),
+    '/metrics': (('GET',), metrics_endpoint),
+    '/admin/logging': (('GET', 'POST'), logging_settings),
+}
+
+
+# === ASGI приложение ===
+
+async def startup():
+    """Запуск в loop сервера: он же становится telegram_loop для всего кода main/functions"""
+    started_at = time.perf_counter()
+    main.telegram_loop = asyncio.get_running_loop()
+    main.telegram_thread = threading.current_thread()
+    if WARM_UP_CLIENTS:
+        threading.Thread(target=warm_up_clients, name='warm-up-clients', daemon=True).start()
+    try:
+        await main.start_telegram(started_at)
+    except Exception as e:
+        main.telegram_init_error = str(e)
+        raise
+    # Копия таблицы заявок и календарь записи загружаются фоном
+    start_bookings_sync()
+    # Дописываем в Google Sheets заявки, оставшиеся в локальной очереди
+    sheets_spool.start()
+
+
+async def shutdown():
+    if background_tasks:
+        await asyncio.wait(background_tasks, timeout=CHAT_TIMEOUT)
+    try:
+        # Удаляем невыданные thread из запаса
+        await thread_prewarmer.shutdown()
+    except Exception as e:
+        logger.error(f"Ошибка остановки запаса thread: {e}")
+    await asyncio.to_thread(sheets_spool.stop)
+    await application.shutdown()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await startup()
+            except Exception as e:
+                logger.error(f"Ошибка запуска ASGI приложения: {e}", exc_info=True)
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def read_body(receive) -> bytes:
+    """Тело запроса; None, если оно больше MAX_BODY"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def cors_headers(request: Request, methods) -> dict:
+    """CORS для веб-виджета (как CORS(app) в режиме Flask)"""
+    headers = {'Access-Control-Allow-Origin': '*'}
+    if request.method == 'OPTIONS':
+        headers['Access-Control-Allow-Methods'] = ', '.join(methods + ('OPTIONS',))
+        if request.headers.get('access-control-request-headers'):
+            headers['Access-Control-Allow-Headers'] = request.headers['access-control-request-headers']
+    return headers
+
+
+async def dispatch(request: Request) -> Response:
+    route = ROUTES.get(request.path)
+    if route is None:
+        return json_response({'error': 'Not Found'}, 404)
+    methods, handler = route
+    if request.method == 'OPTIONS':
+        response = Response()
+    elif request.method not in methods:
+        response = json_response({'error': 'Method Not Allowed'}, 405, {'Allow': ', '.join(methods)})
+    else:
+        try:
+            response = await handler(request)
+        except Exception as e:
+            logger.error(f'Ошибка обработки {request.path}: {e}', exc_info=True)
+            response = json_response({'error': 'Внутренняя ошибка сервера'}, 500)
+    response.headers.update(cors_headers(request, methods))
+    return response
+
+
+async def app(scope, receive, send):
+    """ASGI приложение: lifespan и HTTP эндпоинты main.py"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    started_at = time.perf_counter()
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    request_id_var.set(headers.get('x-request-id') or new_request_id())
+    body = await read_body(receive)
+    if body is None:
+        response = json_response({'error': 'Слишком большой запрос'}, 413)
+    else:
+        response = await dispatch(Request(scope, body))
+    response.headers['X-Request-ID'] = request_id_var.get()
+
+    # Для стрима — время до начала ответа, как в режиме Flask
+    if scope['path'] in METRIC_ENDPOINTS:
+        http_request_seconds.observe(time.perf_counter() - started_at, endpoint=scope['path'], status=response.status)
+
+    raw_headers = [(b'content-type', response.content_type.encode('latin-1'))]
+    raw_headers += [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+                    for name, value in response.headers.items()]
+    if isinstance(response, StreamingResponse):
+        await send({'type': 'http.response.start', 'status': response.status, 'headers': raw_headers})
+        async for chunk in response.chunks:
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    else:
+        raw_headers.append((b'content-length', str(len(response.body)).encode('latin-1')))
+        await send({'type': 'http.response.start', 'status': response.status, 'headers': raw_headers})
+        await send({'type': 'http.response.body', 'body': response.body})
+
+
+# === Запуск через uvicorn ===
+
+def serve_in_thread(host: str = '127.0.0.1', port: int = 0):
+    """Запускает uvicorn в отдельном потоке (бенчмарки); возвращает (server, port) после готовности"""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, lifespan='on', log_level='warning'))
+    threading.Thread(target=server.run, name='asgi-server', daemon=True).start()
+    deadline = time.monotonic() + main.STARTUP_TIMEOUT
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError('ASGI сервер не запустился')
+        time.sleep(0.05)
+    return server, server.servers[0].sockets[0].getsockname()[1]
+
+
+def run(host: str = '0.0.0.0', port: int = 5000):
+    import uvicorn
+
+    uvicorn.run(app, host=host, port=port, lifespan='on', log_level=os.getenv('LOG_LEVEL', 'INFO').lower())
+
+
+if __name__ == '__main__':
+    logger.info("🚀 Запуск системы 'Твоё право' (асинхронный сервер)...")
+    if NGROK_URL:
+        main.set_webhook()
+    run(port=int(os.getenv('PORT', '5000')))
@@ -0,0 +1,222 @@
+import json
+import asyncio
+import logging
+import functools
+
+from resilience import Deadline, RetryPolicy, call_with_retry_async, is_transient
+
+logger = logging.getLogger(__name__)
+
+# События стрима, после которых run больше не изменится
+RUN_FINAL_EVENTS = {
+    "thread.run.completed": "completed",
+    "thread.run.failed": "failed",
+    "thread.run.cancelled": "cancelled",
+    "thread.run.expired": "expired",
+    "thread.run.incomplete": "incomplete",
+}
+
+
+class AsyncAssistantClient:
+    """Асинхронный клиент OpenAI Assistant на событиях стрима вместо опроса runs.retrieve.
+
+    Каждый запрос ограничен call_timeout и повторяется по retry при временных
+    ошибках; run ограничен run_timeout и отменяется, если не уложился.
+    breaker — общий предохранитель OpenAI (None — без него).
+    """
+
+    def __init__(self, api_key: str, assistant_id: str, executor=None, breaker=None, retry: RetryPolicy = None,
+                 call_timeout: float = 30, run_timeout: float = 90):
+        self.api_key = api_key
+        self.assistant_id = assistant_id
+        # Пул потоков для синхронных обработчиков function calls (None — пул loop по умолчанию)
+        self.executor = executor
+        self.breaker = breaker
+        self.retry = retry or RetryPolicy()
+        self.call_timeout = call_timeout
+        self.run_timeout = run_timeout
+        self._client = None
+
+    @property
+    def client(self):
+        """AsyncOpenAI создаётся лениво — внутри того event loop, где будет работать.
+
+        Повторы SDK выключены: их делает call_with_retry_async с учётом предохранителя.
+        """
+        if self._client is None:
+            # Импорт openai откладывается до первого запроса: он заметно замедляет запуск процесса
+            import openai
+            self._client = openai.AsyncOpenAI(api_key=self.api_key, max_retries=0, timeout=self.call_timeout)
+        return self._client
+
+    async def _call(self, name: str, factory, deadline: Deadline = None):
+        return await call_with_retry_async(
+            factory, self.retry, self.breaker, deadline, self.call_timeout, name=f"OpenAI {name}"
+        )
+
+    async def create_thread(self, messages=None, deadline: Deadline = None) -> str:
+        """Создаёт новый thread (при необходимости сразу с сообщениями) и возвращает его id"""
+        if messages:
+            thread = await self._call('threads.create', lambda: self.client.beta.threads.create(messages=messages),
+                                      deadline)
+        else:
+            thread = await self._call('threads.create', lambda: self.client.beta.threads.create(), deadline)
+        return thread.id
+
+    async def delete_thread(self, thread_id: str):
+        """Удаляет thread"""
+        await self._call('threads.delete', lambda: self.client.beta.threads.delete(thread_id))
+
+    async def add_message(self, thread_id: str, content: str, role: str = "user", deadline: Deadline = None):
+        """Добавляет сообщение в thread (по умолчанию от пользователя)"""
+        await self._call('messages.create', lambda: self.client.beta.threads.messages.create(
+            thread_id=thread_id,
+            role=role,
+            content=content
+        ), deadline)
+
+    async def list_messages(self, thread_id: str):
+        """Возвращает сообщения thread (от новых к старым)"""
+        messages = await self._call('messages.list', lambda: self.client.beta.threads.messages.list(thread_id=thread_id))
+        return messages.data
+
+    async def iter_messages(self, thread_id: str, after: str = None, page_size: int = 100):
+        """Сообщения thread от старых к новым, начиная после after (все страницы)"""
+        params = {"order": "asc", "limit": page_size}
+        if after:
+            params["after"] = after
+        if self.breaker:
+            self.breaker.allow()
+        try:
+            async for message in self.client.beta.threads.messages.list(thread_id=thread_id, **params):
+                yield message
+        except BaseException as e:
+            if self.breaker:
+                if isinstance(e, Exception):
+                    self.breaker.record(e)
+                else:
+                    # Генератор закрыт или задача отменена: пробный вызов не дал результата
+                    self.breaker.release()
+            raise
+        if self.breaker:
+            self.breaker.record_success()
+
+    async def cancel_run(self, thread_id: str, run_id: str):
+        """Отменяет run (ошибки только логируются: run всё равно истечёт на стороне OpenAI)"""
+        try:
+            await asyncio.wait_for(
+                self.client.beta.threads.runs.cancel(run_id, thread_id=thread_id), self.call_timeout
+            )
+            logger.info(f"Run {run_id} в thread {thread_id} отменён")
+        except Exception as e:
+            logger.warning(f"Не удалось отменить run {run_id}: {e}")
+
+    async def run(self, thread_id: str, tool_handler=None, on_delta=None, deadline: Deadline = None, on_usage=None,
+                  **run_kwargs):
+        """Запускает assistant в режиме стрима и ждёт финального события.
+
+        tool_handler(function_name, arguments, tool_call_id) -> dict — синхронный обработчик function calls,
+        выполняется в отдельном потоке, чтобы не блокировать event loop.
+        on_delta(text) — необязательный колбэк для каждого фрагмента ответа.
+        on_usage(usage) — необязательный колбэк с usage завершённого run (prompt_tokens, completion_tokens).
+        deadline — общий срок ответа (по умолчанию run_timeout секунд). Run, не уложившийся
+        в срок или прерванный отменой задачи, отменяется в OpenAI; статус в этом случае 'timeout'.
+        Возвращает (status, text).
+        """
+        deadline = deadline or Deadline(self.run_timeout)
+        run_ref = {}
+        # Повтор безопасен, только пока run не создан: иначе assistant ответил бы дважды
+        policy = RetryPolicy(self.retry.attempts, self.retry.base_delay, self.retry.max_delay,
+                             retry_if=lambda e: 'id' not in run_ref and is_transient(e))
+        try:
+            result = await call_with_retry_async(
+                lambda: self._stream_run(thread_id, run_ref, tool_handler, on_delta, run_kwargs),
+                policy, self.breaker, deadline, name='OpenAI runs.stream'
+            )
+            if on_usage and run_ref.get('usage'):
+                on_usage(run_ref['usage'])
+            return result
+        except TimeoutError:
+            logger.error(f"Run в thread {thread_id} не завершился за отведённое время")
+            if 'id' in run_ref:
+                await self.cancel_run(thread_id, run_ref['id'])
+            return 'timeout', None
+        except asyncio.CancelledError:
+            # Запрос отменён (клиент не дождался) — run не должен работать впустую
+            if 'id' in run_ref:
+                asyncio.get_running_loop().create_task(self.cancel_run(thread_id, run_ref['id']))
+            raise
+
+    async def _stream_run(self, thread_id: str, run_ref: dict, tool_handler, on_delta, run_kwargs):
+        """Один стрим run; id созданного run записывается в run_ref['id']"""
+        stream_manager = self.client.beta.threads.runs.stream(
+            thread_id=thread_id,
+            assistant_id=self.assistant_id,
+            **run_kwargs
+        )
+        status = None
+        parts = []
+        final_text = None
+
+        # После requires_action сервер закрывает стрим, продолжение идёт
+        # через submit_tool_outputs_stream — поэтому цикл по менеджерам стрима
+        while stream_manager is not None:
+            next_manager = None
+            async with stream_manager as stream:
+                async for event in stream:
+                    if event.event == "thread.run.created":
+                        run_ref['id'] = event.data.id
+
+                    elif event.event == "thread.message.delta":
+                        for content in event.data.delta.content or []:
+                            if content.type == "text" and content.text and content.text.value:
+                                parts.append(content.text.value)
+                                if on_delta:
+                                    await on_delta(content.text.value)
+
+                    elif event.event == "thread.message.completed":
+                        message = event.data
+                        if message.role == "assistant" and message.content:
+                            final_text = message.content[0].text.value
+
+                    elif event.event == "thread.run.requires_action":
+                        run = event.data
+                        run_ref['id'] = run.id
+                        tool_calls = run.required_action.submit_tool_outputs.tool_calls
+                        logger.info("🔧 OpenAI требует выполнения функций: %d", len(tool_calls))
+                        tool_outputs = []
+                        for tool_call in tool_calls:
+                            function_name = tool_call.function.name
+                            arguments = json.loads(tool_call.function.arguments)
+                            logger.info("OpenAI вызывает функцию: %s", function_name)
+                            logger.debug("Аргументы функции %s: %s", function_name, arguments)
+                            if tool_handler:
+                                result = await asyncio.get_running_loop().run_in_executor(
+                                    self.executor, functools.partial(tool_handler, function_name, arguments, tool_call.id)
+                                )
+                            else:
+                                result = {"success": False, "message": f"Функция {function_name} не поддерживается"}
+                            tool_outputs.append({
+                                "tool_call_id": tool_call.id,
+                                "output": json.dumps(result)
+                            })
+                        next_manager = self.client.beta.threads.runs.submit_tool_outputs_stream(
+                            thread_id=thread_id,
+                            run_id=run.id,
+                            tool_outputs=tool_outputs
+                        )
+
+                    elif event.event in RUN_FINAL_EVENTS:
+                        status = RUN_FINAL_EVENTS[event.event]
+                        run_ref['usage'] = getattr(event.data, 'usage', None)
+
+                    elif event.event == "error":
+                        logger.error(f"Ошибка стрима OpenAI: {event.data}")
+                        status = "failed"
+
+            stream_manager = next_manager
+
+        logger.info("🏁 OpenAI завершен со статусом: %s", status)
+        if final_text is None and parts:
+            final_text = "".join(parts)
+        return status, final_text
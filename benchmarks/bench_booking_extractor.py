@@ -0,0 +1,141 @@
+"""Бенчмарк извлечения данных записи из переписки с Assistant.
+
+Запуск: python benchmarks/bench_booking_extractor.py
+Сравнивает прежний разбор (все сообщения thread при каждом срабатывании)
+с инкрементальным (только новые сообщения после сохранённого id) на длинной
+переписке и проверяет, что на наборе диалогов оба дают одинаковый результат.
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from booking_extractor import BookingExtraction, feed_messages  # noqa: E402
+
+MESSAGES = 2000  # длина переписки (сообщений пользователя)
+TRIGGER_EVERY = 20  # как часто Assistant говорит «сохраню вашу запись»
+
+PHRASES = [
+    'Да, хочу записаться', 'Иван Петров', '+7 900 123-45-67', 'Нужна консультация по трудовому спору',
+    '25.12.2025 15:00', 'Паспорт и трудовой договор', 'Меня уволили без выходного пособия',
+    'да', 'нет', 'Можно пораньше?', '15 декабря', 'Справка о доходах', 'Представительство в суде',
+    'Спасибо', 'Анна', '8 (912) 000 11 22', 'Хочу обсудить раздел имущества', 'ок',
+]
+
+
+class Text:
+    def __init__(self, value):
+        self.value = value
+
+
+class Content:
+    type = 'text'
+
+    def __init__(self, value):
+        self.text = Text(value)
+
+
+class Message:
+    """Сообщение thread в форме ответа OpenAI (id, role, content)"""
+
+    def __init__(self, message_id, role, text):
+        self.id = message_id
+        self.role = role
+        self.content = [Content(text)]
+
+
+def legacy_extract(messages):
+    """Прежний extract_booking_data_from_thread (без логирования): полный разбор при каждом вызове"""
+    user_messages = []
+    for msg in reversed(messages):
+        if msg.role == "user":
+            user_messages.append(msg.content[0].text.value)
+    booking_data = {'name': '', 'phone': '', 'service': '', 'date': '', 'documents': 'нет', 'comment': 'нет',
+                    'source': 'Виджет'}
+    for msg in user_messages:
+        msg_lower = msg.lower().strip()
+        if not booking_data['name'] and not any(char.isdigit() for char in msg) and len(msg.split()) <= 3:
+            if msg_lower not in ['да', 'нет', 'да, хочу записаться', 'хочу записаться', 'записаться']:
+                booking_data['name'] = msg.strip()
+        if not booking_data['phone'] and any(char.isdigit() for char in msg) and len(msg) >= 7:
+            digits = ''.join(filter(str.isdigit, msg))
+            if len(digits) >= 7:
+                booking_data['phone'] = msg.strip()
+        if not booking_data['date'] and any(char.isdigit() for char in msg):
+            if any(pattern in msg_lower for pattern in ['.', '/', 'ноябр', 'декабр', 'январ', 'февр', 'март', 'апрел',
+                                                        'май', 'июн', 'июл', 'август', 'сентябр', 'октябр']):
+                booking_data['date'] = msg.strip()
+        if not booking_data['service'] and len(msg) > 10:
+            if not any(char.isdigit() for char in msg) or 'консультация' in msg_lower or 'адвокат' in msg_lower or 'суд' in msg_lower:
+                if msg_lower not in ['да, хочу записаться', 'хочу записаться']:
+                    booking_data['service'] = msg.strip()
+    for msg in user_messages:
+        msg_lower = msg.lower().strip()
+        if (msg != booking_data['name'] and msg != booking_data['phone'] and
+                msg != booking_data['service'] and msg != booking_data['date']):
+            if ('паспорт' in msg_lower or 'документ' in msg_lower or 'справк' in msg_lower or
+                    'свидетельство' in msg_lower or 'удостовер' in msg_lower):
+                booking_data['documents'] = msg.strip()
+            elif len(msg) > 3 and msg_lower not in ['да', 'нет', 'да, хочу записаться', 'хочу записаться']:
+                if booking_data['comment'] == 'нет':
+                    booking_data['comment'] = msg.strip()
+                else:
+                    booking_data['comment'] += f"; {msg.strip()}"
+    if booking_data['name'] and booking_data['phone']:
+        return booking_data
+    return None
+
+
+def conversation(rng, length):
+    """Переписка от старых к новым: сообщения пользователя чередуются с ответами assistant"""
+    messages = []
+    for i in range(length):
+        messages.append(Message(f"msg_{2 * i}", 'user', rng.choice(PHRASES)))
+        messages.append(Message(f"msg_{2 * i + 1}", 'assistant', 'Понял, продолжим.'))
+    return messages
+
+
+def main():
+    rng = random.Random(7)
+
+    # Совпадение результатов на случайных диалогах
+    mismatches = 0
+    for _ in range(500):
+        messages = conversation(rng, rng.randint(1, 12))
+        incremental = BookingExtraction()
+        for start in range(0, len(messages), 4):
+            state = incremental.to_dict()
+            incremental = feed_messages(BookingExtraction(state), messages[start:start + 4])
+        if incremental.result() != legacy_extract(list(reversed(messages))):
+            mismatches += 1
+
+    # Длинная переписка: срабатывание каждые TRIGGER_EVERY сообщений пользователя
+    messages = conversation(rng, MESSAGES)
+    step = TRIGGER_EVERY * 2
+
+    t0 = time.perf_counter()
+    for end in range(step, len(messages) + 1, step):
+        legacy_extract(list(reversed(messages[:end])))
+    legacy_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    state = None
+    for end in range(step, len(messages) + 1, step):
+        extraction = BookingExtraction(state)
+        feed_messages(extraction, messages[end - step:end])
+        extraction.result()
+        state = extraction.to_dict()
+    incremental_s = time.perf_counter() - t0
+
+    triggers = len(messages) // step
+    print(f"Совпадение с прежним разбором: {500 - mismatches}/500 диалогов")
+    print(f"Переписка {MESSAGES} сообщений пользователя, {triggers} срабатываний:")
+    print(f"  прежний (полный разбор):   {legacy_s * 1000:8.1f} мс, {legacy_s / triggers * 1000:6.2f} мс на срабатывание")
+    print(f"  инкрементальный:           {incremental_s * 1000:8.1f} мс, "
+          f"{incremental_s / triggers * 1000:6.2f} мс на срабатывание")
+
+
+if __name__ == '__main__':
+    main()
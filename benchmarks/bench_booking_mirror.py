@@ -0,0 +1,155 @@
+"""Бенчмарк копии таблицы заявок (booking_mirror.py).
+
+Запуск: python benchmarks/bench_booking_mirror.py --rows 100000 [--sheets]
+Показывает время полной загрузки копии и дочитывания новых строк,
+задержку поиска по телефону, списков на день и на неделю по индексам
+по сравнению с просмотром всех строк. С --sheets строки читаются через
+заглушку Google Sheets (fake_services.py) тем же кодом, что и в сервисе:
+полное чтение таблицы против чтения только новых строк по номеру.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from booking_mirror import BookingMirror  # noqa: E402
+from booking_dedup import normalize_phone  # noqa: E402
+from slot_calendar import parse_slot  # noqa: E402
+
+NOW = datetime(2024, 12, 20, 12, 0)
+SERVICES = ('Консультация', 'Развод', 'Наследство', 'Трудовой спор', 'Жилищный вопрос')
+SOURCES = ('Телеграм', 'Виджет')
+ROUNDS = 2000
+NEW_ROWS = 100
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def timed(func, args_list) -> list:
+    timings = []
+    for args in args_list:
+        t0 = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - t0) * 1000)
+    return timings
+
+
+def report(title: str, timings: list):
+    print(f"  {title:<36} p50 {statistics.median(timings):9.4f} мс, p95 {percentile(timings, 0.95):9.4f} мс")
+
+
+def make_rows(count: int, rng: random.Random) -> list:
+    """Заголовок и count заявок: ~count/3 клиентов, записи в рабочее время на год вперёд"""
+    phones = [f"+7 9{rng.randrange(10 ** 9):09d}" for _ in range(max(1, count // 3))]
+    rows = [['Имя', 'Телефон', 'Услуга', 'Дата', 'Документы', 'Комментарий', 'Источник', 'Создана']]
+    for index in range(count):
+        day = NOW.date() + timedelta(days=rng.randrange(365))
+        rows.append([f"Клиент {index}", rng.choice(phones), rng.choice(SERVICES),
+                     f"{day:%d.%m.%Y} {rng.randrange(10, 19)}:00", 'нет', '', rng.choice(SOURCES),
+                     NOW.strftime('%Y-%m-%d %H:%M:%S')])
+    return rows
+
+
+def row_slot(row: list):
+    return parse_slot(row[3], NOW) if len(row) > 3 else None
+
+
+def bench_memory(rows: list, rng: random.Random):
+    table = rows[:-NEW_ROWS]
+    mirror = BookingMirror(lambda start: table[start - 1:], row_slot)
+
+    t0 = time.perf_counter()
+    mirror.sync()
+    full_ms = (time.perf_counter() - t0) * 1000
+    table = rows
+    t0 = time.perf_counter()
+    added = mirror.sync()
+    incremental_ms = (time.perf_counter() - t0) * 1000
+    stats = mirror.stats()
+    print(f"Строк: {stats['rows']}, телефонов: {stats['phones']}, дат: {stats['dates']}")
+    print(f"  полная загрузка и индексы            {full_ms:9.1f} мс")
+    print(f"  дочитывание {added} новых строк         {incremental_ms:9.1f} мс")
+
+    # Те же запросы без индекса: просмотр всех строк (как при чтении таблицы целиком)
+    slots = [row_slot(row) for row in rows]
+
+    def linear_phone(phone):
+        phone = normalize_phone(phone)
+        return [row for row in rows if len(row) > 1 and normalize_phone(row[1]) == phone]
+
+    def linear_day(day):
+        return [row for row, slot in zip(rows, slots) if slot is not None and slot.date() == day]
+
+    phones = [(rng.choice(rows[1:])[1],) for _ in range(ROUNDS)]
+    days = [(NOW.date() + timedelta(days=rng.randrange(365)),) for _ in range(ROUNDS)]
+    few = max(1, ROUNDS // 200)
+    print()
+    report('поиск по телефону (индекс)', timed(mirror.find_phone, phones))
+    report('записи на день (индекс)', timed(mirror.on_date, days))
+    report('записи на неделю (индекс)', timed(lambda day: mirror.between(day, 7), days))
+    report('поиск по телефону (все строки)', timed(linear_phone, phones[:few]))
+    report('записи на день (все строки)', timed(linear_day, days[:few]))
+
+
+def bench_sheets(rows: list):
+    """Чтение строк через клиент Google Sheets сервиса и заглушку API"""
+    from fake_services import FakeTelegram, FakeOpenAI, FakeSheets, fake_environment
+
+    sheets = FakeSheets(latency=0.0, rows=rows[:-NEW_ROWS]).start()
+    workdir = tempfile.mkdtemp(prefix='bench_mirror_')
+    os.environ.update(fake_environment(FakeTelegram().start(), FakeOpenAI().start(), sheets))
+    os.environ.update({
+        'SHEETS_SPOOL_PATH': os.path.join(workdir, 'sheets_spool.db'),
+        'SESSION_DB_PATH': os.path.join(workdir, 'sessions.db'),
+        'BOOKING_DEDUP_PATH': os.path.join(workdir, 'booking_dedup.db'),
+        'RATE_LIMIT_DB_PATH': os.path.join(workdir, 'rate_limits.db'),
+        'THREAD_POOL_SIZE': '0',
+        'LOG_LEVEL': 'WARNING',
+    })
+    import functions
+
+    functions.sheets_client.get()
+    mirror = BookingMirror(functions.read_sheet_rows_from, functions.booking_row_slot, functions.booking_row_date)
+    t0 = time.perf_counter()
+    mirror.sync()
+    full_ms = (time.perf_counter() - t0) * 1000
+    with sheets.lock:
+        sheets.rows.extend(rows[-NEW_ROWS:])
+    t0 = time.perf_counter()
+    added = mirror.sync()
+    incremental_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    functions.read_sheet_rows_from(1)
+    read_ms = (time.perf_counter() - t0) * 1000
+    print(f"\nЧерез API Google Sheets (заглушка), строк {mirror.size}:")
+    print(f"  полная загрузка копии                {full_ms:9.1f} мс")
+    print(f"  дочитывание {added} новых строк         {incremental_ms:9.1f} мс")
+    print(f"  чтение всей таблицы (прежний способ) {read_ms:9.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='строк заявок в таблице')
+    parser.add_argument('--sheets', action='store_true', help='также замерить чтение через заглушку Google Sheets')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    rows = make_rows(args.rows, rng)
+    bench_memory(rows, rng)
+    if args.sheets:
+        bench_sheets(rows)
+
+
+if __name__ == '__main__':
+    main()
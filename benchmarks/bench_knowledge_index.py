@@ -0,0 +1,97 @@
+"""Бенчмарк быстрого ответа из базы знаний.
+
+Запуск: python benchmarks/bench_knowledge_index.py
+Показывает точность уверенных ответов на фиксированном наборе вопросов,
+задержку поиска (p50/p95) и время полной и инкрементальной перестройки индекса.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_index import KnowledgeIndex  # noqa: E402
+
+KNOWLEDGE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'knowledge.txt')
+
+# (вопрос пользователя, ожидаемый вопрос FAQ или None — должен уйти в Assistant)
+QUESTIONS = [
+    ("Сколько стоит консультация?", "Сколько стоит консультация?"),
+    ("подскажите сколько стоят консультации", "Сколько стоит консультация?"),
+    ("Сколько по времени длится консультация", "Сколько длится консультация?"),
+    ("можно получить консультацию дистанционно?", "Можно ли получить консультацию дистанционно?"),
+    ("Есть рассрочка?", "Есть ли рассрочка?"),
+    ("Вы берете уголовные дела?", "Берёте уголовные дела?"),
+    ("Нужна ли доверенность", "Нужно ли оформлять доверенность?"),
+    ("Какие документы нужно подготовить к первой встрече?", "Какие документы подготовить к первой встрече?"),
+    ("Вы гарантируете результат?", None),
+    ("Можно гарантировать результат?", "Можно ли гарантировать результат?"),
+    ("Работаете в других регионах?", "Вы работаете в других регионах?"),
+    ("Возможен возврат гонорара?", "Возможен ли возврат гонорара?"),
+    ("Что делать при обыске", "Что делать при задержании или обыске?"),
+    ("Меня уволили без выходного пособия, что делать?", None),
+    ("Сосед затопил квартиру, как взыскать ущерб?", None),
+    ("Хочу записаться на завтра в 15:00", None),
+    ("Меня зовут Иван", None),
+    ("Да", None),
+    ("Как развестись, если муж против?", None),
+    ("Можно ли оспорить завещание?", None),
+]
+
+ROUNDS = 200
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    started = time.perf_counter()
+    index = KnowledgeIndex(KNOWLEDGE_FILE)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    correct = 0
+    for question, expected in QUESTIONS:
+        section = index.answer(question)
+        got = section.question if section else None
+        ok = got == expected
+        correct += ok
+        print(f"{'OK ' if ok else 'ERR'} {question!r} -> {got!r}")
+
+    timings = []
+    for _ in range(ROUNDS):
+        for question, _ in QUESTIONS:
+            t0 = time.perf_counter()
+            index.answer(question)
+            timings.append((time.perf_counter() - t0) * 1000)
+
+    # Инкрементальная перестройка: меняем один раздел во временной копии файла
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        tmp_path = os.path.join(tmp_dir, 'knowledge.txt')
+        shutil.copy(KNOWLEDGE_FILE, tmp_path)
+        tmp_index = KnowledgeIndex(tmp_path)
+        with open(tmp_path, encoding='utf-8') as f:
+            text = f.read()
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text.replace('Обычно 45–60 минут.', 'Обычно около часа.', 1))
+        t0 = time.perf_counter()
+        tmp_index.refresh(force=True)
+        rebuild_ms = (time.perf_counter() - t0) * 1000
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print()
+    print(f"Точность: {correct}/{len(QUESTIONS)}")
+    print(f"Построение индекса: {build_ms:.2f} мс, разделов: {index.stats()['sections']}")
+    print(f"Инкрементальная перестройка (1 раздел): {rebuild_ms:.2f} мс")
+    print(f"Поиск: p50 {statistics.median(timings):.3f} мс, p95 {percentile(timings, 0.95):.3f} мс, "
+          f"max {max(timings):.3f} мс ({len(timings)} запросов)")
+
+
+if __name__ == '__main__':
+    main()
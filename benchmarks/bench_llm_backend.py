@@ -0,0 +1,99 @@
+"""Бенчмарк бэкендов модели ответа (llm_backend.py).
+
+Запуск: python benchmarks/bench_llm_backend.py --dialogs 5 --turns 12
+Одни и те же диалоги проходят через get_assistant_response_async с каждым
+бэкендом (LLM_BACKEND): Assistants API, Chat Completions и локальная заглушка.
+OpenAI заменён заглушкой (fake_services.py) с задержкой каждого HTTP вызова
+(--api-latency) и временем ответа, растущим с числом не закэшированных токенов
+контекста (--context-latency на 1000 токенов). Показываются HTTP вызовы
+к OpenAI на ответ, задержка ответа и доля токенов контекста из кэша префиксов.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fake_services import FakeTelegram, FakeOpenAI, FakeSheets, fake_environment  # noqa: E402
+
+QUESTIONS = (
+    'Здравствуйте, как подать на развод, если есть общий ребёнок?',
+    'Сколько стоит консультация?',
+    'Какие документы нужны для раздела имущества?',
+    'Можно ли оспорить завещание через год после открытия наследства?',
+    'Работодатель не платит зарплату второй месяц, что делать?',
+    'Сколько длится рассмотрение дела в суде?',
+)
+BACKENDS = ('assistants', 'chat', 'fake')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def dialogs(functions, count: int, turns: int) -> list:
+    """Проходит count диалогов по turns вопросов; возвращает время ответов, мс"""
+    timings = []
+    for dialog in range(count):
+        thread_id = None
+        for turn in range(turns):
+            message = f"{QUESTIONS[(dialog + turn) % len(QUESTIONS)]} (№{turn})"
+            started = time.perf_counter()
+            _, thread_id = await functions.get_assistant_response_async(message, thread_id, 'Виджет')
+            timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dialogs', type=int, default=5, help='диалогов на бэкенд')
+    parser.add_argument('--turns', type=int, default=12, help='вопросов в диалоге')
+    parser.add_argument('--api-latency', type=float, default=0.03, help='задержка HTTP вызова OpenAI, сек')
+    parser.add_argument('--run-latency', type=float, default=0.3, help='время до первого фрагмента ответа, сек')
+    parser.add_argument('--context-latency', type=float, default=0.02,
+                        help='добавка на 1000 не закэшированных токенов контекста, сек')
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='бэкенды через запятую')
+    args = parser.parse_args()
+
+    openai = FakeOpenAI(run_latency=args.run_latency, api_latency=args.api_latency, chunks=10, chunk_delay=0,
+                        context_latency=args.context_latency).start()
+    workdir = tempfile.mkdtemp(prefix='bench_llm_backend_')
+    os.environ.update(fake_environment(FakeTelegram().start(), openai, FakeSheets(latency=0.0).start()))
+    os.environ.update({
+        'SHEETS_SPOOL_PATH': os.path.join(workdir, 'sheets_spool.db'),
+        'SESSION_DB_PATH': os.path.join(workdir, 'sessions.db'),
+        'BOOKING_DEDUP_PATH': os.path.join(workdir, 'booking_dedup.db'),
+        'RATE_LIMIT_DB_PATH': os.path.join(workdir, 'rate_limits.db'),
+        'THREAD_POOL_SIZE': '0',
+        'ANSWER_CACHE_SIZE': '0',
+        'FAQ_FAST_PATH': '0',
+        'LOG_LEVEL': 'WARNING',
+    })
+    os.chdir(os.path.dirname(BENCH_DIR))  # промпт.txt и knowledge.txt
+    import functions
+
+    answers = args.dialogs * args.turns
+    print(f"Диалогов: {args.dialogs} по {args.turns} вопросов, задержка вызова OpenAI {args.api_latency * 1000:.0f} мс\n")
+    for kind in args.backends.split(','):
+        functions.assistant_client = functions.create_llm_backend(kind)
+        with openai.lock:
+            openai.counts.clear()
+        timings = asyncio.run(dialogs(functions, args.dialogs, args.turns))
+        calls = sum(count for name, count in openai.counts.items() if name not in ('tool_calls', 'streams_aborted'))
+        print(f"{kind:<11} вызовов OpenAI на ответ {calls / answers:4.1f}, ответ p50 {statistics.median(timings):6.0f} мс, "
+              f"p95 {percentile(timings, 0.95):6.0f} мс")
+        stats = functions.llm_backend_health()
+        if stats.get('cache_hit_ratio') is not None:
+            print(f"{'':<11} токенов контекста {stats['prompt_tokens'] // stats['requests']} на запрос, "
+                  f"из кэша префиксов {stats['cache_hit_ratio'] * 100:.0f}%")
+
+
+if __name__ == '__main__':
+    main()
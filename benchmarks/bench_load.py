@@ -0,0 +1,279 @@
+"""Нагрузочный бенчмарк /webhook, /api/chat, /api/chat/stream и /api/booking без внешних сервисов.
+
+Запуск: python benchmarks/bench_load.py --concurrency 16 --requests 200
+Поднимает заглушки Telegram, OpenAI Assistants и Google Sheets (fake_services.py),
+запускает сервис из main.py в этом же процессе (werkzeug, многопоточный режим;
+--server asgi — асинхронный сервер asgi.py) и показывает p50/p95/p99 задержки и запросы в секунду по каждому сценарию.
+
+Внешний сервис (например, gunicorn с переменными из fake_services.py):
+    python benchmarks/bench_load.py --url http://127.0.0.1:5000
+Результаты можно сохранить (--json) и сравнить до и после изменений main.py/functions.py.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import itertools
+import threading
+import statistics
+from datetime import date, timedelta
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_services import add_arguments, start_fakes, fake_environment  # noqa: E402
+
+SCENARIOS = ('webhook', 'chat', 'chat_stream', 'booking')
+
+# Вопросы, которых нет в базе знаний: ответ идёт через Assistant
+QUESTIONS = [
+    'Меня уволили без выходного пособия, что делать?',
+    'Сосед затопил квартиру, как взыскать ущерб?',
+    'Как развестись, если муж против?',
+    'Можно ли оспорить завещание?',
+    'Банк списал деньги без моего согласия, куда обращаться?',
+    'Работодатель не платит зарплату третий месяц',
+]
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def booking_slot(n: int) -> str:
+    """n-е свободное время записи: по часу с 10 до 19 в будни, начиная через месяц"""
+    day = date.today() + timedelta(days=30)
+    day -= timedelta(days=day.weekday())
+    week, rest = divmod(n, 45)
+    day += timedelta(weeks=week, days=rest // 9)
+    return f"{day:%d.%m.%Y} {10 + rest % 9}:00"
+
+
+class Scenario:
+    """Один сценарий нагрузки: request(session, worker, i) -> True при успешном ответе"""
+
+    def __init__(self, base_url: str, followup: float):
+        self.base_url = base_url
+        self.followup = followup
+        self.update_ids = itertools.count(1)
+        self.booking_ids = itertools.count()
+        self.threads = {}  # worker -> thread_id последнего диалога
+
+    def webhook(self, session, worker, i):
+        user_id = 10_000_000 + worker * 100_000 + i
+        update_id = next(self.update_ids)
+        update = {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id, 'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+                'text': QUESTIONS[i % len(QUESTIONS)],
+            },
+        }
+        response = session.post(f"{self.base_url}/webhook", json=update, timeout=60)
+        return response.status_code == 200
+
+    def _chat_payload(self, worker, i):
+        payload = {'message': QUESTIONS[i % len(QUESTIONS)]}
+        thread_id = self.threads.get(worker)
+        if thread_id and (i * 0.618) % 1 < self.followup:
+            payload['thread_id'] = thread_id
+        return payload
+
+    def chat(self, session, worker, i):
+        response = session.post(f"{self.base_url}/api/chat", json=self._chat_payload(worker, i), timeout=150)
+        if response.status_code != 200:
+            return False
+        data = response.json()
+        self.threads[worker] = data.get('thread_id')
+        return bool(data.get('response')) or data.get('merged')
+
+    def chat_stream(self, session, worker, i):
+        with session.post(f"{self.base_url}/api/chat/stream", json=self._chat_payload(worker, i),
+                          stream=True, timeout=150) as response:
+            if response.status_code != 200:
+                return False
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith('event: '):
+                    event = line[7:]
+                elif line.startswith('data: ') and event == 'thread_id':
+                    self.threads[worker] = json.loads(line[6:]).get('thread_id')
+                elif line.startswith('data: ') and event in ('done', 'error'):
+                    return event == 'done'
+        return False
+
+    def booking(self, session, worker, i):
+        response = session.post(f"{self.base_url}/api/booking", json={
+            'name': f'Клиент {worker}-{i}',
+            'phone': f'+7 900 {worker:03d}-{i % 100:02d}-{i // 100 % 100:02d}',
+            'service': 'Правовая консультация',
+            # Каждая заявка — на своё время, иначе календарь записи отклонит её как занятую
+            'date': booking_slot(next(self.booking_ids)),
+            'documents': 'паспорт',
+            'comment': 'бенчмарк',
+        }, timeout=60)
+        return response.status_code == 200
+
+
+def run_scenario(request, concurrency: int, total: int) -> dict:
+    counter = itertools.count()
+    lock = threading.Lock()
+    timings = []
+    errors = [0]
+
+    def worker(index):
+        session = requests.Session()
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            t0 = time.perf_counter()
+            try:
+                ok = request(session, index, i)
+            except requests.RequestException:
+                ok = False
+            elapsed = (time.perf_counter() - t0) * 1000
+            with lock:
+                timings.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    duration = time.perf_counter() - started
+
+    timings.sort()
+    return {
+        'requests': len(timings),
+        'errors': errors[0],
+        'duration_s': round(duration, 3),
+        'rps': round(len(timings) / duration, 1),
+        'p50_ms': round(statistics.median(timings), 1),
+        'p95_ms': round(percentile(timings, 0.95), 1),
+        'p99_ms': round(percentile(timings, 0.99), 1),
+        'max_ms': round(timings[-1], 1),
+    }
+
+
+def start_local_service(fakes, args) -> str:
+    """Запускает сервис из main.py в этом процессе с заглушками вместо внешних API"""
+    workdir = tempfile.mkdtemp(prefix='bench_load_')
+    os.environ.update(fake_environment(*fakes))
+    os.environ.update({
+        'SHEETS_SPOOL_PATH': os.path.join(workdir, 'sheets_spool.db'),
+        'SESSION_DB_PATH': os.path.join(workdir, 'sessions.db'),
+        'CONVERSATION_DB_PATH': os.path.join(workdir, 'conversations.db'),
+        'BOOKING_DEDUP_PATH': os.path.join(workdir, 'booking_dedup.db'),
+        'RATE_LIMIT_DB_PATH': os.path.join(workdir, 'rate_limits.db'),
+        'SHEETS_WRITE_MODE': args.sheets_mode,
+        'WEBHOOK_MODE': args.webhook_mode,
+        # Кэш и быстрые ответы FAQ выключены, чтобы каждый вопрос доходил до Assistant
+        'ANSWER_CACHE_SIZE': os.getenv('ANSWER_CACHE_SIZE', '0'),
+        'FAQ_FAST_PATH': os.getenv('FAQ_FAST_PATH', '0'),
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+    })
+    # Все запросы идут с 127.0.0.1: лимиты клиентов по умолчанию не мешают замеру
+    for name in ('CHAT_RATE_PER_IP_PER_MIN', 'CHAT_BURST_PER_IP', 'CHAT_RATE_PER_THREAD_PER_MIN',
+                 'CHAT_BURST_PER_THREAD', 'TELEGRAM_RATE_PER_USER_PER_MIN', 'TELEGRAM_BURST_PER_USER'):
+        os.environ.setdefault(name, '1000000')
+    os.chdir(ROOT_DIR)
+
+    import logging
+    import main
+
+    if args.server == 'asgi':
+        import asgi
+        _, port = asgi.serve_in_thread('127.0.0.1', 0)
+        return f"http://127.0.0.1:{port}"
+
+    from werkzeug.serving import make_server
+
+    # Журнал запросов werkzeug в замере не нужен
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    main.start_worker()
+    server = make_server('127.0.0.1', 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-flask', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def wait_ready(base_url: str, timeout: float = 60):
+    """Ждёт готовности сервиса (/ready), чтобы прогрев при запуске не попал в замер"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = requests.get(f"{base_url}/ready", timeout=5)
+            if response.status_code in (200, 404):
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    print(f"Сервис не готов за {timeout:.0f} с, замер начинается без готовности", flush=True)
+
+
+def wait_background(timeout: float = 60):
+    """Ждёт фоновые ответы Assistant (после /webhook), чтобы они не влияли на следующий сценарий"""
+    if 'main' not in sys.modules:
+        return
+    from functions import assistant_pool
+    deadline = time.monotonic() + timeout
+    while assistant_pool.stats()['pending'] and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='адрес уже запущенного сервиса (по умолчанию сервис запускается здесь)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"через запятую из: {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help='запросов на сценарий')
+    parser.add_argument('--followup', type=float, default=0.5, help='доля сообщений чата в существующий thread')
+    parser.add_argument('--webhook-mode', default='sync', choices=('sync', 'ack'))
+    parser.add_argument('--sheets-mode', default='spool', choices=('spool', 'direct'))
+    parser.add_argument('--server', default='flask', choices=('flask', 'asgi'),
+                        help='flask — main.app в werkzeug, asgi — asgi.app в uvicorn')
+    parser.add_argument('--json', help='сохранить результаты в файл JSON')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    fakes = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        fakes = start_fakes(args)
+        base_url = start_local_service(fakes, args)
+    wait_ready(base_url)
+
+    results = {}
+    for name in args.scenarios.split(','):
+        scenario = Scenario(base_url, args.followup)
+        results[name] = run_scenario(getattr(scenario, name), args.concurrency, args.requests)
+        wait_background()
+        r = results[name]
+        print(f"{name:<12} {r['requests']:>5} запр., ошибок {r['errors']:>4}, {r['rps']:>7.1f} запр/с, "
+              f"p50 {r['p50_ms']:>7.1f} мс, p95 {r['p95_ms']:>7.1f} мс, p99 {r['p99_ms']:>7.1f} мс, "
+              f"max {r['max_ms']:>7.1f} мс", flush=True)
+
+    if fakes:
+        for fake in fakes:
+            print(f"{type(fake).__name__}: {fake.counts}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
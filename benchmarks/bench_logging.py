@@ -0,0 +1,119 @@
+"""Бенчмарк накладных расходов логирования на горячем пути webhook.
+
+Запуск: python benchmarks/bench_logging.py
+Имитирует логирование одного Telegram update (как в main.webhook и обработчиках)
+и показывает время, которое тратит вызывающий поток на запрос: прежний вариант
+(f-строки и полный update на INFO, синхронный StreamHandler) и новый
+(ленивое форматирование, очередь, payload выключен или выборка).
+"""
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from structured_logging import (  # noqa: E402
+    DeferredQueueHandler, JsonFormatter, LogSettings, RequestIdFilter, TEXT_FORMAT, request_id_var
+)
+from logging.handlers import QueueListener  # noqa: E402
+
+ROUNDS = 20000
+
+UPDATE = {
+    'update_id': 123456789,
+    'message': {
+        'message_id': 42,
+        'from': {'id': 1001, 'is_bot': False, 'first_name': 'Иван', 'username': 'ivan', 'language_code': 'ru'},
+        'chat': {'id': 1001, 'first_name': 'Иван', 'username': 'ivan', 'type': 'private'},
+        'date': 1760000000,
+        'text': 'Здравствуйте, меня уволили без выходного пособия, что делать? ' * 3,
+    },
+}
+USER_DATA = {'name': 'Иван', 'phone': '+7 900 000-00-00', 'service': 'Правовая консультация'}
+
+
+def make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def before(logger, data):
+    """Логирование update до изменений: всё на INFO, f-строки"""
+    logger.info('Telegram webhook получил запрос')
+    logger.info(f'Webhook данные: {data}')
+    message = data['message']['text']
+    logger.info(f"🔍 DEBUG: получено сообщение от user_id={data['message']['from']['id']}, text='{message}'")
+    logger.info(f"🔍 DEBUG: состояние context.user_data={USER_DATA}")
+    logger.info(f"💬 Консультация от user_id={data['message']['from']['id']}, message='{message}'")
+    logger.info('Update обработан успешно')
+
+
+def after(logger, data, settings):
+    """Логирование update после изменений: ленивые аргументы, payload под переключателем"""
+    logger.debug('Telegram webhook получил запрос')
+    if settings.payload():
+        logger.info('Webhook данные: %s', data)
+    if logger.isEnabledFor(logging.DEBUG) and settings.payload():
+        logger.debug("🔍 DEBUG: получено сообщение от user_id=%s, text='%s'",
+                     data['message']['from']['id'], data['message']['text'])
+    logger.info('💬 Консультация от user_id=%s', data['message']['from']['id'])
+    if settings.payload():
+        logger.info("Вопрос user_id=%s: '%s'", data['message']['from']['id'], data['message']['text'])
+    logger.debug('Update обработан успешно')
+
+
+def measure(func, *args):
+    timings = []
+    for i in range(ROUNDS):
+        request_id_var.set(f"tg-{i}")
+        t0 = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - t0) * 1e6)
+    return timings
+
+
+def report(title, timings):
+    timings.sort()
+    print(f"{title:<48} p50 {statistics.median(timings):7.2f} мкс, "
+          f"p99 {timings[int(len(timings) * 0.99)]:8.2f} мкс, среднее {statistics.fmean(timings):7.2f} мкс")
+
+
+def queued(name, formatter):
+    output = logging.StreamHandler(open(os.devnull, 'w', encoding='utf-8'))
+    output.setFormatter(formatter)
+    handler = DeferredQueueHandler(queue.Queue(maxsize=ROUNDS * 10))
+    handler.addFilter(RequestIdFilter())
+    listener = QueueListener(handler.queue, output)
+    listener.start()
+    return make_logger(name, handler), listener
+
+
+def main():
+    devnull = open(os.devnull, 'w', encoding='utf-8')
+    sync_handler = logging.StreamHandler(devnull)
+    sync_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    report('до: синхронный вывод, f-строки', measure(before, make_logger('bench.before', sync_handler), UPDATE))
+
+    off = LogSettings(payloads=False)
+    sampled = LogSettings(payloads=True, sample_rate=0.1)
+    full = LogSettings(payloads=True, sample_rate=1.0)
+
+    for fmt_name, formatter in (('text', logging.Formatter(TEXT_FORMAT)), ('json', JsonFormatter())):
+        for title, settings in (('payload выключен', off), ('payload 10%', sampled), ('payload 100%', full)):
+            logger, listener = queued(f'bench.{fmt_name}.{title}', formatter)
+            report(f'после ({fmt_name}, очередь): {title}', measure(after, logger, UPDATE, settings))
+            # Время фонового потока на вывод не входит в замер вызывающего потока
+            listener.stop()
+
+    print(f"\nРазмер update в логе: {len(json.dumps(UPDATE, ensure_ascii=False))} символов, {ROUNDS} запросов на вариант")
+
+
+if __name__ == '__main__':
+    main()
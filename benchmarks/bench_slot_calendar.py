@@ -0,0 +1,124 @@
+"""Бенчмарк календаря записи.
+
+Запуск: python benchmarks/bench_slot_calendar.py --bookings 100000
+Показывает распознавание даты и времени на фиксированном наборе фраз,
+время загрузки индекса из строк таблицы, задержку проверки времени
+(check) и подбора свободного времени (free_slots) по сравнению
+с линейным просмотром всех записей.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from slot_calendar import SlotCalendar, parse_slot, format_slot  # noqa: E402
+
+NOW = datetime(2024, 12, 20, 12, 0)  # пятница
+# (фраза клиента, ожидаемое время или None)
+PHRASES = [
+    ("25.12.2024 15:00", datetime(2024, 12, 25, 15)),
+    ("25.12 15:00", datetime(2024, 12, 25, 15)),
+    ("2024-12-25 15:00", datetime(2024, 12, 25, 15)),
+    ("завтра в 15:00", datetime(2024, 12, 21, 15)),
+    ("завтра в 11", datetime(2024, 12, 21, 11)),
+    ("послезавтра 12 ч", datetime(2024, 12, 22, 12)),
+    ("в понедельник 11:00", datetime(2024, 12, 23, 11)),
+    ("в пятницу в 3 часа дня", datetime(2024, 12, 27, 15)),
+    ("27 декабря в 16.30", datetime(2024, 12, 27, 16, 30)),
+    ("10 января 10:00", datetime(2025, 1, 10, 10)),
+    ("05.01 в 10:00", datetime(2025, 1, 5, 10)),
+    ("23.12 15.00", datetime(2024, 12, 23, 15)),
+    ("Сегодня 18:30", datetime(2024, 12, 20, 18, 30)),
+    ("25/12/24 в 10", datetime(2024, 12, 25, 10)),
+    ("в 7 вечера в среду", datetime(2024, 12, 25, 19)),
+    ("в 15", None),
+    ("15.00", None),
+    ("на следующей неделе", None),
+    ("как можно скорее", None),
+]
+
+ROUNDS = 2000
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def timed(func, args_list) -> list:
+    timings = []
+    for args in args_list:
+        t0 = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - t0) * 1000)
+    return timings
+
+
+def report(title: str, timings: list):
+    print(f"  {title:<34} p50 {statistics.median(timings):8.4f} мс, p95 {percentile(timings, 0.95):8.4f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bookings', type=int, default=100000, help='записей в календаре')
+    args = parser.parse_args()
+
+    correct = 0
+    for phrase, expected in PHRASES:
+        got = parse_slot(phrase, NOW)
+        ok = got == expected
+        correct += ok
+        print(f"{'OK ' if ok else 'ERR'} {phrase!r} -> {format_slot(got) if got else None}")
+    print(f"Распознавание: {correct}/{len(PHRASES)}")
+
+    # Записи на сетке по часу в рабочие дни на несколько лет вперёд (плотность ~70%)
+    calendar = SlotCalendar(slot_minutes=60, capacity=1, horizon_days=3650)
+    calendar.now = lambda: NOW
+    rng = random.Random(1)
+    rows = []
+    day = NOW.date()
+    while len(rows) < args.bookings:
+        day += timedelta(days=1)
+        if day.weekday() >= 5:
+            continue
+        for hour in range(10, 19):
+            if rng.random() < 0.7 and len(rows) < args.bookings:
+                rows.append(['Имя', '+79990000000', 'Услуга', f"{day:%d.%m.%Y} {hour}:00", 'нет', 'нет', 'Виджет',
+                             NOW.strftime('%Y-%m-%d %H:%M:%S')])
+    last_day = day
+
+    t0 = time.perf_counter()
+    slots = [parse_slot(row[3], NOW) for row in rows]
+    parse_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    calendar.load(slots)
+    load_ms = (time.perf_counter() - t0) * 1000
+    print(f"\nЗаписей: {calendar.size}, до {last_day:%d.%m.%Y}")
+    print(f"  разбор строк таблицы               {parse_ms:8.1f} мс")
+    print(f"  построение индекса                 {load_ms:8.1f} мс")
+
+    span = (last_day - NOW.date()).days
+    queries = [(datetime.combine(NOW.date() + timedelta(days=rng.randrange(1, span)), datetime.min.time())
+                + timedelta(hours=rng.randrange(10, 18)),) for _ in range(ROUNDS)]
+
+    def linear_check(slot):
+        # Прежний способ без индекса: просмотр всех записей
+        start = slot
+        end = slot + timedelta(minutes=60)
+        return sum(1 for booked in slots if booked < end and booked + timedelta(minutes=60) > start) < 1
+
+    print()
+    report('check (индекс)', timed(calendar.check, queries))
+    report('free_slots(3) (индекс)', timed(lambda slot: calendar.free_slots(slot, 3), queries))
+    report('reserve + release (индекс)', timed(
+        lambda slot: calendar.reserve(slot) == calendar.FREE and calendar.release(slot), queries))
+    report('check (просмотр всех записей)', timed(linear_check, queries[:max(1, ROUNDS // 100)]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Бенчмарк холодного запуска воркера: импорт модулей и готовность telegram_loop.
+
+Запуск: python benchmarks/bench_startup.py --repeat 5
+Каждый замер — в новом процессе Python (как при деплое или перезапуске воркера).
+Telegram Bot API заменён заглушкой (fake_services.py), поэтому сеть не нужна.
+
+Показывает медиану по замерам:
+  import functions / import main — время импорта до начала обслуживания запросов;
+  init_application до готовности — от запуска telegram_loop до события готовности;
+  отложено: Sheets, openai       — цена ленивой инициализации при первом обращении;
+  прежняя инициализация Sheets   — build('sheets', 'v4') по полному discovery-документу.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_services import FakeTelegram  # noqa: E402
+
+# Код замера в дочернем процессе: печатает JSON с длительностями в секундах
+CHILD = r'''
+import sys, json, time
+sys.path.insert(0, '.')
+t0 = time.perf_counter()
+import functions
+t1 = time.perf_counter()
+import main
+t2 = time.perf_counter()
+ready = main.init_application()
+t3 = time.perf_counter()
+functions.sheets_client.get()
+t4 = time.perf_counter()
+functions.sync_openai()
+t5 = time.perf_counter()
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.discovery import build
+t6 = time.perf_counter()
+build('sheets', 'v4', credentials=AnonymousCredentials(), static_discovery=True).spreadsheets()
+t7 = time.perf_counter()
+print(json.dumps({
+    'ready': ready,
+    'import_functions': t1 - t0,
+    'import_main': t2 - t1,
+    'worker_ready': t3 - t2,
+    'lazy_sheets': t4 - t3,
+    'lazy_openai': t5 - t4,
+    'legacy_sheets_build': t7 - t6,
+}))
+'''
+
+ROWS = [
+    ('import functions', 'import_functions'),
+    ('import main', 'import_main'),
+    ('init_application до готовности', 'worker_ready'),
+    ('отложено: клиент Sheets', 'lazy_sheets'),
+    ('отложено: импорт openai', 'lazy_openai'),
+    ('прежняя инициализация Sheets (build)', 'legacy_sheets_build'),
+]
+
+
+def measure(env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD], cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='число запусков процесса')
+    parser.add_argument('--json', help='сохранить результаты в файл JSON')
+    args = parser.parse_args()
+
+    telegram = FakeTelegram(latency=0.02).start()
+    workdir = tempfile.mkdtemp(prefix='bench_startup_')
+    env = dict(os.environ)
+    env.update({
+        'TELEGRAM_BOT_TOKEN': '123456:bench',
+        'TELEGRAM_API_URL': telegram.url,
+        'OPENAI_API_KEY': 'sk-bench',
+        'GOOGLE_SHEETS_API_URL': 'http://127.0.0.1:9',
+        'SHEETS_SPOOL_PATH': os.path.join(workdir, 'sheets_spool.db'),
+        'SESSION_DB_PATH': os.path.join(workdir, 'sessions.db'),
+        'BOOKING_DEDUP_PATH': os.path.join(workdir, 'booking_dedup.db'),
+        'RATE_LIMIT_DB_PATH': os.path.join(workdir, 'rate_limits.db'),
+        'THREAD_POOL_SIZE': '0',
+        'LOG_LEVEL': 'WARNING',
+    })
+
+    runs = [measure(env) for _ in range(args.repeat)]
+    print(f"Запусков: {len(runs)}, готовность telegram_loop: {sum(run['ready'] for run in runs)}/{len(runs)}")
+    results = {}
+    for title, key in ROWS:
+        values = [run[key] * 1000 for run in runs]
+        results[key] = {'median_ms': round(statistics.median(values), 1), 'max_ms': round(max(values), 1)}
+        print(f"  {title:<38} медиана {results[key]['median_ms']:>7.1f} мс, max {results[key]['max_ms']:>7.1f} мс")
+    startup = sum(results[key]['median_ms'] for key in ('import_functions', 'import_main', 'worker_ready'))
+    print(f"  {'до готовности (сумма медиан)':<38} {startup:>15.1f} мс "
+          f"(прежде: импорт с openai и build Sheets + sleep(2))")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'runs': runs, 'results': results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
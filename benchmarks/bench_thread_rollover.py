@@ -0,0 +1,107 @@
+"""Бенчмарк переноса длинных диалогов в новый thread (thread_rollover.py).
+
+Запуск: python benchmarks/bench_thread_rollover.py --turns 80
+Один долгий диалог через get_assistant_response_async и заглушку OpenAI
+(fake_services.py), в которой время run растёт с длиной истории thread
+(--context-latency на 1000 токенов). Диалог проходится дважды: без переноса
+(THREAD_ROLLOVER=0, как раньше) и с переносом; показываются средние длина
+thread, токены контекста и время ответа за весь диалог и за последние ходы,
+а также сохранились ли в кратком содержании данные записи.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fake_services import FakeTelegram, FakeOpenAI, FakeSheets, fake_environment  # noqa: E402
+
+# Первые сообщения диалога — данные записи, которые должны пережить перенос
+OPENING = ['Анна Петрова', '+7 900 123-45-67']
+QUESTION = ('Уточните, пожалуйста, ещё один момент по моему делу о разделе имущества после развода: '
+            'как учитываются вклады, открытые до брака, и что будет с квартирой, купленной в ипотеку? №{}')
+ANSWER = ('Спасибо за вопрос. Имущество, приобретённое до брака, по общему правилу остаётся личной собственностью. '
+          'Квартира в ипотеке, купленная в браке, делится вместе с долгом, но есть исключения: взносы из личных '
+          'средств и материнский капитал учитываются отдельно. Адвокат разберёт ваш случай на консультации.')
+LAST_TURNS = 10
+
+
+async def conversation(functions, turns: int) -> list:
+    """Проходит диалог; возвращает [(время ответа, сообщений в thread, токены контекста)] по ходам"""
+    results = []
+    thread_id = None
+    for turn in range(turns):
+        message = OPENING[turn] if turn < len(OPENING) else QUESTION.format(turn)
+        started = time.perf_counter()
+        _, thread_id = await functions.get_assistant_response_async(message, thread_id, 'Виджет')
+        elapsed = time.perf_counter() - started
+        usage = functions.sessions.get('thread_usage', thread_id) or {}
+        results.append((elapsed, usage.get('messages', 0), usage.get('prompt_tokens', 0)))
+    return results, thread_id
+
+
+def report(title: str, results: list):
+    def line(name, rows):
+        print(f"  {name:<18} ответ {statistics.mean(r[0] for r in rows) * 1000:7.0f} мс, "
+              f"сообщений в thread {statistics.mean(r[1] for r in rows):6.1f}, "
+              f"токенов {statistics.mean(r[2] for r in rows):7.0f}")
+    print(title)
+    line('весь диалог', results)
+    line(f"последние {LAST_TURNS} ходов", results[-LAST_TURNS:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=80, help='ходов в диалоге')
+    parser.add_argument('--run-latency', type=float, default=0.05, help='время run без истории, сек')
+    parser.add_argument('--context-latency', type=float, default=0.05, help='добавка к run на 1000 токенов истории, сек')
+    parser.add_argument('--max-messages', type=int, default=40, help='порог переноса: сообщений в thread')
+    parser.add_argument('--max-tokens', type=int, default=12000, help='порог переноса: токенов контекста')
+    args = parser.parse_args()
+
+    openai = FakeOpenAI(run_latency=args.run_latency, api_latency=0.005, chunks=5, chunk_delay=0,
+                        context_latency=args.context_latency, answer=ANSWER).start()
+    workdir = tempfile.mkdtemp(prefix='bench_rollover_')
+    os.environ.update(fake_environment(FakeTelegram().start(), openai, FakeSheets(latency=0.0).start()))
+    os.environ.update({
+        'SHEETS_SPOOL_PATH': os.path.join(workdir, 'sheets_spool.db'),
+        'SESSION_DB_PATH': os.path.join(workdir, 'sessions.db'),
+        'BOOKING_DEDUP_PATH': os.path.join(workdir, 'booking_dedup.db'),
+        'RATE_LIMIT_DB_PATH': os.path.join(workdir, 'rate_limits.db'),
+        'THREAD_POOL_SIZE': '0',
+        'ANSWER_CACHE_SIZE': '0',
+        'FAQ_FAST_PATH': '0',
+        'THREAD_MAX_MESSAGES': str(args.max_messages),
+        'THREAD_MAX_TOKENS': str(args.max_tokens),
+        'LOG_LEVEL': 'WARNING',
+    })
+    import functions
+
+    functions.THREAD_ROLLOVER = False
+    before, _ = asyncio.run(conversation(functions, args.turns))
+    functions.THREAD_ROLLOVER = True
+    after, thread_id = asyncio.run(conversation(functions, args.turns))
+
+    print(f"Ходов: {args.turns}, порог переноса: {args.max_messages} сообщений или {args.max_tokens} токенов\n")
+    report('Без переноса (один thread):', before)
+    report('С переносом:', after)
+    stats = functions.thread_rollover.stats()
+    print(f"\nПереносов: {stats['rollovers']}, ошибок: {stats['failures']}")
+    for stage, title in (('before', 'последний run до переноса'), ('after', 'первый run после переноса')):
+        item = stats[stage]
+        if item['threads']:
+            print(f"  {title:<27} сообщений {item['avg_messages']:6.1f}, токенов {item['avg_prompt_tokens']:6}, "
+                  f"run {item['avg_run_seconds'] * 1000:6.0f} мс")
+    summary = openai.threads[thread_id][0]['content'][0]['text']['value']
+    kept = all(value in summary for value in OPENING)
+    print(f"Данные записи в кратком содержании: {'сохранены' if kept else 'ПОТЕРЯНЫ'}")
+
+
+if __name__ == '__main__':
+    main()
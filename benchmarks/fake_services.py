@@ -0,0 +1,535 @@
+"""Локальные заглушки внешних сервисов для бенчмарков: Telegram Bot API, OpenAI (Assistants и Chat Completions) и Google Sheets.
+
+Запуск отдельно (например, чтобы нагружать сервис под gunicorn):
+    python benchmarks/fake_services.py --run-latency 0.5 --tool-call-rate 0.1 --sheets-error-rate 0.05
+Печатает переменные окружения, с которыми нужно запустить сервис.
+Из bench_load.py заглушки запускаются в том же процессе.
+"""
+import re
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+from urllib.parse import parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOOKING_ARGUMENTS = {
+    'name': 'Иван Петров',
+    'phone': '+7 900 000-00-00',
+    'service': 'Правовая консультация',
+    'datetime': '25.12.2025 15:00',
+    'documents': 'паспорт',
+    'comments': 'нет',
+}
+
+
+def common_prefix(first: str, second: str) -> int:
+    """Длина общего начала двух строк (двоичный поиск по срезам)"""
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[:middle] == second[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class FakeServer:
+    """HTTP сервер заглушки в фоновом потоке; обработчик получает сервис через self.server.service"""
+
+    def __init__(self, handler_class, host: str = '127.0.0.1', port: int = 0):
+        self.httpd = ThreadingHTTPServer((host, port), handler_class)
+        self.httpd.daemon_threads = True
+        self.httpd.service = self
+        self.thread = None
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def read_body(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if not raw:
+            return {}
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('application/json'):
+            return json.loads(raw)
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            return {key: values[-1] for key, values in parse_qs(raw.decode()).items()}
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return {}
+
+    def send_json(self, data, status: int = 200):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# === Telegram Bot API ===
+class FakeTelegramHandler(JsonHandler):
+    def do_POST(self):
+        match = re.match(r'^/bot[^/]+/(\w+)$', self.path)
+        if not match:
+            return self.send_json({'ok': False, 'error_code': 404, 'description': 'Not Found'}, 404)
+        method = match.group(1)
+        params = self.read_body()
+        self.service.count(method)
+        time.sleep(self.service.latency)
+        self.send_json({'ok': True, 'result': self.service.result(method, params)})
+
+    do_GET = do_POST
+
+
+class FakeTelegram(FakeServer):
+    """Bot API: getMe, sendMessage и остальные методы отвечают успехом через latency секунд"""
+
+    def __init__(self, latency: float = 0.02, **kwargs):
+        super().__init__(FakeTelegramHandler, **kwargs)
+        self.latency = latency
+        self._message_ids = itertools.count(1)
+
+    def result(self, method: str, params: dict):
+        if method == 'getMe':
+            return {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+                    'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+        if method == 'sendMessage':
+            try:
+                chat_id = int(params.get('chat_id', 0))
+            except ValueError:
+                chat_id = 0
+            return {'message_id': next(self._message_ids), 'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+        return True
+
+
+# === OpenAI Assistants API ===
+class FakeOpenAIHandler(JsonHandler):
+    def do_POST(self):
+        service = self.service
+        path = self.path.split('?')[0]
+        body = self.read_body()
+        match = re.match(r'^/v1/threads/([^/]+)/runs/([^/]+)/cancel$', path)
+        if match:
+            service.count('runs.cancel')
+            return self.send_json(service._run(match.group(1), match.group(2), 'cancelling'))
+        if random.random() < service.error_rate:
+            service.count('errors')
+            return self.send_json({'error': {'message': 'The server is overloaded', 'type': 'server_error'}}, 503)
+        if path == '/v1/chat/completions':
+            service.count('chat.completions')
+            return self.stream_chat(body)
+        if path == '/v1/threads':
+            service.count('threads.create')
+            time.sleep(service.api_latency)
+            return self.send_json(service.create_thread(body.get('messages') or []))
+        match = re.match(r'^/v1/threads/([^/]+)/messages$', path)
+        if match:
+            service.count('messages.create')
+            time.sleep(service.api_latency)
+            return self.send_json(service.add_message(match.group(1), body.get('role', 'user'), body.get('content', '')))
+        match = re.match(r'^/v1/threads/([^/]+)/runs$', path)
+        if match:
+            service.count('runs.create')
+            if not body.get('stream'):
+                # Синхронный клиент: run без стрима, статус опрашивается через runs.retrieve
+                time.sleep(service.api_latency)
+                return self.send_json(service.start_run(match.group(1)))
+            return self.stream_run(match.group(1), tool_outputs=False)
+        match = re.match(r'^/v1/threads/([^/]+)/runs/([^/]+)/submit_tool_outputs$', path)
+        if match:
+            service.count('runs.submit_tool_outputs')
+            return self.stream_run(match.group(1), tool_outputs=True, run_id=match.group(2))
+        self.send_json({'error': {'message': f'Unknown path {path}'}}, 404)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        match = re.match(r'^/v1/threads/([^/]+)/runs/([^/]+)$', path)
+        if match:
+            self.service.count('runs.retrieve')
+            time.sleep(self.service.api_latency)
+            return self.send_json(self.service.retrieve_run(match.group(1), match.group(2)))
+        match = re.match(r'^/v1/threads/([^/]+)/messages$', path)
+        if not match:
+            return self.send_json({'error': {'message': f'Unknown path {path}'}}, 404)
+        self.service.count('messages.list')
+        time.sleep(self.service.api_latency)
+        query = {key: values[-1] for key, values in parse_qs(self.path.partition('?')[2]).items()}
+        self.send_json(self.service.list_messages(
+            match.group(1), order=query.get('order', 'desc'), after=query.get('after'),
+            limit=int(query.get('limit', 20))
+        ))
+
+    def do_DELETE(self):
+        match = re.match(r'^/v1/threads/([^/]+)$', self.path.split('?')[0])
+        self.service.count('threads.delete')
+        thread_id = match.group(1) if match else ''
+        with self.service.lock:
+            self.service.threads.pop(thread_id, None)
+        self.send_json({'id': thread_id, 'object': 'thread.deleted', 'deleted': True})
+
+    def stream_run(self, thread_id: str, tool_outputs: bool, run_id: str = None):
+        service = self.service
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for event, data in service.run_events(thread_id, tool_outputs, run_id):
+                if event == 'sleep':
+                    time.sleep(data)
+                    continue
+                self.wfile.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"event: done\ndata: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент не дождался ответа (таймаут или отмена run)
+            service.count('streams_aborted')
+
+
+    def stream_chat(self, body: dict):
+        service = self.service
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for chunk in service.chat_events(body):
+                if isinstance(chunk, float):
+                    time.sleep(chunk)
+                    continue
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            service.count('streams_aborted')
+
+
+class FakeOpenAI(FakeServer):
+    """Assistants API со стримом run и потоковый Chat Completions.
+
+    run_latency — время до первого фрагмента ответа, chunks — число фрагментов
+    (между ними chunk_delay), tool_call_rate — доля run, вызывающих save_booking_data,
+    error_rate — доля POST-запросов (кроме отмены run), получающих 503.
+    context_latency — добавка к run_latency на каждые 1000 токенов истории thread
+    (токены оцениваются как символы / 3 и возвращаются в usage завершённого run).
+    Chat Completions имитирует кэш префиксов: совпавшее с прошлыми запросами начало
+    (от 1024 токенов, с шагом 128) возвращается в usage как cached_tokens и не
+    добавляет context_latency.
+    """
+
+    def __init__(self, run_latency: float = 0.5, api_latency: float = 0.03, chunks: int = 20,
+                 chunk_delay: float = 0.01, tool_call_rate: float = 0.0, error_rate: float = 0.0,
+                 context_latency: float = 0.0,
+                 answer: str = 'Спасибо за вопрос. Адвокат разберёт ваш случай на консультации.', **kwargs):
+        super().__init__(FakeOpenAIHandler, **kwargs)
+        self.run_latency = run_latency
+        self.error_rate = error_rate
+        self.api_latency = api_latency
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.tool_call_rate = tool_call_rate
+        self.context_latency = context_latency
+        self.answer = answer
+        self.threads = {}  # thread_id -> [message]
+        self.runs = {}  # run_id -> время готовности ответа (run без стрима)
+        self.prompts = []  # тексты последних запросов Chat Completions (для кэша префиксов)
+        self._ids = itertools.count(1)
+
+    def _id(self, prefix: str) -> str:
+        return f"{prefix}_{next(self._ids)}"
+
+    def _message(self, thread_id: str, role: str, text: str, run_id: str = None, status: str = 'completed') -> dict:
+        return {
+            'id': self._id('msg'), 'object': 'thread.message', 'created_at': int(time.time()),
+            'thread_id': thread_id, 'role': role, 'status': status, 'assistant_id': None, 'run_id': run_id,
+            'attachments': [], 'metadata': {},
+            'content': [{'type': 'text', 'text': {'value': text, 'annotations': []}}] if text else [],
+        }
+
+    def create_thread(self, messages: list) -> dict:
+        thread_id = self._id('thread')
+        with self.lock:
+            self.threads[thread_id] = [self._message(thread_id, m.get('role', 'user'), m.get('content', ''))
+                                       for m in messages]
+        return {'id': thread_id, 'object': 'thread', 'created_at': int(time.time()), 'metadata': {}}
+
+    def add_message(self, thread_id: str, role: str, content: str) -> dict:
+        message = self._message(thread_id, role, content)
+        with self.lock:
+            self.threads.setdefault(thread_id, []).append(message)
+        return message
+
+    def list_messages(self, thread_id: str, order: str = 'desc', after: str = None, limit: int = 20) -> dict:
+        """Страница сообщений thread (курсор after — id последнего сообщения предыдущей страницы)"""
+        with self.lock:
+            data = list(self.threads.get(thread_id, []))
+        if order == 'desc':
+            data.reverse()
+        if after:
+            ids = [message['id'] for message in data]
+            data = data[ids.index(after) + 1:] if after in ids else []
+        page = data[:limit]
+        return {'object': 'list', 'data': page, 'first_id': page[0]['id'] if page else None,
+                'last_id': page[-1]['id'] if page else None, 'has_more': len(data) > limit}
+
+    def _run(self, thread_id: str, run_id: str, status: str, required_action=None, usage=None) -> dict:
+        return {
+            'id': run_id, 'object': 'thread.run', 'created_at': int(time.time()), 'thread_id': thread_id,
+            'assistant_id': 'asst_bench', 'status': status, 'required_action': required_action,
+            'model': 'fake', 'instructions': '', 'tools': [], 'metadata': {}, 'parallel_tool_calls': True,
+            'usage': usage,
+        }
+
+    def prompt_tokens(self, thread_id: str) -> int:
+        """Оценка токенов истории thread (символы / 3)"""
+        with self.lock:
+            messages = list(self.threads.get(thread_id, []))
+        return sum(len(content['text']['value']) for message in messages for content in message['content']) // 3
+
+    def start_run(self, thread_id: str) -> dict:
+        run_id = self._id('run')
+        with self.lock:
+            self.runs[run_id] = time.monotonic() + self.run_latency
+        return self._run(thread_id, run_id, 'queued')
+
+    def retrieve_run(self, thread_id: str, run_id: str) -> dict:
+        """in_progress, пока не прошло run_latency; затем ответ добавляется в thread и run завершён"""
+        with self.lock:
+            ready_at = self.runs.get(run_id)
+            if ready_at is None:
+                return self._run(thread_id, run_id, 'completed')
+            if time.monotonic() < ready_at:
+                return self._run(thread_id, run_id, 'in_progress')
+            del self.runs[run_id]
+            self.threads.setdefault(thread_id, []).append(
+                self._message(thread_id, 'assistant', self.answer, run_id)
+            )
+        return self._run(thread_id, run_id, 'completed')
+
+    def run_events(self, thread_id: str, tool_outputs: bool, run_id: str = None):
+        """События стрима run: (имя события, данные) или ('sleep', секунды)"""
+        run_id = run_id or self._id('run')
+        if not tool_outputs:
+            yield 'thread.run.created', self._run(thread_id, run_id, 'queued')
+            yield 'thread.run.in_progress', self._run(thread_id, run_id, 'in_progress')
+        prompt_tokens = self.prompt_tokens(thread_id)
+        yield 'sleep', self.run_latency + self.context_latency * prompt_tokens / 1000
+
+        if not tool_outputs and random.random() < self.tool_call_rate:
+            self.count('tool_calls')
+            tool_call = {'id': self._id('call'), 'type': 'function', 'function': {
+                'name': 'save_booking_data', 'arguments': json.dumps(BOOKING_ARGUMENTS, ensure_ascii=False)}}
+            yield 'thread.run.requires_action', self._run(thread_id, run_id, 'requires_action', {
+                'type': 'submit_tool_outputs', 'submit_tool_outputs': {'tool_calls': [tool_call]}})
+            return
+
+        message = self._message(thread_id, 'assistant', '', run_id, status='in_progress')
+        yield 'thread.message.created', message
+        step = max(1, len(self.answer) // max(1, self.chunks))
+        for start in range(0, len(self.answer), step):
+            yield 'thread.message.delta', {'id': message['id'], 'object': 'thread.message.delta', 'delta': {
+                'content': [{'index': 0, 'type': 'text', 'text': {'value': self.answer[start:start + step]}}]}}
+            if self.chunk_delay:
+                yield 'sleep', self.chunk_delay
+        completed = dict(message, status='completed',
+                         content=[{'type': 'text', 'text': {'value': self.answer, 'annotations': []}}])
+        with self.lock:
+            self.threads.setdefault(thread_id, []).append(completed)
+        yield 'thread.message.completed', completed
+        completion_tokens = len(self.answer) // 3
+        yield 'thread.run.completed', self._run(thread_id, run_id, 'completed', usage={
+            'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens})
+
+    def cached_tokens(self, prompt: str) -> int:
+        """Токены самого длинного общего начала с прошлыми запросами по правилам кэша OpenAI"""
+        with self.lock:
+            prefix = max((common_prefix(prompt, seen) for seen in self.prompts), default=0)
+            self.prompts.append(prompt)
+            del self.prompts[:-256]
+        tokens = prefix // 3
+        return tokens // 128 * 128 if tokens >= 1024 else 0
+
+    def chat_events(self, body: dict):
+        """Фрагменты стрима chat.completions или паузы (float, секунды)"""
+        messages = body.get('messages') or []
+        # Префикс кэша: функции и сообщения в порядке запроса
+        prompt = json.dumps(body.get('tools') or [], ensure_ascii=False) + ''.join(
+            f"<{message.get('role')}>{message.get('content') or ''}"
+            f"{json.dumps(message.get('tool_calls'), ensure_ascii=False) if message.get('tool_calls') else ''}"
+            for message in messages)
+        prompt_tokens = len(prompt) // 3
+        cached = self.cached_tokens(prompt)
+        yield self.run_latency + self.context_latency * (prompt_tokens - cached) / 1000
+
+        completion_id = self._id('chatcmpl')
+
+        def chunk(delta=None, finish_reason=None, usage=None):
+            return {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                    'model': body.get('model', 'fake'),
+                    'choices': [] if usage else [{'index': 0, 'delta': delta or {}, 'finish_reason': finish_reason}],
+                    'usage': usage}
+
+        answer = self.answer
+        tool_call = body.get('tools') and messages and messages[-1].get('role') == 'user' \
+            and random.random() < self.tool_call_rate
+        if tool_call:
+            self.count('tool_calls')
+            answer = 'Сохраняю вашу запись.'
+        yield chunk({'role': 'assistant', 'content': ''})
+        step = max(1, len(answer) // max(1, self.chunks))
+        for start in range(0, len(answer), step):
+            yield chunk({'content': answer[start:start + step]})
+            if self.chunk_delay:
+                yield float(self.chunk_delay)
+        if tool_call:
+            arguments = json.dumps(BOOKING_ARGUMENTS, ensure_ascii=False)
+            half = len(arguments) // 2
+            yield chunk({'tool_calls': [{'index': 0, 'id': self._id('call'), 'type': 'function',
+                                         'function': {'name': 'save_booking_data', 'arguments': arguments[:half]}}]})
+            yield chunk({'tool_calls': [{'index': 0, 'function': {'arguments': arguments[half:]}}]})
+        yield chunk(finish_reason='tool_calls' if tool_call else 'stop')
+        completion_tokens = len(answer) // 3
+        yield chunk(usage={'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                           'total_tokens': prompt_tokens + completion_tokens,
+                           'prompt_tokens_details': {'cached_tokens': cached}})
+
+
+# === Google Sheets values.append и values.get ===
+class FakeSheetsHandler(JsonHandler):
+    def do_GET(self):
+        service = self.service
+        match = re.match(r'^/v4/spreadsheets/([^/]+)/values/([^/?]+)', self.path)
+        if not match:
+            return self.send_json({'error': {'code': 404, 'message': 'Not Found'}}, 404)
+        time.sleep(service.latency)
+        service.count('gets')
+        # Диапазон вида A:H или A101:H — строки начиная с указанной (с 1)
+        start = re.match(r'^[A-Z]+(\d*)', unquote(match.group(2)))
+        offset = int(start.group(1)) - 1 if start and start.group(1) else 0
+        with service.lock:
+            rows = service.rows[offset:]
+        self.send_json({'range': unquote(match.group(2)), 'majorDimension': 'ROWS', 'values': rows})
+
+    def do_POST(self):
+        service = self.service
+        match = re.match(r'^/v4/spreadsheets/([^/]+)/values/([^/?]+):append', self.path)
+        if not match:
+            return self.send_json({'error': {'code': 404, 'message': 'Not Found'}}, 404)
+        body = self.read_body()
+        time.sleep(service.latency)
+        if random.random() < service.error_rate:
+            service.count('errors')
+            return self.send_json({'error': {'code': 503, 'message': 'The service is currently unavailable.',
+                                             'status': 'UNAVAILABLE'}}, 503)
+        rows = body.get('values', [])
+        with service.lock:
+            service.rows.extend(rows)
+        service.count('appends')
+        service.count('rows', len(rows))
+        self.send_json({'spreadsheetId': match.group(1), 'tableRange': 'A1',
+                        'updates': {'spreadsheetId': match.group(1), 'updatedRows': len(rows)}})
+
+
+class FakeSheets(FakeServer):
+    """Google Sheets values.append/values.get с задержкой latency и долей ошибок 503 error_rate (для append)"""
+
+    def __init__(self, latency: float = 0.3, error_rate: float = 0.0, rows: list = None, **kwargs):
+        super().__init__(FakeSheetsHandler, **kwargs)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rows = list(rows or [])
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Параметры заглушек (общие для этого файла и bench_load.py)"""
+    parser.add_argument('--run-latency', type=float, default=0.5, help='время до первого фрагмента ответа run, сек')
+    parser.add_argument('--api-latency', type=float, default=0.03, help='задержка остальных вызовов OpenAI, сек')
+    parser.add_argument('--chunks', type=int, default=20, help='число фрагментов ответа в стриме')
+    parser.add_argument('--tool-call-rate', type=float, default=0.0, help='доля run с вызовом save_booking_data')
+    parser.add_argument('--openai-error-rate', type=float, default=0.0, help='доля ответов 503 от OpenAI')
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help='задержка Bot API, сек')
+    parser.add_argument('--sheets-latency', type=float, default=0.3, help='задержка values.append, сек')
+    parser.add_argument('--sheets-error-rate', type=float, default=0.0, help='доля ответов 503 от Sheets')
+
+
+def start_fakes(args):
+    """Запускает три заглушки и возвращает (telegram, openai, sheets)"""
+    telegram = FakeTelegram(latency=args.telegram_latency).start()
+    openai = FakeOpenAI(run_latency=args.run_latency, api_latency=args.api_latency, chunks=args.chunks,
+                        tool_call_rate=args.tool_call_rate, error_rate=args.openai_error_rate).start()
+    sheets = FakeSheets(latency=args.sheets_latency, error_rate=args.sheets_error_rate).start()
+    return telegram, openai, sheets
+
+
+def fake_environment(telegram: FakeTelegram, openai: FakeOpenAI, sheets: FakeSheets) -> dict:
+    """Переменные окружения сервиса для работы с заглушками"""
+    return {
+        'TELEGRAM_BOT_TOKEN': '123456:bench',
+        'TELEGRAM_API_URL': telegram.url,
+        'TELEGRAM_GROUP_ID': '-100123',
+        'OPENAI_API_KEY': 'sk-bench',
+        'OPENAI_BASE_URL': f"{openai.url}/v1",
+        'OPENAI_ASSISTANT_ID': 'asst_bench',
+        'GOOGLE_SHEET_ID': 'bench-sheet',
+        'GOOGLE_SHEETS_API_URL': sheets.url,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    args = parser.parse_args()
+    fakes = start_fakes(args)
+    for name, value in fake_environment(*fakes).items():
+        print(f"{name}={value}")
+    try:
+        while True:
+            time.sleep(10)
+            print(' '.join(f"{type(fake).__name__}: {fake.counts}" for fake in fakes), flush=True)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
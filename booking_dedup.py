@@ -0,0 +1,187 @@
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+NON_DIGIT_RE = re.compile(r'\D')
+SEPARATORS_RE = re.compile(r'[\s.,/:\-]+')
+
+
+def normalize_phone(phone: str) -> str:
+    """Только цифры; российский номер 8XXXXXXXXXX приводится к 7XXXXXXXXXX"""
+    digits = NON_DIGIT_RE.sub('', phone or '')
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    elif len(digits) == 10:
+        digits = '7' + digits
+    return digits
+
+
+def normalize_text(text: str) -> str:
+    """Нижний регистр, разделители (пробелы, точки, дефисы, двоеточия) схлопнуты в пробел"""
+    return SEPARATORS_RE.sub(' ', (text or '').lower().replace('ё', 'е')).strip()
+
+
+def booking_fingerprint(data: dict) -> str:
+    """Отпечаток заявки по нормализованным телефону, услуге и дате"""
+    parts = (normalize_phone(data.get('phone', '')), normalize_text(data.get('service', '')),
+             normalize_text(data.get('date', '')))
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+class BookingDedupIndex:
+    """Индекс уже принятых заявок для идемпотентной записи (SQLite, общий для процессов).
+
+    Заявка регистрируется по отпечатку (телефон, услуга, дата) и, если есть,
+    по ключу идемпотентности клиента. Повтор любого из них в течение window
+    секунд считается той же заявкой. Размер индекса ограничен maxsize:
+    истёкшие и самые старые записи удаляются.
+
+    Здесь же — занятое время записи (claim_slot): календарь каждого процесса
+    видит заявки других воркеров только после синхронизации с таблицей, а общая
+    таблица slot_claims не даёт двум воркерам занять одно время в этом окне.
+    """
+
+    def __init__(self, path: str, window: float = 24 * 3600, maxsize: int = 100000, cleanup_every: int = 100):
+        self.path = path
+        self.window = window
+        self.maxsize = maxsize
+        self.cleanup_every = cleanup_every
+        self.duplicates = 0
+        self._claims = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS booking_dedup ("
+            " key TEXT PRIMARY KEY,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS booking_dedup_created ON booking_dedup (created_at)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS slot_claims ("
+            " id INTEGER PRIMARY KEY,"
+            " minute INTEGER NOT NULL,"
+            " claimed_at REAL NOT NULL DEFAULT 0,"
+            " synced INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS slot_claims_minute ON slot_claims (minute)")
+
+    def keys(self, data: dict, idempotency_key: str = None) -> list:
+        """Ключи заявки в индексе: отпечаток и ключ идемпотентности"""
+        keys = [f"fp:{booking_fingerprint(data)}"]
+        if idempotency_key:
+            keys.append(f"idem:{idempotency_key}")
+        return keys
+
+    def claim(self, keys: list) -> bool:
+        """Регистрирует заявку. False — такая заявка уже принята в пределах окна"""
+        now = time.time()
+        placeholders = ','.join('?' * len(keys))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = self._conn.execute(
+                    f"SELECT 1 FROM booking_dedup WHERE key IN ({placeholders}) AND created_at >= ? LIMIT 1",
+                    (*keys, now - self.window)
+                ).fetchone()
+                if existing is None:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO booking_dedup (key, created_at) VALUES (?, ?)",
+                        [(key, now) for key in keys]
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            if existing is not None:
+                self.duplicates += 1
+                return False
+            self._claims += 1
+            if self._claims % self.cleanup_every == 0:
+                self._cleanup(now)
+        return True
+
+    def release(self, keys: list):
+        """Снимает регистрацию (запись не удалась — повтор должен пройти)"""
+        placeholders = ','.join('?' * len(keys))
+        with self._lock:
+            self._conn.execute(f"DELETE FROM booking_dedup WHERE key IN ({placeholders})", keys)
+
+    def claim_slot(self, minute: int, span: int, capacity: int = None, expired_before: int = None) -> bool:
+        """Занимает время записи: minute — начало в минутах, span — длительность приёма.
+
+        False — с интервалом уже пересекаются capacity записей других процессов
+        (capacity=None — записать без проверки). Записи с началом раньше
+        expired_before (прошедшее время) удаляются.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if expired_before is not None:
+                    self._conn.execute("DELETE FROM slot_claims WHERE minute < ?", (expired_before - span,))
+                overlapping = self._conn.execute(
+                    "SELECT COUNT(*) FROM slot_claims WHERE minute > ? AND minute < ?", (minute - span, minute + span)
+                ).fetchone()[0]
+                claimed = capacity is None or overlapping < capacity
+                if claimed:
+                    self._conn.execute("INSERT INTO slot_claims (minute, claimed_at) VALUES (?, ?)",
+                                       (minute, time.time()))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def sync_slots(self, minutes: list, since: float, grace: float = 600):
+        """Пересобирает занятое время по таблице заявок (полная синхронизация).
+
+        minutes — начала записей из таблицы и очереди записи, since — момент начала
+        чтения таблицы. Удаляются записи прошлых пересборок и занятия старше
+        since - grace: отменённая в таблице заявка больше не держит время. Более
+        свежие занятия остаются — заявка могла ещё записываться и не попасть
+        ни в таблицу, ни в очередь.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM slot_claims WHERE synced = 1 OR claimed_at < ?", (since - grace,))
+                self._conn.executemany(
+                    "INSERT INTO slot_claims (minute, claimed_at, synced) VALUES (?, ?, 1)",
+                    [(minute, since) for minute in minutes]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def release_slot(self, minute: int):
+        """Освобождает одну запись на время minute (заявка не записана)"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM slot_claims WHERE id = (SELECT id FROM slot_claims WHERE minute = ? AND synced = 0 LIMIT 1)",
+                (minute,)
+            )
+
+    def _cleanup(self, now: float):
+        """Удаляет истёкшие записи и самые старые сверх maxsize (вызывается под блокировкой)"""
+        removed = self._conn.execute("DELETE FROM booking_dedup WHERE created_at < ?", (now - self.window,)).rowcount
+        overflow = self._conn.execute("SELECT COUNT(*) FROM booking_dedup").fetchone()[0] - self.maxsize
+        if overflow > 0:
+            removed += self._conn.execute(
+                "DELETE FROM booking_dedup WHERE rowid IN (SELECT rowid FROM booking_dedup ORDER BY created_at LIMIT ?)",
+                (overflow,)
+            ).rowcount
+        if removed:
+            logger.info(f"Индекс повторных заявок: удалено записей {removed}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM booking_dedup").fetchone()[0]
+            slots = self._conn.execute("SELECT COUNT(*) FROM slot_claims").fetchone()[0]
+        return {'size': size, 'slot_claims': slots, 'duplicates': self.duplicates, 'window': self.window}
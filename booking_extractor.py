@@ -0,0 +1,109 @@
+import re
+
+# Ответы, которые не считаются именем клиента
+NAME_SKIP = {'да', 'нет', 'да, хочу записаться', 'хочу записаться', 'записаться'}
+# Ответы, которые не считаются услугой или комментарием
+SERVICE_SKIP = {'да, хочу записаться', 'хочу записаться'}
+COMMENT_SKIP = {'да', 'нет', 'да, хочу записаться', 'хочу записаться'}
+
+DIGIT_RE = re.compile(r'\d')
+DATE_RE = re.compile(r'[./]|ноябр|декабр|январ|февр|март|апрел|май|июн|июл|август|сентябр|октябр')
+SERVICE_RE = re.compile(r'консультация|адвокат|суд')
+DOCUMENT_RE = re.compile(r'паспорт|документ|справк|свидетельство|удостовер')
+
+FIELDS = ('name', 'phone', 'service', 'date')
+
+
+class BookingExtraction:
+    """Данные записи, извлекаемые из сообщений пользователя по мере их появления в thread.
+
+    Каждое сообщение разбирается один раз (feed); состояние сериализуется в dict
+    вместе с id последнего разобранного сообщения, поэтому при следующем вызове
+    читаются только новые сообщения thread.
+    """
+
+    def __init__(self, state: dict = None):
+        state = state or {}
+        self.last_message_id = state.get('last_message_id')
+        self.fields = {field: state.get(field, '') for field in FIELDS}
+        # Из сообщений, не ставших основными полями, собираются документы и комментарий
+        self.documents = state.get('documents', 'нет')
+        self.comments = list(state.get('comments', []))
+
+    def feed(self, message: str):
+        """Разбирает очередное сообщение пользователя (от старых к новым)"""
+        lower = message.lower().strip()
+        stripped = message.strip()
+        fields = self.fields
+        has_digits = DIGIT_RE.search(message) is not None
+        matched = False
+
+        # Имя: без цифр, не длиннее трёх слов
+        if not fields['name'] and not has_digits and len(message.split()) <= 3 and lower not in NAME_SKIP:
+            fields['name'] = stripped
+            matched = True
+
+        # Телефон: не меньше семи цифр
+        if not fields['phone'] and has_digits and len(message) >= 7 and len(DIGIT_RE.findall(message)) >= 7:
+            fields['phone'] = stripped
+            matched = True
+
+        # Дата: цифры и разделитель даты или название месяца
+        if not fields['date'] and has_digits and DATE_RE.search(lower):
+            fields['date'] = stripped
+            matched = True
+
+        # Услуга: длинное описание без цифр или с ключевыми словами
+        if not fields['service'] and len(message) > 10 and lower not in SERVICE_SKIP:
+            if not has_digits or SERVICE_RE.search(lower):
+                fields['service'] = stripped
+                matched = True
+
+        # Повтор уже найденного поля не попадает ни в документы, ни в комментарий.
+        # Поле, найденное позже, не может совпасть с более ранним сообщением:
+        # правила зависят только от текста, и это сообщение уже было отвергнуто
+        if matched or message in fields.values():
+            return
+        if DOCUMENT_RE.search(lower):
+            self.documents = stripped
+        elif len(message) > 3 and lower not in COMMENT_SKIP:
+            self.comments.append(stripped)
+
+    def result(self, source: str = 'Виджет'):
+        """Данные записи или None, если ещё нет имени и телефона"""
+        fields = self.fields
+        if not fields['name'] or not fields['phone']:
+            return None
+        return {
+            **fields,
+            'documents': self.documents,
+            'comment': '; '.join(self.comments) if self.comments else 'нет',
+            'source': source,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            'last_message_id': self.last_message_id,
+            **self.fields,
+            'documents': self.documents,
+            'comments': self.comments,
+        }
+
+
+def message_text(message):
+    """Текст сообщения thread (первый текстовый блок) или None"""
+    for content in message.content or []:
+        if content.type == 'text':
+            return content.text.value
+    return None
+
+
+def feed_messages(extraction: BookingExtraction, messages):
+    """Передаёт в разбор сообщения пользователя (от старых к новым) и запоминает последнее"""
+    for message in messages:
+        if message.role == 'user':
+            text = message_text(message)
+            if text:
+                extraction.feed(text)
+        extraction.last_message_id = message.id
+    return extraction
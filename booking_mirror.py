@@ -0,0 +1,138 @@
+import time
+import logging
+import threading
+from datetime import date, timedelta
+
+from booking_dedup import normalize_phone
+
+logger = logging.getLogger(__name__)
+
+# Колонка телефона в строке заявки (см. functions.build_sheet_row)
+PHONE_COLUMN = 1
+
+
+class BookingMirror:
+    """Локальная копия таблицы заявок для поиска без чтения Google Sheets.
+
+    Строки хранятся в памяти в порядке таблицы, хэш-индексы — по нормализованному
+    телефону и по дате записи. sync() дочитывает только строки после уже
+    прочитанных (по номеру строки); раз в full_sync_interval секунд таблица
+    перечитывается целиком, чтобы учесть ручные правки и удаления.
+
+    fetch_rows(start_row) возвращает строки таблицы начиная с номера start_row (с 1),
+    row_slot(row) — время записи (datetime), row_date(row) — дату, если времени нет.
+    """
+
+    def __init__(self, fetch_rows, row_slot, row_date=None, full_sync_interval: float = 3600):
+        self.fetch_rows = fetch_rows
+        self.row_slot = row_slot
+        self.row_date = row_date
+        self.full_sync_interval = full_sync_interval
+        self.offset = 0  # номер последней прочитанной строки таблицы
+        self.synced_at = None
+        self.full_synced_at = None
+        self.sync_seconds = None
+        self.error = None
+        self._rows = []
+        self._slots = []  # datetime записи или None для каждой строки
+        self._by_phone = {}  # телефон -> номера строк (индексы в _rows)
+        self._by_date = {}  # дата -> номера строк
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def _keys(self, row: list):
+        """Телефон, время и дата записи строки (разбор вне блокировки)"""
+        phone = normalize_phone(row[PHONE_COLUMN]) if len(row) > PHONE_COLUMN else ''
+        slot = self.row_slot(row)
+        day = slot.date() if slot is not None else (self.row_date(row) if self.row_date else None)
+        return phone, slot, day
+
+    @staticmethod
+    def _index(rows: list, keys: list, target_rows: list, slots: list, by_phone: dict, by_date: dict):
+        for row, (phone, slot, day) in zip(rows, keys):
+            position = len(target_rows)
+            target_rows.append(row)
+            slots.append(slot)
+            if phone:
+                by_phone.setdefault(phone, []).append(position)
+            if day is not None:
+                by_date.setdefault(day, []).append(position)
+
+    def sync(self, full: bool = False) -> int:
+        """Дочитывает новые строки (или всю таблицу). Возвращает количество прочитанных строк"""
+        with self._sync_lock:
+            started = time.perf_counter()
+            full = (full or self.full_synced_at is None
+                    or time.time() - self.full_synced_at >= self.full_sync_interval)
+            try:
+                rows = self.fetch_rows(1 if full else self.offset + 1)
+            except Exception as e:
+                self.error = str(e)
+                raise
+            keys = [self._keys(row) for row in rows]
+            if full:
+                # Новая копия строится рядом и подменяет старую целиком
+                new_rows, slots, by_phone, by_date = [], [], {}, {}
+                self._index(rows, keys, new_rows, slots, by_phone, by_date)
+                with self._lock:
+                    self._rows, self._slots, self._by_phone, self._by_date = new_rows, slots, by_phone, by_date
+                self.offset = len(rows)
+                self.full_synced_at = time.time()
+            else:
+                with self._lock:
+                    self._index(rows, keys, self._rows, self._slots, self._by_phone, self._by_date)
+                self.offset += len(rows)
+            self.synced_at = time.time()
+            self.sync_seconds = round(time.perf_counter() - started, 4)
+            self.error = None
+        if rows:
+            logger.info(f"Копия таблицы заявок: прочитано строк {len(rows)} ({'полностью' if full else 'новые'}), "
+                        f"всего {self.offset}")
+        return len(rows)
+
+    def find_phone(self, phone: str) -> list:
+        """Заявки клиента по телефону (в любом формате), новые первыми: [(номер строки, строка, время)]"""
+        with self._lock:
+            positions = self._by_phone.get(normalize_phone(phone), ())
+            return [(position + 1, self._rows[position], self._slots[position]) for position in reversed(positions)]
+
+    def on_date(self, day: date) -> list:
+        """Заявки на дату, по времени записи: [(номер строки, строка, время)]"""
+        with self._lock:
+            found = [(position + 1, self._rows[position], self._slots[position])
+                     for position in self._by_date.get(day, ())]
+        return sorted(found, key=lambda item: (item[2] is None, item[2] or 0, item[0]))
+
+    def between(self, first: date, days: int) -> dict:
+        """Заявки за days дней начиная с first: {дата: [(номер строки, строка, время)]}, только непустые дни"""
+        result = {}
+        for offset in range(days):
+            day = first + timedelta(days=offset)
+            found = self.on_date(day)
+            if found:
+                result[day] = found
+        return result
+
+    def rows_since(self, first: date) -> list:
+        """Строки с записью на first и позже: [(строка, время)] — для загрузки календаря"""
+        with self._lock:
+            return [(self._rows[position], self._slots[position])
+                    for day, positions in self._by_date.items() if day >= first
+                    for position in positions]
+
+    @property
+    def size(self) -> int:
+        return len(self._rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            phones, dates = len(self._by_phone), len(self._by_date)
+        return {
+            'rows': self.size,
+            'phones': phones,
+            'dates': dates,
+            'synced_at': self.synced_at,
+            'full_synced_at': self.full_synced_at,
+            'sync_seconds': self.sync_seconds,
+            'error': self.error,
+        }
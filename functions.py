@@ -1,16 +1,37 @@
 import os
 import json
+import math
+import time
+import asyncio
 import logging
+import threading
 from dotenv import load_dotenv
 import pytz
-from datetime import datetime
+from datetime import datetime, timedelta
 
-# Google Sheets
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+# Google Sheets (клиент создаётся при первой записи)
+from sheets_client import LazySheetsClient
 
-# OpenAI Assistant
-import openai
+# OpenAI Assistant (модуль openai импортируется при первом запросе)
+from assistant_async import AsyncAssistantClient
+from llm_backend import ChatCompletionsBackend, FakeLLMBackend, StaticPrompt
+from workers import AssistantWorkerPool
+from sheets_spool import SheetsSpool
+from notifier import TelegramNotifier
+from answer_cache import AnswerCache
+from knowledge_index import KnowledgeIndex
+from session_store import create_session_store
+from thread_scheduler import ThreadRunScheduler
+from thread_prewarm import ThreadPrewarmer
+from thread_rollover import ThreadRollover
+from booking_extractor import BookingExtraction, feed_messages, message_text
+from booking_dedup import BookingDedupIndex, normalize_phone, normalize_text
+from slot_calendar import SlotCalendar, WEEKDAY_NAMES, format_slot, describe_slot, parse_workdays, parse_date
+from booking_mirror import BookingMirror
+from admission import AdmissionController, Limit, create_admission_store
+from resilience import CircuitBreaker, Deadline, RetryPolicy, call_with_retry
+from metrics import MetricsRegistry
+from structured_logging import setup_logging, log_settings
 
 # Telegram
 from telegram import Bot, Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
@@ -25,6 +46,8 @@ load_dotenv()
 
 # === Переменные окружения ===
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+# Адрес Bot API: свой Bot API сервер или локальная заглушка (benchmarks/fake_services.py)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
 TELEGRAM_GROUP_ID = os.getenv('TELEGRAM_GROUP_ID')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 OPENAI_ASSISTANT_ID = os.getenv('OPENAI_ASSISTANT_ID')
@@ -32,29 +55,243 @@ GOOGLE_SHEET_ID = os.getenv('GOOGLE_SHEET_ID')
 NGROK_URL = os.getenv('NGROK_URL')
 
 # === Логирование ===
-logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+# LOG_FORMAT: 'text' или 'json'; LOG_QUEUE=1 — вывод логов в фоновом потоке.
+# LOG_PAYLOADS=1 включает логирование содержимого сообщений (доля LOG_PAYLOAD_SAMPLE),
+# во время работы переключается через /admin/logging
+setup_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    fmt=os.getenv('LOG_FORMAT', 'text'),
+    use_queue=os.getenv('LOG_QUEUE', '1') == '1',
+    payloads=os.getenv('LOG_PAYLOADS', '0') == '1',
+    sample_rate=float(os.getenv('LOG_PAYLOAD_SAMPLE', '1'))
+)
 logger = logging.getLogger(__name__)
 
+# === Метрики процесса (текстовый формат Prometheus на /metrics) ===
+metrics = MetricsRegistry()
+assistant_phase_seconds = metrics.histogram(
+    'assistant_phase_seconds',
+    'Длительность этапов ответа Assistant: thread_create, message_create, run_queue, run, tool_call, messages_list',
+    ['phase']
+)
+sheets_save_seconds = metrics.histogram(
+    'sheets_save_seconds', 'Время сохранения заявки (save_application_to_sheets)', ['mode']
+)
+sheets_append_seconds = metrics.histogram(
+    'sheets_append_seconds', 'Время запроса values().append к Google Sheets'
+)
+sheets_errors_total = metrics.counter(
+    'sheets_errors_total', 'Ошибки записи заявок: save — сохранение заявки, append — запрос к Google Sheets', ['stage']
+)
+notification_send_seconds = metrics.histogram(
+    'telegram_notification_send_seconds', 'Время отправки уведомления в служебный чат Telegram', ['result']
+)
+sessions_count = metrics.gauge('sessions', 'Количество сессий в хранилище', ['namespace'])
+bookings_deduplicated_total = metrics.counter(
+    'bookings_deduplicated_total', 'Повторные заявки, не записанные в Google Sheets', ['source']
+)
+slot_conflicts_total = metrics.counter(
+    'slot_conflicts_total', 'Заявки на занятое, нерабочее или прошедшее время', ['status']
+)
+admission_rejected_total = metrics.counter(
+    'admission_rejected_total', 'Запросы к Assistant, отклонённые лимитами: ip, thread, user, inflight', ['reason']
+)
+
 # === Telegram Bot будет создан в main.py ===
 # bot = Bot(token=TELEGRAM_BOT_TOKEN)  # Убираем дублирование
 
+# === Сроки, повторы и предохранители для OpenAI и Google Sheets ===
+OPENAI_CALL_TIMEOUT = float(os.getenv('OPENAI_CALL_TIMEOUT', '30'))
+OPENAI_RUN_TIMEOUT = float(os.getenv('OPENAI_RUN_TIMEOUT', '90'))
+SHEETS_CALL_TIMEOUT = float(os.getenv('SHEETS_CALL_TIMEOUT', '20'))
+SHEETS_DEADLINE = float(os.getenv('SHEETS_DEADLINE', '45'))
+openai_retry = RetryPolicy(attempts=int(os.getenv('OPENAI_RETRIES', '3')))
+sheets_retry = RetryPolicy(attempts=int(os.getenv('SHEETS_RETRIES', '3')))
+# После BREAKER_FAILURES временных ошибок подряд вызовы сразу отклоняются на BREAKER_RESET секунд
+openai_breaker = CircuitBreaker(
+    'openai', failure_threshold=int(os.getenv('BREAKER_FAILURES', '5')),
+    reset_timeout=float(os.getenv('BREAKER_RESET', '30'))
+)
+sheets_breaker = CircuitBreaker(
+    'google_sheets', failure_threshold=int(os.getenv('BREAKER_FAILURES', '5')),
+    reset_timeout=float(os.getenv('BREAKER_RESET', '30'))
+)
+breakers = (openai_breaker, sheets_breaker)
+circuit_breaker_state = metrics.gauge(
+    'circuit_breaker_state', 'Состояние предохранителя: 0 — замкнут, 1 — пробный вызов, 2 — разомкнут', ['name']
+)
+for breaker in breakers:
+    circuit_breaker_state.set_function(
+        lambda breaker=breaker: (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN).index(breaker.state),
+        name=breaker.name
+    )
+
+def breakers_health() -> dict:
+    """Состояние предохранителей для /health"""
+    return {breaker.name: breaker.stats() for breaker in breakers}
+
 # === Инициализация OpenAI ===
-openai.api_key = OPENAI_API_KEY
+_openai_module = None
+
+def sync_openai():
+    """Модуль openai с настройками синхронного клиента.
+
+    Импорт openai занимает заметную часть запуска, поэтому выполняется при первом запросе.
+    """
+    global _openai_module
+    if _openai_module is None:
+        import openai
+        openai.api_key = OPENAI_API_KEY
+        # Повторы делает call_with_retry (с учётом предохранителя), а не SDK
+        openai.max_retries = 0
+        openai.timeout = OPENAI_CALL_TIMEOUT
+        _openai_module = openai
+    return _openai_module
+
+# Устанавливается после warm_up_clients (учитывается в /ready)
+clients_ready = threading.Event()
+
+def warm_up_clients():
+    """Импортирует openai и создаёт клиент Sheets фоном после запуска воркера.
+
+    Так первый запрос пользователя не ждёт импорта, а telegram_loop не блокируется на нём.
+    """
+    started = time.perf_counter()
+    try:
+        sync_openai()
+        try:
+            sheets_client.get()
+        except RuntimeError:
+            pass  # ошибка уже в логе и в /health; запись повторит попытку
+        logger.info("Клиенты OpenAI и Google Sheets подготовлены за %.0f мс", (time.perf_counter() - started) * 1000)
+    finally:
+        clients_ready.set()
+# Пул для ответов Assistant: общий лимит, лимит на пользователя и потоки для блокирующих вызовов
+assistant_pool = AssistantWorkerPool(
+    max_concurrent=int(os.getenv('ASSISTANT_MAX_CONCURRENT', '8')),
+    max_per_user=int(os.getenv('ASSISTANT_MAX_PER_USER', '3')),
+    max_pending=int(os.getenv('ASSISTANT_MAX_PENDING', '100')),
+    max_threads=int(os.getenv('ASSISTANT_THREAD_WORKERS', '8'))
+)
+# Допуск к Assistant: token buckets по IP, thread_id и пользователю Telegram
+# и общий для всех процессов лимит одновременных run (SQLite-файл RATE_LIMIT_DB_PATH)
+admission = AdmissionController(
+    create_admission_store(os.getenv('RATE_LIMIT_BACKEND', 'sqlite'), os.getenv('RATE_LIMIT_DB_PATH', 'rate_limits.db')),
+    max_inflight=int(os.getenv('ASSISTANT_MAX_INFLIGHT', '32')),
+    slot_ttl=float(os.getenv('ASSISTANT_SLOT_TTL', '180'))
+)
+# вид клиента -> (запросов в минуту, запросов подряд)
+RATE_LIMITS = {
+    'ip': (float(os.getenv('CHAT_RATE_PER_IP_PER_MIN', '20')), float(os.getenv('CHAT_BURST_PER_IP', '5'))),
+    'thread': (float(os.getenv('CHAT_RATE_PER_THREAD_PER_MIN', '10')), float(os.getenv('CHAT_BURST_PER_THREAD', '3'))),
+    'user': (float(os.getenv('TELEGRAM_RATE_PER_USER_PER_MIN', '10')), float(os.getenv('TELEGRAM_BURST_PER_USER', '3'))),
+}
+
+def admit_assistant_request(**clients):
+    """Проверяет лимиты клиентов (ip=..., thread=..., user=...) и занимает слот run.
+
+    Возвращает Decision; при допуске слот (decision.slot) освобождается через admission.release.
+    """
+    limits = []
+    for kind, client in clients.items():
+        if client:
+            per_min, burst = RATE_LIMITS[kind]
+            limits.append(Limit(f"{kind}:{client}", per_min / 60, burst))
+    decision = admission.admit(limits)
+    if not decision:
+        admission_rejected_total.inc(reason=decision.reason)
+        logger.warning("Запрос к Assistant отклонён лимитом %s, повтор через %.1f с", decision.reason, decision.retry_after)
+    return decision
+
+async def release_after_run(coro, slot):
+    """Ждёт корутину ответа и освобождает слот run, когда она завершится.
+
+    Слот держится до конца run, а не до таймаута вызывающего потока: иначе
+    ASSISTANT_MAX_INFLIGHT недосчитывал бы продолжающиеся run. Освобождение (SQLite) — в пуле.
+    """
+    try:
+        return await coro
+    finally:
+        await asyncio.shield(assistant_pool.run_blocking(admission.release, slot))
+
+# thread_id -> задача, дописывающая в выданный из запаса thread ответ из кэша
+thread_seeding = {}
+
+async def seed_thread(thread_id: str, messages: list):
+    """Дописывает сообщения в thread (фоном, пока пользователь читает ответ)"""
+    try:
+        for item in messages:
+            await assistant_client.add_message(thread_id, item["content"], role=item["role"])
+    except Exception as e:
+        logger.error(f"Не удалось дописать ответ из кэша в thread {thread_id}: {e}")
+    finally:
+        thread_seeding.pop(thread_id, None)
+
+async def new_thread(messages: list = None):
+    """Новый thread: из запаса (сообщения дописываются фоном) или через threads.create()"""
+    thread_id = thread_prewarmer.acquire()
+    if thread_id is None:
+        with assistant_phase_seconds.time(phase='thread_create'):
+            return await assistant_client.create_thread(messages)
+    if messages:
+        thread_seeding[thread_id] = asyncio.get_running_loop().create_task(seed_thread(thread_id, messages))
+    return thread_id
+
+# === Кэш ответов на первые вопросы ===
+KNOWLEDGE_FILE = 'knowledge.txt'
+PROMPT_FILE = 'промпт.txt'
+answer_cache = AnswerCache(
+    maxsize=int(os.getenv('ANSWER_CACHE_SIZE', '500')),
+    ttl=float(os.getenv('ANSWER_CACHE_TTL', str(6 * 3600))),
+    watch_files=[KNOWLEDGE_FILE, PROMPT_FILE]
+)
+
+# === Локальный индекс базы знаний для быстрых ответов на вопросы FAQ ===
+FAQ_FAST_PATH = os.getenv('FAQ_FAST_PATH', '1') == '1'
+# Сколько разделов базы знаний передавать Assistant вместе с вопросом (0 — не передавать)
+KNOWLEDGE_PASSAGES = int(os.getenv('KNOWLEDGE_PASSAGES', '0'))
+knowledge_index = KnowledgeIndex(KNOWLEDGE_FILE)
+
+def quick_answer(message: str):
+    """Ответ на первый вопрос без Assistant: из кэша или из базы знаний. None — нужен Assistant"""
+    cached_answer = answer_cache.get(message)
+    if cached_answer:
+        logger.info("Ответ на первый вопрос взят из кэша")
+        return cached_answer
+    if FAQ_FAST_PATH:
+        section = knowledge_index.answer(message)
+        if section:
+            logger.info(f"Ответ на первый вопрос взят из базы знаний: '{section.question}'")
+            return section.answer
+    return None
+
+def knowledge_run_options(message: str):
+    """Дополнительные инструкции run с подходящими разделами базы знаний"""
+    if not KNOWLEDGE_PASSAGES:
+        return {}
+    passages = knowledge_index.passages(message, KNOWLEDGE_PASSAGES)
+    if not passages:
+        return {}
+    return {
+        "additional_instructions": "Фрагменты базы знаний, относящиеся к вопросу клиента:\n\n" + "\n\n".join(passages)
+    }
+
+def cached_thread_messages(message: str, answer: str):
+    """Сообщения для нового thread, чтобы ответ из кэша остался в контексте диалога"""
+    return [
+        {"role": "user", "content": message},
+        {"role": "assistant", "content": answer}
+    ]
 
 # === Инициализация Google Sheets ===
 GOOGLE_SERVICE_ACCOUNT_FILE = 'assistent-jura-2cef395ce813.json'
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+# Другой адрес Sheets API, например локальная заглушка (benchmarks/fake_services.py)
+GOOGLE_SHEETS_API_URL = os.getenv('GOOGLE_SHEETS_API_URL')
 
-try:
-    credentials = service_account.Credentials.from_service_account_file(
-        GOOGLE_SERVICE_ACCOUNT_FILE, scopes=SCOPES
-    )
-    sheets_service = build('sheets', 'v4', credentials=credentials)
-    sheet = sheets_service.spreadsheets()
-    logger.info("Google Sheets API инициализирован")
-except Exception as e:
-    logger.error(f"Ошибка инициализации Google Sheets: {e}")
-    sheet = None
+sheets_client = LazySheetsClient(
+    GOOGLE_SERVICE_ACCOUNT_FILE, SCOPES, api_url=GOOGLE_SHEETS_API_URL, timeout=SHEETS_CALL_TIMEOUT
+)
 
 # === Клавиатуры ===
 main_keyboard = ReplyKeyboardMarkup([
@@ -81,51 +318,423 @@ service_keyboard = ReplyKeyboardMarkup(
 )
 
 # === Хранилище данных пользователей ===
-user_data = {}  # user_id -> данные заявки
-user_threads = {}  # user_id -> thread_id для OpenAI
+# Пространства имён: 'booking' — user_id -> черновик заявки, 'thread' — user_id -> thread_id для OpenAI,
+# 'extraction' — thread_id -> состояние извлечения данных записи из переписки,
+# 'thread_usage' — thread_id -> длина thread и токены контекста, 'thread_alias' — прежний thread_id -> новый
+# 'memory' или 'sqlite'; в многопроцессном режиме сессии должны быть общими для воркеров.
+# Из event loop хранилище вызывается через assistant_pool.run_blocking: SQLite может ждать блокировку до 10 с
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlite' if os.getenv('MULTIPROCESS', '0') == '1' else 'memory')
+BOOKING_TTL = float(os.getenv('BOOKING_SESSION_TTL', str(24 * 3600)))
+THREAD_TTL = float(os.getenv('THREAD_SESSION_TTL', str(30 * 24 * 3600)))
+sessions = create_session_store(
+    SESSION_BACKEND,
+    path=os.getenv('SESSION_DB_PATH', 'sessions.db'),
+    maxsize=int(os.getenv('SESSION_MAX_ENTRIES', '10000'))
+)
+sessions.start_eviction(float(os.getenv('SESSION_EVICTION_INTERVAL', '60')))
+for namespace in ('booking', 'thread', 'extraction', 'thread_usage', 'chat_history'):
+    sessions_count.set_function(lambda namespace=namespace: sessions.size(namespace), namespace=namespace)
 
-# === Функция: сохранение заявки в Google Sheets ===
-def save_application_to_sheets(data: dict):
-    """Сохраняет заявку в Google Таблицу"""
-    if not sheet:
-        logger.error("Google Sheets не инициализирован")
-        return None
+def merge_booking_draft(user_id, fields: dict):
+    """Дополняет черновик заявки пользователя и возвращает его (блокирующий вызов хранилища)"""
+    draft = sessions.get('booking', user_id) or {}
+    draft.update(fields)
+    sessions.set('booking', user_id, draft, ttl=BOOKING_TTL)
+    return draft
+
+async def update_booking_draft(user_id, **fields):
+    """Дополняет черновик заявки пользователя и возвращает его"""
+    return await assistant_pool.run_blocking(merge_booking_draft, user_id, fields)
+
+# === Перенос длинных диалогов в новый thread ===
+# Run обрабатывает всю историю thread: после порога диалог продолжается в новом thread
+# с кратким содержанием (THREAD_ROLLOVER=0 — без переноса)
+THREAD_ROLLOVER = os.getenv('THREAD_ROLLOVER', '1') == '1'
+thread_rollover = ThreadRollover(
+    max_messages=int(os.getenv('THREAD_MAX_MESSAGES', '40')),
+    max_tokens=int(os.getenv('THREAD_MAX_TOKENS', '12000')),
+    keep_messages=int(os.getenv('THREAD_KEEP_MESSAGES', '6'))
+)
+thread_messages = metrics.histogram(
+    'assistant_thread_messages', 'Сообщений в thread после run', buckets=(2, 5, 10, 20, 40, 80, 160, 320)
+)
+thread_prompt_tokens = metrics.histogram(
+    'assistant_thread_prompt_tokens', 'Токены контекста run (prompt_tokens)',
+    buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+)
+thread_rollovers_total = metrics.counter(
+    'thread_rollovers_total', 'Переносы длинных диалогов в новый thread: ok, failed', ['result']
+)
+# thread_id -> задача переноса (одна на thread, даже если сообщения пришли одновременно)
+thread_rollovers = {}
+# Ограничение цепочки прежний thread -> новый при поиске актуального thread
+MAX_THREAD_ALIASES = 10
+
+def record_thread_run(thread_id: str, messages: list, response_text: str, run_seconds: float, usage=None):
+    """Учитывает run в thread: сообщения пачки и ответ, токены контекста, время run"""
+    chars = sum(len(message) for message in messages) + len(response_text or '')
+    state = thread_rollover.record_run(
+        sessions.get('thread_usage', thread_id), len(messages) + 1, chars, run_seconds,
+        getattr(usage, 'prompt_tokens', None)
+    )
+    sessions.set('thread_usage', thread_id, state, ttl=THREAD_TTL)
+    thread_messages.observe(state['messages'])
+    thread_prompt_tokens.observe(state['prompt_tokens'])
+
+def resolve_thread_alias(thread_id: str) -> str:
+    """Актуальный thread диалога по цепочке переносов (блокирующий вызов хранилища)"""
+    for _ in range(MAX_THREAD_ALIASES):
+        alias = sessions.get('thread_alias', thread_id)
+        if not alias:
+            break
+        thread_id = alias
+    return thread_id
+
+async def current_thread(thread_id: str) -> str:
+    """Thread для нового сообщения диалога: прежний или новый, если история превысила порог"""
+    thread_id = await assistant_pool.run_blocking(resolve_thread_alias, thread_id)
+    if not THREAD_ROLLOVER:
+        return thread_id
+    task = thread_rollovers.get(thread_id)
+    if task is None:
+        usage = await assistant_pool.run_blocking(sessions.get, 'thread_usage', thread_id)
+        # Пока читали usage, перенос могло начать другое сообщение того же thread
+        task = thread_rollovers.get(thread_id)
+    if task is None:
+        # Во время run история меняется: перенос — со следующим сообщением
+        if not thread_rollover.due(usage) or thread_scheduler.busy(thread_id):
+            return thread_id
+        task = asyncio.get_running_loop().create_task(roll_over_thread(thread_id, usage))
+        thread_rollovers[thread_id] = task
+        task.add_done_callback(lambda _: thread_rollovers.pop(thread_id, None))
+    return await asyncio.shield(task)
+
+async def roll_over_thread(thread_id: str, usage: dict) -> str:
+    """Переносит диалог в новый thread с кратким содержанием; при ошибке диалог остаётся в прежнем"""
+    try:
+        history = [message async for message in assistant_client.iter_messages(thread_id)]
+        # Данные записи дочитываются из сообщений, ещё не разобранных извлечением
+        extraction = await assistant_pool.run_blocking(load_booking_extraction, thread_id)
+        ids = [message.id for message in history]
+        start = ids.index(extraction.last_message_id) + 1 if extraction.last_message_id in ids else 0
+        feed_messages(extraction, history[start:])
+        summary = thread_rollover.summary(extraction, [(message.role, message_text(message)) for message in history])
+        new_thread_id = await new_thread([{"role": "assistant", "content": summary}])
+    except Exception as e:
+        thread_rollover.failed()
+        thread_rollovers_total.inc(result='failed')
+        logger.error(f"Не удалось перенести диалог из thread {thread_id}: {e}")
+        return thread_id
+    # В новом thread краткое содержание — сообщение ассистента, извлечение его не разбирает
+    extraction.last_message_id = None
+    await assistant_pool.run_blocking(
+        store_rolled_over_thread, thread_id, new_thread_id, extraction, thread_rollover.rolled_over(usage, summary)
+    )
+    thread_rollovers_total.inc(result='ok')
+    logger.info(f"Диалог перенесён из thread {thread_id} ({usage.get('messages', 0)} сообщений, "
+                f"~{usage.get('prompt_tokens', 0)} токенов) в {new_thread_id}")
+    return new_thread_id
+
+def store_rolled_over_thread(thread_id: str, new_thread_id: str, extraction: BookingExtraction, usage: dict):
+    """Записывает состояние нового thread и ссылку на него из прежнего (блокирующий вызов хранилища)"""
+    store_booking_extraction(new_thread_id, extraction)
+    sessions.set('thread_usage', new_thread_id, usage, ttl=THREAD_TTL)
+    sessions.set('thread_alias', thread_id, new_thread_id, ttl=THREAD_TTL)
+
+# === Функция: подготовка строки заявки для Google Sheets ===
+def build_sheet_row(data: dict):
+    """Формирует строку таблицы из данных заявки"""
+    # Обрабатываем данные перед записью
+    documents = data.get('documents', '').strip()
+    if not documents or documents.lower() in ['нет', 'no', '']:
+        documents = 'нет'
+        
+    comment = data.get('comment', '').strip()  
+    if not comment or comment.lower() in ['нет', 'no', '']:
+        comment = 'нет'
         
+    source = data.get('source', '')
+    if source == 'Телеграм':
+        source = 'Телеграм'
+    elif source == 'website':
+        source = 'Виджет'
+    elif source == 'Виджет':
+        source = 'Виджет'
+    
+    return [
+        data.get('name', ''),
+        data.get('phone', ''),
+        data.get('service', ''),
+        data.get('date', ''),
+        documents,
+        comment,
+        source,
+        datetime.now(pytz.timezone('Europe/Moscow')).strftime('%Y-%m-%d %H:%M:%S')
+    ]
+
+# === Функция: прямая запись строк в Google Sheets ===
+def append_rows_to_sheets(rows: list):
+    """Добавляет строки в Google Таблицу одним запросом (исключение при ошибке)"""
     try:
-        # Обрабатываем данные перед записью
-        documents = data.get('documents', '').strip()
-        if not documents or documents.lower() in ['нет', 'no', '']:
-            documents = 'нет'
-            
-        comment = data.get('comment', '').strip()  
-        if not comment or comment.lower() in ['нет', 'no', '']:
-            comment = 'нет'
-            
-        source = data.get('source', '')
-        if source == 'Телеграм':
-            source = 'Телеграм'
-        elif source == 'website':
-            source = 'Виджет'
-        elif source == 'Виджет':
-            source = 'Виджет'
+        sheet = sheets_client.get()
+    except RuntimeError:
+        sheets_errors_total.inc(stage='append')
+        raise
         
-        values = [[
-            data.get('name', ''),
-            data.get('phone', ''),
-            data.get('service', ''),
-            data.get('date', ''),
-            documents,
-            comment,
-            source,
-            datetime.now(pytz.timezone('Europe/Moscow')).strftime('%Y-%m-%d %H:%M:%S')
-        ]]
+    request = sheet.values().append(
+        spreadsheetId=GOOGLE_SHEET_ID,
+        range='A1',
+        valueInputOption='USER_ENTERED',
+        body={'values': rows}
+    )
+    try:
+        with sheets_append_seconds.time():
+            return call_with_retry(
+                lambda: sheets_client.execute(request), sheets_retry, sheets_breaker, Deadline(SHEETS_DEADLINE),
+                name='Google Sheets append'
+            )
+    except Exception:
+        sheets_errors_total.inc(stage='append')
+        raise
+
+# === Локальная очередь записи в Google Sheets ===
+# 'spool' — заявка сохраняется локально и пишется в таблицу фоновым потоком пачками,
+# 'direct' — запись в таблицу прямо в запросе (как раньше)
+SHEETS_WRITE_MODE = os.getenv('SHEETS_WRITE_MODE', 'spool')
+sheets_spool = SheetsSpool(
+    os.getenv('SHEETS_SPOOL_PATH', 'sheets_spool.db'),
+    append_rows_to_sheets,
+    batch_size=int(os.getenv('SHEETS_BATCH_SIZE', '50')),
+    flush_interval=float(os.getenv('SHEETS_FLUSH_INTERVAL', '2'))
+)
+
+def sheets_health() -> dict:
+    """Состояние записи в Google Sheets для /health"""
+    return {
+        'client': sheets_client.state,
+        'client_init_seconds': sheets_client.init_seconds,
+        'client_error': sheets_client.error,
+        'write_mode': SHEETS_WRITE_MODE,
+        'spool': sheets_spool.stats(),
+    }
+
+# === Защита от повторной записи заявок ===
+# Одна и та же заявка (телефон, услуга, дата или ключ идемпотентности) в пределах окна записывается один раз
+booking_dedup = BookingDedupIndex(
+    os.getenv('BOOKING_DEDUP_PATH', 'booking_dedup.db'),
+    window=float(os.getenv('BOOKING_DEDUP_WINDOW', str(24 * 3600))),
+    maxsize=int(os.getenv('BOOKING_DEDUP_MAX_ENTRIES', '100000'))
+)
+
+def is_duplicate(result) -> bool:
+    """Результат save_application_to_sheets для уже принятой заявки"""
+    return isinstance(result, dict) and result.get('duplicate', False)
+
+# === Календарь записи ===
+# Занятое время в памяти процесса: проверка и подбор свободного времени без чтения таблицы;
+# время новых заявок занимается и в booking_dedup.db, общей для воркеров gunicorn
+SLOT_CALENDAR = os.getenv('SLOT_CALENDAR', '1') == '1'
+slot_calendar = SlotCalendar(
+    slot_minutes=int(os.getenv('SLOT_MINUTES', '60')),
+    open_hour=int(os.getenv('WORK_OPEN_HOUR', '10')),
+    close_hour=int(os.getenv('WORK_CLOSE_HOUR', '19')),
+    workdays=parse_workdays(os.getenv('WORK_DAYS', '0-4')),
+    capacity=int(os.getenv('SLOT_CAPACITY', '1')),
+    lead_minutes=int(os.getenv('SLOT_LEAD_MINUTES', '60')),
+    shared=booking_dedup
+)
+metrics.gauge('slot_calendar_bookings', 'Записи в календаре').set_function(lambda: slot_calendar.size)
+# Колонки заявки в таблице (см. build_sheet_row): D — дата и время, H — время создания заявки
+SHEET_LAST_COLUMN = os.getenv('GOOGLE_SHEET_LAST_COLUMN', 'H')
+SLOT_STATUS_TEXT = {
+    SlotCalendar.BUSY: 'Это время уже занято',
+    SlotCalendar.CLOSED: 'В это время приёма нет',
+    SlotCalendar.PAST: 'Это время уже прошло',
+    SlotCalendar.UNKNOWN: 'Календарь записи ещё загружается, занятость времени пока неизвестна',
+}
+
+def read_sheet_rows(range_name: str) -> list:
+    """Читает строки таблицы заявок (values().get)"""
+    request = sheets_client.get().values().get(spreadsheetId=GOOGLE_SHEET_ID, range=range_name)
+    result = call_with_retry(
+        lambda: sheets_client.execute(request), sheets_retry, sheets_breaker, Deadline(SHEETS_DEADLINE),
+        name='Google Sheets get'
+    )
+    return result.get('values', [])
+
+def read_sheet_rows_from(start_row: int) -> list:
+    """Строки таблицы заявок начиная с номера start_row (с 1)"""
+    return read_sheet_rows(f"A{start_row}:{SHEET_LAST_COLUMN}")
+
+def booking_row_created(row: list):
+    if len(row) >= 8:
+        try:
+            return datetime.strptime(row[7], '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            pass
+    return None
+
+def booking_row_slot(row: list):
+    """Время записи из строки таблицы; относительные даты («завтра») — от времени создания заявки"""
+    if len(row) < 4:
+        return None
+    return slot_calendar.parse(row[3], booking_row_created(row))
+
+def booking_row_date(row: list):
+    """Дата записи из строки без распознанного времени («25.12», «в пятницу»)"""
+    if len(row) < 4:
+        return None
+    created = booking_row_created(row) or slot_calendar.now()
+    return parse_date(row[3].lower().replace('ё', 'е'), created.date())
+
+# === Копия таблицы заявок ===
+# Строки таблицы в памяти процесса с индексами по телефону и дате: календарь и команды
+# сотрудников (/find, /day, /week) читают её, а не Google Sheets
+BOOKINGS_SYNC_INTERVAL = float(os.getenv('BOOKINGS_SYNC_INTERVAL', os.getenv('SLOT_CALENDAR_REFRESH', '60')))
+booking_mirror = BookingMirror(
+    read_sheet_rows_from, booking_row_slot, booking_row_date,
+    full_sync_interval=float(os.getenv('BOOKINGS_FULL_SYNC_INTERVAL', '3600'))
+)
+metrics.gauge('booking_mirror_rows', 'Строки в копии таблицы заявок').set_function(lambda: booking_mirror.size)
+booking_mirror_sync_seconds = metrics.histogram(
+    'booking_mirror_sync_seconds', 'Длительность синхронизации копии таблицы заявок', ['mode']
+)
+
+def load_slot_calendar(pending: list, started: float, full: bool = False):
+    """Загружает календарь из копии таблицы и строк локальной очереди записи"""
+    since = slot_calendar.now() - timedelta(days=1)
+    seen = set()
+    slots = []
+    rows = [(row, booking_row_slot(row)) for row in pending] + booking_mirror.rows_since(since.date())
+    for row, slot in rows:
+        key = tuple(row)
+        if key in seen:
+            continue
+        seen.add(key)
+        if slot is not None and slot >= since:
+            slots.append(slot)
+    slot_calendar.load(slots, started, full)
+    logger.info(f"Календарь записи загружен: {len(slots)} записей за {slot_calendar.load_seconds * 1000:.0f} мс")
+
+def sync_bookings() -> bool:
+    """Дочитывает копию таблицы заявок и перезагружает из неё календарь"""
+    started = time.perf_counter()
+    full_synced_at = booking_mirror.full_synced_at
+    if SLOT_CALENDAR:
+        slot_calendar.begin_load()
+    try:
+        # Сначала очередь, потом таблица: строка, записанная между чтениями, не потеряется
+        pending = sheets_spool.pending_rows() if SLOT_CALENDAR else []
+        booking_mirror.sync()
+    except Exception as e:
+        if SLOT_CALENDAR:
+            slot_calendar.load_failed(e)
+        logger.error(f"Не удалось обновить копию таблицы заявок: {e}")
+        return False
+    full = booking_mirror.full_synced_at != full_synced_at
+    booking_mirror_sync_seconds.observe(booking_mirror.sync_seconds, mode='full' if full else 'incremental')
+    if SLOT_CALENDAR:
+        load_slot_calendar(pending, started, full)
+    return True
+
+def run_bookings_sync():
+    """Синхронизирует копию таблицы при запуске и затем каждые BOOKINGS_SYNC_INTERVAL секунд"""
+    while True:
+        synced = sync_bookings()
+        if BOOKINGS_SYNC_INTERVAL <= 0 and synced:
+            return
+        # После ошибки — повтор через минуту
+        time.sleep(BOOKINGS_SYNC_INTERVAL if synced and BOOKINGS_SYNC_INTERVAL > 0 else 60)
+
+def start_bookings_sync():
+    """Запускает синхронизацию копии таблицы и календаря фоном (вызывается при запуске воркера)"""
+    threading.Thread(target=run_bookings_sync, name='bookings-sync', daemon=True).start()
+
+def free_slot_texts(after: datetime = None, count: int = 3) -> list:
+    return [format_slot(slot) for slot in slot_calendar.free_slots(after, count)]
+
+def is_slot_taken(result) -> bool:
+    """Результат save_application_to_sheets для занятого (нерабочего, прошедшего) времени"""
+    return isinstance(result, dict) and result.get('slot_taken', False)
+
+def slot_unavailable_text(status: str, alternatives: list) -> str:
+    """Сообщение клиенту о недоступном времени с вариантами"""
+    text = SLOT_STATUS_TEXT[status]
+    if status == SlotCalendar.CLOSED:
+        text += f" (приём: {slot_calendar.working_hours_text()})"
+    if alternatives:
+        text += ". Свободное время: " + ", ".join(alternatives)
+    return text + "."
+
+def slot_keyboard(slots: list):
+    """Кнопки со свободным временем для шага выбора даты"""
+    if not slots:
+        return ReplyKeyboardRemove()
+    return ReplyKeyboardMarkup([[slot] for slot in slots], resize_keyboard=True, one_time_keyboard=True)
+
+# === Функция: сохранение заявки в Google Sheets ===
+def save_application_to_sheets(data: dict, idempotency_key: str = None, enforce_slot: bool = True):
+    """Сохраняет заявку в Google Таблицу.
+
+    Повтор уже принятой заявки не записывается: возвращается {'duplicate': True}.
+    Распознанные дата и время записываются как ДД.ММ.ГГГГ ЧЧ:ММ; если это время
+    недоступно, возвращается {'slot_taken': True, 'status', 'alternatives'}
+    (enforce_slot=False — заявка записывается всё равно, с предупреждением в логе).
+    """
+    slot = slot_calendar.parse(data.get('date', '')) if SLOT_CALENDAR else None
+    if slot is not None:
+        data = dict(data, date=format_slot(slot))
+    try:
+        keys = booking_dedup.keys(data, idempotency_key)
+        claimed = booking_dedup.claim(keys)
+    except Exception as e:
+        # Без индекса лучше записать заявку повторно, чем потерять её
+        logger.error(f"Ошибка индекса повторных заявок: {e}")
+        keys, claimed = None, True
+    if not claimed:
+        logger.info(f"Повторная заявка не записана: {data.get('name', 'Без имени')} ({data.get('source', '')})")
+        bookings_deduplicated_total.inc(source=data.get('source', ''))
+        return {'duplicate': True}
+    
+    if slot is not None:
+        status = slot_calendar.reserve(slot)
+        if status == SlotCalendar.UNKNOWN:
+            # Календарь ещё не загружен из таблицы: время проверено только по заявкам воркеров сервиса
+            logger.warning(f"Календарь не загружен, время {data['date']} не сверено с таблицей")
+        elif status != SlotCalendar.FREE:
+            slot_conflicts_total.inc(status=status)
+            if enforce_slot:
+                logger.info(f"Время {data['date']} недоступно ({status}), заявка не записана")
+                if keys:
+                    booking_dedup.release(keys)
+                return {'slot_taken': True, 'status': status, 'alternatives': free_slot_texts(slot)}
+            logger.warning(f"Заявка на недоступное время {data['date']} ({status}) записана: нужна проверка")
+            slot_calendar.add(slot)
+    
+    with sheets_save_seconds.time(mode=SHEETS_WRITE_MODE):
+        result = write_application(data)
+    if not result:
+        sheets_errors_total.inc(stage='save')
+        if keys:
+            # Запись не удалась — повтор этой заявки должен пройти
+            booking_dedup.release(keys)
+        if slot is not None:
+            slot_calendar.release(slot)
+    return result
+
+def write_application(data: dict):
+    """Записывает заявку в очередь или напрямую в таблицу (в зависимости от SHEETS_WRITE_MODE)"""
+    if SHEETS_WRITE_MODE == 'spool':
+        try:
+            spool_id = sheets_spool.enqueue(build_sheet_row(data))
+            logger.info(f"Заявка поставлена в очередь Google Sheets (#{spool_id}): {data.get('name', 'Без имени')}")
+            return {'spooled': spool_id}
+        except Exception as e:
+            logger.error(f"Ошибка сохранения заявки в локальную очередь: {e}")
+            return None
         
-        result = sheet.values().append(
-            spreadsheetId=GOOGLE_SHEET_ID,
-            range='A1',
-            valueInputOption='USER_ENTERED',
-            body={'values': values}
-        ).execute()
+    try:
+        result = append_rows_to_sheets([build_sheet_row(data)])
         
         logger.info(f"Заявка сохранена в Google Sheets: {data.get('name', 'Без имени')}")
         return result
@@ -135,27 +744,133 @@ def save_application_to_sheets(data: dict):
         return None
 
 # === Функция: отправка уведомления в Telegram группу ===
-def send_telegram_notification(text: str, bot=None):
-    """Отправляет уведомление в служебный Telegram чат"""
+# Постоянный отправщик уведомлений: запускается в telegram_loop (см. main.run_telegram_loop)
+notifier = TelegramNotifier(
+    TELEGRAM_GROUP_ID,
+    global_rate=float(os.getenv('TELEGRAM_GLOBAL_RATE', '30')),
+    chat_rate=float(os.getenv('TELEGRAM_CHAT_RATE_PER_MIN', '20')) / 60,
+    latency=notification_send_seconds
+)
+
+async def send_notification_once(text: str):
+    """Отправляет уведомление отдельным короткоживущим Bot.
+
+    Bot приложения не подходит: его shutdown() закрыл бы HTTP клиент, с которым работает Application.
+    """
     try:
-        if bot:
-            import asyncio
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                loop.run_until_complete(bot.initialize())
-                loop.run_until_complete(bot.send_message(chat_id=TELEGRAM_GROUP_ID, text=text))
-                loop.run_until_complete(bot.shutdown())
-                logger.info("Уведомление отправлено в Telegram группу")
-            finally:
-                loop.close()
-        else:
-            logger.warning("Bot не передан для отправки уведомления")
+        async with Bot(TELEGRAM_BOT_TOKEN, base_url=f"{TELEGRAM_API_URL}/bot") as own_bot:
+            await own_bot.send_message(chat_id=TELEGRAM_GROUP_ID, text=text)
+        logger.info("Уведомление отправлено в Telegram группу")
     except Exception as e:
         logger.error(f"Ошибка отправки в Telegram: {e}")
 
+# Запасные отправки уведомлений, запущенные внутри event loop (ссылки держатся до завершения)
+notification_tasks = set()
+
+def send_telegram_notification(text: str):
+    """Отправляет уведомление в служебный Telegram чат"""
+    # Основной путь: очередь постоянного отправщика в telegram_loop
+    if notifier.notify(text):
+        return
+    # Запасной путь, если telegram_loop ещё не запущен
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(send_notification_once(text))
+    else:
+        task = loop.create_task(send_notification_once(text))
+        notification_tasks.add(task)
+        task.add_done_callback(notification_tasks.discard)
+
 # === Функция: обработка OpenAI function calls ===
-def handle_function_call(function_name: str, arguments: dict, source: str = 'Виджет'):
+# Описание функции check_availability для настроек Assistant (tools), рядом с save_booking_data
+CHECK_AVAILABILITY_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "check_availability",
+        "description": "Проверяет, свободно ли время записи к адвокату, и подбирает ближайшее свободное время. "
+                       "Вызывай перед тем, как предложить или подтвердить клиенту дату и время.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "datetime": {
+                    "type": "string",
+                    "description": "Желаемые дата и время клиента как есть (например, '25.12 15:00', 'завтра в 11'). "
+                                   "Пусто — подобрать ближайшее свободное время"
+                },
+                "count": {"type": "integer", "description": "Сколько вариантов свободного времени вернуть (1–10)"}
+            },
+            "required": []
+        }
+    }
+}
+
+# Описание функции save_booking_data (для бэкенда 'chat'; в Assistant настроена так же)
+SAVE_BOOKING_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "save_booking_data",
+        "description": "Сохраняет заявку клиента на приём к адвокату. Вызывай, когда собраны имя, телефон, "
+                       "услуга, дата и время (время предварительно проверено через check_availability).",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string", "description": "Имя клиента"},
+                "phone": {"type": "string", "description": "Номер телефона клиента"},
+                "service": {"type": "string", "description": "Услуга, на которую записывается клиент"},
+                "datetime": {"type": "string", "description": "Дата и время приёма, например '25.12.2025 15:00'"},
+                "documents": {"type": "string", "description": "Документы, которые клиент принесёт (или 'нет')"},
+                "comments": {"type": "string", "description": "Суть вопроса и пожелания клиента (или 'нет')"}
+            },
+            "required": ["name", "phone", "service", "datetime"]
+        }
+    }
+}
+
+def check_availability(text: str = '', count: int = 3):
+    """Свободно ли время из text и ближайшее свободное время (функция Assistant check_availability)"""
+    try:
+        count = max(1, min(10, int(count or 3)))
+    except (TypeError, ValueError):
+        count = 3
+    hours = slot_calendar.working_hours_text()
+    if not (text or '').strip():
+        if not slot_calendar.loaded:
+            return {"success": True, "status": SlotCalendar.UNKNOWN, "free_slots": [], "working_hours": hours,
+                    "message": SLOT_STATUS_TEXT[SlotCalendar.UNKNOWN] + "."}
+        free = free_slot_texts(count=count)
+        return {"success": True, "free_slots": free, "working_hours": hours,
+                "message": "Ближайшее свободное время: " + ", ".join(free) if free else "Свободного времени нет"}
+    slot = slot_calendar.parse(text)
+    if slot is None:
+        return {"success": False, "working_hours": hours,
+                "message": "Не удалось распознать дату и время. Уточните у клиента день и время (например, 25.12 15:00)."}
+    status = slot_calendar.check(slot)
+    if status == SlotCalendar.FREE:
+        return {"success": True, "available": True, "datetime": format_slot(slot), "working_hours": hours,
+                "message": f"Время {describe_slot(slot)} свободно."}
+    free = free_slot_texts(slot, count)
+    # unknown: календарь не загружен, занято ли время — неизвестно
+    return {"success": True, "available": None if status == SlotCalendar.UNKNOWN else False, "status": status, "datetime": format_slot(slot),
+            "free_slots": free, "working_hours": hours, "message": slot_unavailable_text(status, free)}
+
+def booking_idempotency_key(booking_data: dict, thread_id: str = None, tool_call_id: str = None):
+    """Ключ идемпотентности заявки из диалога, общий для save_booking_data и разбора переписки.
+
+    Отпечаток (телефон, услуга, дата) повтор не ловит: при разборе переписки услугой
+    часто становится первое сообщение клиента, а функция получает настоящую услугу.
+    Поэтому ключ — thread, телефон и время записи (дата разобрана календарём, чтобы
+    «25 декабря в 15:00» и «25.12 15:00» совпали): другая запись в том же thread не повтор.
+    """
+    if thread_id:
+        date_text = booking_data.get('date', '')
+        slot = slot_calendar.parse(date_text)
+        when = format_slot(slot) if slot else normalize_text(date_text)
+        return f"thread:{thread_id}:{normalize_phone(booking_data.get('phone', ''))}:{when}"
+    return f"tool:{tool_call_id}" if tool_call_id else None
+
+def handle_function_call(function_name: str, arguments: dict, source: str = 'Виджет', tool_call_id: str = None,
+                         thread_id: str = None):
     """Обрабатывает вызовы функций от OpenAI Assistant"""
     try:
         if function_name == "save_booking_data":
@@ -192,20 +907,36 @@ def handle_function_call(function_name: str, arguments: dict, source: str = 'В
                 'source': source,  # Используем переданный источник
             }
             
-            # Сохраняем в Google Sheets
-            result = save_application_to_sheets(booking_data)
+            # Сохраняем в Google Sheets (повторный вызов в том же thread не создаст вторую заявку)
+            result = save_application_to_sheets(booking_data, idempotency_key=booking_idempotency_key(booking_data, thread_id, tool_call_id))
             
-            if result:
+            if is_duplicate(result):
+                return {
+                    "success": True,
+                    "message": "Эта заявка уже сохранена в системе, повторно оформлять её не нужно. Мы свяжемся с клиентом для уточнения деталей.",
+                    "client_message": "Ваша заявка уже сохранена, оформлять её повторно не нужно. Мы свяжемся с вами для уточнения деталей."
+                }
+            elif is_slot_taken(result):
+                return {
+                    "success": False,
+                    "free_slots": result['alternatives'],
+                    "message": f"{slot_unavailable_text(result['status'], result['alternatives'])} Заявка не сохранена: предложите клиенту другое время."
+                }
+            elif result:
                 logger.info(f"Заявка сохранена через OpenAI function: {booking_data.get('name', 'Без имени')}")
                 return {
                     "success": True,
-                    "message": f"✅ Заявка успешно сохранена в системе!\n\nДанные клиента:\n👤 Имя: {booking_data['name']}\n📞 Телефон: {booking_data['phone']}\n⚖️ Услуга: {booking_data['service']}\n📅 Дата: {booking_data['date']}\n\nМы свяжемся с клиентом для уточнения деталей."
+                    "message": f"✅ Заявка успешно сохранена в системе!\n\nДанные клиента:\n👤 Имя: {booking_data['name']}\n📞 Телефон: {booking_data['phone']}\n⚖️ Услуга: {booking_data['service']}\n📅 Дата: {booking_data['date']}\n\nМы свяжемся с клиентом для уточнения деталей.",
+                    # Текст для клиента: бэкенд 'chat' отвечает им сам, без второго запроса к модели
+                    "client_message": f"✅ Ваша заявка сохранена!\n\n👤 Имя: {booking_data['name']}\n📞 Телефон: {booking_data['phone']}\n⚖️ Услуга: {booking_data['service']}\n📅 Дата: {booking_data['date']}\n\nМы свяжемся с вами для уточнения деталей."
                 }
             else:
                 return {
                     "success": False,
                     "message": "Произошла ошибка при сохранении заявки в системе. Попробуйте еще раз или обратитесь к администратору."
                 }
+        elif function_name == "check_availability":
+            return check_availability(arguments.get('datetime', ''), arguments.get('count', 3))
         else:
             logger.warning(f"Неизвестная функция: {function_name}")
             return {
@@ -220,51 +951,142 @@ def handle_function_call(function_name: str, arguments: dict, source: str = 'В
             "message": "Произошла техническая ошибка при обработке заявки"
         }
 
+# === Модель ответа: Assistants API, Chat Completions или локальная заглушка ===
+# LLM_BACKEND: 'assistants' — OpenAI Assistant (thread и run на стороне OpenAI);
+# 'chat' — один потоковый запрос Chat Completions на ответ, промпт и история у нас;
+# 'fake' — детерминированные ответы без сети (тесты, локальный запуск)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'assistants')
+CHAT_MODEL = os.getenv('CHAT_MODEL', 'gpt-4o-mini')
+# Функции модели для бэкенда 'chat' (Assistant получает их из своих настроек)
+LLM_TOOLS = [SAVE_BOOKING_TOOL, CHECK_AVAILABILITY_TOOL]
+
+def create_llm_backend(kind: str):
+    """Клиент модели для telegram_loop: create_thread, add_message, run, iter_messages, delete_thread"""
+    if kind == 'chat':
+        return ChatCompletionsBackend(
+            sessions, OPENAI_API_KEY, CHAT_MODEL, StaticPrompt(PROMPT_FILE, KNOWLEDGE_FILE), tools=LLM_TOOLS,
+            executor=assistant_pool.executor, breaker=openai_breaker, retry=openai_retry,
+            call_timeout=OPENAI_CALL_TIMEOUT, run_timeout=OPENAI_RUN_TIMEOUT, now=slot_calendar.now, ttl=THREAD_TTL
+        )
+    if kind == 'fake':
+        return FakeLLMBackend(
+            sessions, answer=lambda message: getattr(knowledge_index.answer(message), 'answer', None),
+            executor=assistant_pool.executor, ttl=THREAD_TTL
+        )
+    if kind != 'assistants':
+        raise ValueError(f"Неизвестный LLM_BACKEND: {kind}")
+    # AsyncOpenAI создаётся при первом вызове
+    return AsyncAssistantClient(
+        OPENAI_API_KEY, OPENAI_ASSISTANT_ID, executor=assistant_pool.executor, breaker=openai_breaker,
+        retry=openai_retry, call_timeout=OPENAI_CALL_TIMEOUT, run_timeout=OPENAI_RUN_TIMEOUT
+    )
+
+assistant_client = create_llm_backend(LLM_BACKEND)
+# Один run на thread в каждый момент; сообщения, пришедшие во время run, уходят следующей пачкой
+thread_scheduler = ThreadRunScheduler()
+# Запас заранее созданных thread для новых диалогов (запускается в main.run_telegram_loop);
+# локальной истории 'chat' и 'fake' запас не нужен
+thread_prewarmer = ThreadPrewarmer(
+    assistant_client.create_thread,
+    assistant_client.delete_thread,
+    size=int(os.getenv('THREAD_POOL_SIZE', '3')) if LLM_BACKEND == 'assistants' else 0,
+    max_age=float(os.getenv('THREAD_POOL_MAX_AGE', '3600'))
+)
+
+def llm_backend_health() -> dict:
+    """Бэкенд модели и его счётчики для /health"""
+    stats = assistant_client.stats() if hasattr(assistant_client, 'stats') else {}
+    return {'backend': LLM_BACKEND, **stats}
+
 # === Функция: работа с OpenAI Assistant ===
+# Статусы, после которых run больше не изменится
+RUN_TERMINAL_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete"}
+TIMEOUT_ANSWER = "Извините, ответ готовится слишком долго. Попробуйте задать вопрос ещё раз."
+
+def openai_call(name: str, func, deadline: Deadline = None):
+    """Синхронный вызов OpenAI с повторами временных ошибок и предохранителем"""
+    return call_with_retry(func, openai_retry, openai_breaker, deadline, name=f"OpenAI {name}")
+
+def cancel_run(thread_id: str, run_id: str):
+    """Отменяет run, не уложившийся в срок (ошибка только логируется)"""
+    try:
+        openai = sync_openai()
+        openai.beta.threads.runs.cancel(run_id, thread_id=thread_id)
+        logger.info(f"Run {run_id} в thread {thread_id} отменён")
+    except Exception as e:
+        logger.warning(f"Не удалось отменить run {run_id}: {e}")
+
 def get_assistant_response(message: str, thread_id: str = None, source: str = 'Виджет'):
     """Получает ответ от OpenAI Assistant с поддержкой function calls"""
     try:
+        openai = sync_openai()
+        # Первый вопрос без контекста: пробуем ответить из кэша
+        first_turn = not thread_id
+        if first_turn:
+            cached_answer = quick_answer(message)
+            if cached_answer:
+                with assistant_phase_seconds.time(phase='thread_create'):
+                    thread = openai_call('threads.create', lambda: openai.beta.threads.create(
+                        messages=cached_thread_messages(message, cached_answer)
+                    ))
+                return cached_answer, thread.id
+        called_functions = []
+        started_at = time.monotonic()
+        # Общий срок ответа: создание thread, сообщение, run и опрос его статуса
+        deadline = Deadline(OPENAI_RUN_TIMEOUT)
+        
         # Создаём новый thread если не передан
         if not thread_id:
-            thread = openai.beta.threads.create()
+            with assistant_phase_seconds.time(phase='thread_create'):
+                thread = openai_call('threads.create', lambda: openai.beta.threads.create(), deadline)
             thread_id = thread.id
             
         # Добавляем сообщение в thread
-        openai.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=message
-        )
+        with assistant_phase_seconds.time(phase='message_create'):
+            openai_call('messages.create', lambda: openai.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=message
+            ), deadline)
         
         # Запускаем assistant
-        run = openai.beta.threads.runs.create(
+        run_started = time.perf_counter()
+        run = openai_call('runs.create', lambda: openai.beta.threads.runs.create(
             thread_id=thread_id,
-            assistant_id=OPENAI_ASSISTANT_ID
-        )
+            assistant_id=OPENAI_ASSISTANT_ID,
+            **knowledge_run_options(message)
+        ), deadline)
         
-        # Ожидаем завершения с обработкой function calls
-        import time
+        # Ожидаем завершения с обработкой function calls (не дольше общего срока)
         while True:
-            run_status = openai.beta.threads.runs.retrieve(
+            if deadline.expired:
+                logger.error(f"Run {run.id} в thread {thread_id} не завершился за {OPENAI_RUN_TIMEOUT:.0f} с")
+                cancel_run(thread_id, run.id)
+                return TIMEOUT_ANSWER, thread_id
+            
+            run_status = openai_call('runs.retrieve', lambda: openai.beta.threads.runs.retrieve(
                 thread_id=thread_id, 
                 run_id=run.id
-            )
+            ), deadline)
             
             # Обрабатываем требуемые действия (function calls)
             if run_status.status == "requires_action":
-                logger.info(f"🔧 OpenAI требует выполнения функций")
                 tool_calls = run_status.required_action.submit_tool_outputs.tool_calls
-                logger.info(f"🔧 Количество функций для вызова: {len(tool_calls)}")
+                logger.info("🔧 OpenAI требует выполнения функций: %d", len(tool_calls))
                 tool_outputs = []
                 
                 for tool_call in tool_calls:
                     function_name = tool_call.function.name
                     arguments = json.loads(tool_call.function.arguments)
                     
-                    logger.info(f"OpenAI вызывает функцию: {function_name} с аргументами: {arguments}")
+                    logger.info("OpenAI вызывает функцию: %s", function_name)
+                    if log_settings.payload():
+                        logger.info("Аргументы функции %s: %s", function_name, arguments)
                     
                     # Выполняем функцию с переданным источником
-                    result = handle_function_call(function_name, arguments, source)
+                    with assistant_phase_seconds.time(phase='tool_call'):
+                        result = handle_function_call(function_name, arguments, source, tool_call.id, thread_id)
+                    called_functions.append(function_name)
                     
                     tool_outputs.append({
                         "tool_call_id": tool_call.id,
@@ -272,140 +1094,230 @@ def get_assistant_response(message: str, thread_id: str = None, source: str = '
                     })
                 
                 # Отправляем результаты функций обратно в OpenAI
-                openai.beta.threads.runs.submit_tool_outputs(
+                openai_call('runs.submit_tool_outputs', lambda: openai.beta.threads.runs.submit_tool_outputs(
                     thread_id=thread_id,
                     run_id=run.id,
                     tool_outputs=tool_outputs
-                )
+                ), deadline)
                 
-            elif run_status.status in ["completed", "failed", "cancelled"]:
-                logger.info(f"🏁 OpenAI завершен со статусом: {run_status.status}")
+            elif run_status.status in RUN_TERMINAL_STATUSES:
+                logger.info("🏁 OpenAI завершен со статусом: %s", run_status.status)
                 break
                 
-            time.sleep(1)
+            time.sleep(deadline.timeout(1))
+        assistant_phase_seconds.observe(time.perf_counter() - run_started, phase='run')
             
         # Получаем ответ
         if run_status.status == "completed":
-            messages = openai.beta.threads.messages.list(thread_id=thread_id)
-            logger.info(f"Получено {len(messages.data)} сообщений в thread")
+            with assistant_phase_seconds.time(phase='messages_list'):
+                messages = openai_call('messages.list', lambda: openai.beta.threads.messages.list(thread_id=thread_id))
+            logger.debug("Получено %d сообщений в thread", len(messages.data))
             
             # Берём ПЕРВОЕ сообщение (самое новое) от assistant
-            for i, msg in enumerate(messages.data):
-                logger.info(f"Сообщение {i}: роль={msg.role}, создано={msg.created_at}")
+            for msg in messages.data:
                 if msg.role == "assistant":
                     response_text = msg.content[0].text.value
-                    logger.info(f"Возвращаем ответ assistant: '{response_text[:100]}...'")
+                    if log_settings.payload():
+                        logger.info("Возвращаем ответ assistant: '%.100s...'", response_text)
                     
                     # Проверяем, если Assistant говорит о сохранении записи
-                    if "сохраню вашу запись" in response_text.lower() or "все данные собраны" in response_text.lower():
-                        logger.info("🔄 Обнаружено намерение сохранить запись, извлекаем данные из thread")
-                        try:
-                            # Извлекаем данные из всех сообщений thread
-                            booking_data = extract_booking_data_from_thread(messages.data)
-                            if booking_data:
-                                logger.info(f"📝 Извлеченные данные записи: {booking_data}")
-                                success = save_application_to_sheets(booking_data)
-                                if success:
-                                    logger.info("✅ Запись успешно сохранена в Google Sheets из веб-виджета")
-                                else:
-                                    logger.error("❌ Ошибка сохранения в Google Sheets")
-                        except Exception as e:
-                            logger.error(f"❌ Ошибка при извлечении данных записи: {e}")
+                    # (заявку, уже сохранённую через save_booking_data, из переписки не дублируем)
+                    if has_booking_intent(response_text):
+                        if 'save_booking_data' not in called_functions:
+                            save_booking_from_thread(thread_id, source)
+                    elif first_turn and not called_functions:
+                        answer_cache.put(message, response_text, time.monotonic() - started_at)
                     
                     return response_text, thread_id
                     
         logger.error(f"OpenAI Assistant завершился со статусом: {run_status.status}")
         return "Извините, произошла ошибка при получении ответа.", thread_id
         
+    except TimeoutError as e:
+        logger.error(f"Ошибка OpenAI Assistant: истёк срок ответа ({e})")
+        return TIMEOUT_ANSWER, thread_id
     except Exception as e:
         logger.error(f"Ошибка OpenAI Assistant: {e}")
         return "Извините, сервис временно недоступен.", thread_id
 
-def extract_booking_data_from_thread(messages):
-    """Извлекает данные записи из сообщений thread"""
+# === Функция: асинхронная работа с OpenAI Assistant ===
+async def get_assistant_response_async(message: str, thread_id: str = None, source: str = 'Виджет', on_delta=None,
+                                       on_thread=None):
+    """Получает ответ от OpenAI Assistant без блокировки event loop (стрим вместо опроса).
+
+    on_delta(text) — необязательная корутина, получающая фрагменты ответа по мере генерации.
+    on_thread(thread_id) — необязательная корутина, вызываемая, как только thread известен (до run).
+    Если сообщение пришло во время run и ответ на него дан вместе с более поздним
+    сообщением того же thread, возвращается (None, thread_id).
+    """
     try:
-        # Собираем все сообщения пользователя
-        user_messages = []
-        for msg in reversed(messages):  # От старых к новым
-            if msg.role == "user":
-                user_messages.append(msg.content[0].text.value)
-        
-        logger.info(f"🔍 Сообщения пользователя: {user_messages}")
+        # Первый вопрос без контекста: пробуем ответить из кэша
+        first_turn = not thread_id
+        if first_turn:
+            cached_answer = quick_answer(message)
+            if cached_answer:
+                if on_delta:
+                    await on_delta(cached_answer)
+                thread_id = await new_thread(cached_thread_messages(message, cached_answer))
+                if on_thread:
+                    await on_thread(thread_id)
+                return cached_answer, thread_id
+        started_at = time.monotonic()
         
-        # Пытаемся извлечь данные (простая логика)
-        booking_data = {
-            'name': '',
-            'phone': '',
-            'service': '',
-            'date': '',
-            'documents': 'нет',
-            'comment': 'нет',
-            'source': 'Виджет'
-        }
-        
-        # Умный поиск данных в сообщениях
-        for i, msg in enumerate(user_messages):
-            msg_lower = msg.lower().strip()
-            
-            # Ищем имя (не содержит цифр, не ключевые слова)
-            if not booking_data['name'] and not any(char.isdigit() for char in msg) and len(msg.split()) <= 3:
-                if msg_lower not in ['да', 'нет', 'да, хочу записаться', 'хочу записаться', 'записаться']:
-                    booking_data['name'] = msg.strip()
-                    logger.info(f"📝 Найдено имя: {booking_data['name']}")
-            
-            # Ищем телефон (содержит цифры и длинный)
-            if not booking_data['phone'] and any(char.isdigit() for char in msg) and len(msg) >= 7:
-                # Простая проверка на телефон
-                digits = ''.join(filter(str.isdigit, msg))
-                if len(digits) >= 7:
-                    booking_data['phone'] = msg.strip()
-                    logger.info(f"📱 Найден телефон: {booking_data['phone']}")
-            
-            # Ищем дату (содержит цифры и возможные форматы даты)
-            if not booking_data['date'] and any(char.isdigit() for char in msg):
-                if any(pattern in msg_lower for pattern in ['.', '/', 'ноябр', 'декабр', 'январ', 'февр', 'март', 'апрел', 'май', 'июн', 'июл', 'август', 'сентябр', 'октябр']):
-                    booking_data['date'] = msg.strip()
-                    logger.info(f"📅 Найдена дата: {booking_data['date']}")
+        # Создаём новый thread если не передан; длинный диалог продолжается в новом thread
+        if not thread_id:
+            thread_id = await new_thread()
+        else:
+            thread_id = await current_thread(thread_id)
+        if on_thread:
+            await on_thread(thread_id)
             
-            # Ищем услугу (длинное описание, не имя, не телефон, не дата)
-            if not booking_data['service'] and len(msg) > 10:
-                if not any(char.isdigit() for char in msg) or 'консультация' in msg_lower or 'адвокат' in msg_lower or 'суд' in msg_lower:
-                    if msg_lower not in ['да, хочу записаться', 'хочу записаться']:
-                        booking_data['service'] = msg.strip()
-                        logger.info(f"⚖️ Найдена услуга: {booking_data['service']}")
+        # Run в thread выполняются по очереди, сообщения во время run объединяются
+        (status, response_text, tool_calls), merged = await thread_scheduler.submit(
+            thread_id, (message, source, on_delta, time.perf_counter()), run_thread_batch
+        )
+        if merged:
+            logger.info(f"Сообщение в thread {thread_id} объединено со следующим, ответ будет дан на них вместе")
+            return None, thread_id
         
-        # Оставшиеся сообщения как документы и комментарии
-        for i, msg in enumerate(user_messages):
-            msg_lower = msg.lower().strip()
-            # Если сообщение не является именем, телефоном, услугой или датой
-            if (msg != booking_data['name'] and msg != booking_data['phone'] and 
-                msg != booking_data['service'] and msg != booking_data['date']):
-                
-                # Проверяем на документы
-                if ('паспорт' in msg_lower or 'документ' in msg_lower or 'справк' in msg_lower or 
-                    'свидетельство' in msg_lower or 'удостовер' in msg_lower):
-                    booking_data['documents'] = msg.strip()
-                    logger.info(f"📄 Найдены документы: {booking_data['documents']}")
+        if status == "completed" and response_text:
+            if log_settings.payload():
+                logger.info("Возвращаем ответ assistant: '%.100s...'", response_text)
+            
+            # Историю thread дочитываем только если Assistant говорит о сохранении записи
+            # и заявка не сохранена в этом run через save_booking_data
+            if has_booking_intent(response_text):
+                if 'save_booking_data' not in tool_calls:
+                    await save_booking_from_thread_async(thread_id, source)
+            elif first_turn and not tool_calls:
+                answer_cache.put(message, response_text, time.monotonic() - started_at)
                 
-                # Остальное как комментарии
-                elif len(msg) > 3 and msg_lower not in ['да', 'нет', 'да, хочу записаться', 'хочу записаться']:
-                    if booking_data['comment'] == 'нет':
-                        booking_data['comment'] = msg.strip()
-                    else:
-                        booking_data['comment'] += f"; {msg.strip()}"
-                    logger.info(f"💬 Найден комментарий: {msg.strip()}")
-        
-        # Проверяем, что есть основные данные
-        if booking_data['name'] and booking_data['phone']:
-            logger.info(f"✅ Успешно извлечены данные записи")
-            return booking_data
-        else:
-            logger.warning(f"⚠️ Недостаточно данных для записи: имя={booking_data['name']}, телефон={booking_data['phone']}")
-            return None
+            return response_text, thread_id
             
+        logger.error(f"OpenAI Assistant завершился со статусом: {status}")
+        if status == 'timeout':
+            return TIMEOUT_ANSWER, thread_id
+        return "Извините, произошла ошибка при получении ответа.", thread_id
+        
+    except TimeoutError as e:
+        logger.error(f"Ошибка OpenAI Assistant: истёк срок ответа ({e})")
+        return TIMEOUT_ANSWER, thread_id
     except Exception as e:
-        logger.error(f"❌ Ошибка извлечения данных: {e}")
-        return None
+        logger.error(f"Ошибка OpenAI Assistant: {e}")
+        return "Извините, сервис временно недоступен.", thread_id
+
+async def run_thread_batch(thread_id: str, batch: list):
+    """Добавляет в thread накопившиеся сообщения и отвечает на них одним run.
+
+    batch — список (message, source, on_delta, queued_at); фрагменты ответа получает последнее сообщение.
+    Возвращает (status, response_text, tool_calls).
+    """
+    message, source, on_delta, _ = batch[-1]
+    tool_calls = []
+    
+    # Время ожидания своей очереди: пока закончится предыдущий run этого thread
+    now = time.perf_counter()
+    for _, _, _, queued_at in batch:
+        assistant_phase_seconds.observe(now - queued_at, phase='run_queue')
+    
+    def tool_handler(name, arguments, tool_call_id):
+        tool_calls.append(name)
+        with assistant_phase_seconds.time(phase='tool_call'):
+            return handle_function_call(name, arguments, source, tool_call_id, thread_id)
+    
+    # Ответ из кэша должен попасть в thread раньше новых сообщений
+    seeding = thread_seeding.get(thread_id)
+    if seeding:
+        await seeding
+    
+    # Общий срок на сообщения и run; не уложившийся run отменяется
+    deadline = Deadline(OPENAI_RUN_TIMEOUT)
+    
+    # Добавляем сообщения в thread
+    for pending_message, _, _, _ in batch:
+        with assistant_phase_seconds.time(phase='message_create'):
+            await assistant_client.add_message(thread_id, pending_message, deadline=deadline)
+    
+    # Запускаем assistant и ждём финального события стрима (время run включает tool_call)
+    run_usage = []
+    run_started = time.perf_counter()
+    status, response_text = await assistant_client.run(
+        thread_id, tool_handler=tool_handler, on_delta=on_delta, deadline=deadline, on_usage=run_usage.append,
+        **knowledge_run_options(message)
+    )
+    run_seconds = time.perf_counter() - run_started
+    assistant_phase_seconds.observe(run_seconds, phase='run')
+    if status == "completed":
+        await assistant_pool.run_blocking(
+            record_thread_run, thread_id, [item[0] for item in batch], response_text, run_seconds,
+            run_usage[0] if run_usage else None
+        )
+    return status, response_text, tool_calls
+
+def has_booking_intent(response_text: str):
+    """Проверяет, говорит ли Assistant о сохранении записи"""
+    text = response_text.lower()
+    return "сохраню вашу запись" in text or "все данные собраны" in text
+
+def save_extracted_booking(booking_data, thread_id: str = None):
+    """Сохраняет в Google Sheets данные записи, извлечённые из переписки thread_id"""
+    if not booking_data:
+        logger.warning("⚠️ Недостаточно данных для записи: нужны имя и телефон")
+        return
+    if log_settings.payload():
+        logger.info("📝 Извлеченные данные записи: %s", booking_data)
+    # Клиенту уже ответили, что запись принята: занятое время не отклоняется, а отмечается в логе
+    success = save_application_to_sheets(
+        booking_data, idempotency_key=booking_idempotency_key(booking_data, thread_id), enforce_slot=False
+    )
+    if is_duplicate(success):
+        logger.info("Запись из переписки уже сохранена (через save_booking_data или ранее)")
+    elif success:
+        logger.info("✅ Запись успешно сохранена в Google Sheets из переписки с Assistant")
+    else:
+        logger.error("❌ Ошибка сохранения в Google Sheets")
+
+def load_booking_extraction(thread_id: str):
+    """Состояние разбора thread: поля записи и id последнего разобранного сообщения"""
+    return BookingExtraction(sessions.get('extraction', thread_id))
+
+def store_booking_extraction(thread_id: str, extraction: BookingExtraction):
+    sessions.set('extraction', thread_id, extraction.to_dict(), ttl=THREAD_TTL)
+
+def save_booking_from_thread(thread_id: str, source: str = 'Виджет'):
+    """Дочитывает новые сообщения thread, извлекает данные записи и сохраняет их (синхронный клиент)"""
+    logger.info("🔄 Обнаружено намерение сохранить запись, извлекаем данные из thread")
+    try:
+        extraction = load_booking_extraction(thread_id)
+        params = {'order': 'asc', 'limit': 100}
+        if extraction.last_message_id:
+            params['after'] = extraction.last_message_id
+        with assistant_phase_seconds.time(phase='messages_list'):
+            # Страницы истории подгружаются по мере перебора
+            feed_messages(extraction, sync_openai().beta.threads.messages.list(thread_id=thread_id, **params))
+        store_booking_extraction(thread_id, extraction)
+        save_extracted_booking(extraction.result(source), thread_id)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при извлечении данных записи: {e}")
+
+async def save_booking_from_thread_async(thread_id: str, source: str = 'Виджет'):
+    """Асинхронный вариант save_booking_from_thread для telegram_loop"""
+    logger.info("🔄 Обнаружено намерение сохранить запись, извлекаем данные из thread")
+    try:
+        extraction = await assistant_pool.run_blocking(load_booking_extraction, thread_id)
+        with assistant_phase_seconds.time(phase='messages_list'):
+            messages = [
+                message async for message in assistant_client.iter_messages(thread_id, after=extraction.last_message_id)
+            ]
+        feed_messages(extraction, messages)
+        await assistant_pool.run_blocking(store_booking_extraction, thread_id, extraction)
+        await assistant_pool.run_blocking(save_extracted_booking, extraction.result(source), thread_id)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при извлечении данных записи: {e}")
+
+def extract_booking_data_from_thread(messages, source: str = 'Виджет'):
+    """Извлекает данные записи из полного списка сообщений thread (от новых к старым)"""
+    return feed_messages(BookingExtraction(), list(reversed(messages))).result(source)
 
 # === Telegram handlers ===
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -422,7 +1334,7 @@ async def handle_mode_choice(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = update.effective_user.id
     
     if text == "Быстрая запись":
-        user_data[user_id] = {}
+        await assistant_pool.run_blocking(sessions.set, 'booking', user_id, {}, ttl=BOOKING_TTL)
         await update.message.reply_text(
             "Давайте оформим заявку.\nВведите ваше имя:",
             reply_markup=ReplyKeyboardRemove()
@@ -447,20 +1359,19 @@ async def handle_mode_choice(update: Update, context: ContextTypes.DEFAULT_TYPE)
 # === FSM handlers для быстрой записи ===
 async def get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получение имени клиента"""
-    logger.info(f"🎯 get_name вызвана! user_id={update.effective_user.id}, text='{update.message.text}'")
-    logger.info(f"Текущее состояние conversation: {context.user_data}")
+    logger.debug("🎯 get_name вызвана! user_id=%s", update.effective_user.id)
     
     user_id = update.effective_user.id
-    user_data[user_id]['name'] = update.message.text
+    await update_booking_draft(user_id, name=update.message.text)
     
     await update.message.reply_text("Введите ваш номер телефона:")
-    logger.info("✅ Отправлен запрос телефона, переход в STATE_PHONE")
+    logger.debug("✅ Отправлен запрос телефона, переход в STATE_PHONE")
     return STATE_PHONE
 
 async def get_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получение телефона клиента"""
     user_id = update.effective_user.id
-    user_data[user_id]['phone'] = update.message.text
+    await update_booking_draft(user_id, phone=update.message.text)
     
     await update.message.reply_text(
         "Выберите услугу:",
@@ -480,27 +1391,55 @@ async def get_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return STATE_SERVICE
         
-    user_data[user_id]['service'] = selected_service
+    await update_booking_draft(user_id, service=selected_service)
+    suggestions = free_slot_texts() if SLOT_CALENDAR else []
     await update.message.reply_text(
-        "Укажите желаемые дату и время (например: 25.12.2024 15:00):",
-        reply_markup=ReplyKeyboardRemove()
+        "Укажите желаемые дату и время (например: 25.12.2024 15:00):"
+        + ("\nБлижайшее свободное время — на кнопках ниже." if suggestions else ""),
+        reply_markup=slot_keyboard(suggestions)
     )
     return STATE_DATE
 
 async def get_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Получение даты и времени"""
+    """Получение даты и времени (с проверкой по календарю записи)"""
     user_id = update.effective_user.id
-    user_data[user_id]['date'] = update.message.text
+    date_text = update.message.text
+    
+    if SLOT_CALENDAR:
+        slot = slot_calendar.parse(date_text)
+        if slot is None:
+            suggestions = free_slot_texts()
+            await update.message.reply_text(
+                "Не удалось распознать дату и время. Укажите их, например: 25.12.2024 15:00",
+                reply_markup=slot_keyboard(suggestions)
+            )
+            return STATE_DATE
+        status = slot_calendar.check(slot)
+        # Пока календарь загружается, время принимается: его проверит запись заявки по общей занятости
+        if status not in (SlotCalendar.FREE, SlotCalendar.UNKNOWN):
+            suggestions = free_slot_texts(slot)
+            await update.message.reply_text(
+                slot_unavailable_text(status, suggestions) + "\nВыберите другое время:",
+                reply_markup=slot_keyboard(suggestions)
+            )
+            return STATE_DATE
+        date_text = format_slot(slot)
+    
+    draft = await update_booking_draft(user_id, date=date_text)
+    if 'comment' in draft:
+        # Клиент выбирает другое время после отказа в get_comment: остальные данные уже есть
+        return await finish_booking(update, user_id, draft)
     
     await update.message.reply_text(
-        "Перечислите документы, которые есть на руках (или напишите 'нет'):"
+        "Перечислите документы, которые есть на руках (или напишите 'нет'):",
+        reply_markup=ReplyKeyboardRemove()
     )
     return STATE_DOCUMENTS
 
 async def get_documents(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получение информации о документах"""
     user_id = update.effective_user.id
-    user_data[user_id]['documents'] = update.message.text
+    await update_booking_draft(user_id, documents=update.message.text)
     
     await update.message.reply_text(
         "Добавьте комментарий или дополнительную информацию (или напишите 'нет'):"
@@ -510,12 +1449,33 @@ async def get_documents(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def get_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Завершение сбора данных и сохранение заявки"""
     user_id = update.effective_user.id
-    user_data[user_id]['comment'] = update.message.text
-    user_data[user_id]['source'] = 'Телеграм'  # Явно устанавливаем источник для FSM
-    
-    # Сохраняем заявку
-    application_data = user_data[user_id]
-    save_result = save_application_to_sheets(application_data)
+    # Явно устанавливаем источник для FSM
+    application_data = await update_booking_draft(user_id, comment=update.message.text, source='Телеграм')
+    return await finish_booking(update, user_id, application_data)
+
+async def finish_booking(update: Update, user_id, application_data: dict):
+    """Сохраняет заявку из черновика и отправляет уведомление"""
+    # Сохраняем заявку (повторная доставка того же update от Telegram не создаст вторую заявку);
+    # SQLite и прямая запись в Sheets с повторами — в пуле потоков, не в loop
+    save_result = await assistant_pool.run_blocking(
+        save_application_to_sheets, application_data, idempotency_key=f"tg-update:{update.update_id}"
+    )
+    if is_duplicate(save_result):
+        await update.message.reply_text(
+            "✅ Эта заявка уже принята.\n"
+            "Мы свяжемся с вами в ближайшее время.",
+            reply_markup=main_keyboard
+        )
+        await assistant_pool.run_blocking(sessions.pop, 'booking', user_id)
+        return ConversationHandler.END
+    if is_slot_taken(save_result):
+        # Время заняли, пока клиент заполнял заявку: остальные данные сохранены в черновике
+        await update.message.reply_text(
+            slot_unavailable_text(save_result['status'], save_result['alternatives'])
+            + "\nВыберите другое время, и заявка будет отправлена:",
+            reply_markup=slot_keyboard(save_result['alternatives'])
+        )
+        return STATE_DATE
     
     # Отправляем уведомление в группу
     # Подготавливаем данные для уведомления (аналогично save_application_to_sheets)
@@ -536,7 +1496,7 @@ async def get_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"📄 Документы: {documents}\n"
         f"💬 Комментарий: {comment}"
     )
-    # send_telegram_notification будет вызвана из main.py с правильным bot
+    send_telegram_notification(notification_text)
     
     await update.message.reply_text(
         "✅ Спасибо! Ваша заявка принята.\n"
@@ -545,13 +1505,13 @@ async def get_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     # Очищаем данные пользователя
-    user_data.pop(user_id, None)
+    await assistant_pool.run_blocking(sessions.pop, 'booking', user_id)
     return ConversationHandler.END
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отмена текущей операции"""
     user_id = update.effective_user.id
-    user_data.pop(user_id, None)
+    await assistant_pool.run_blocking(sessions.pop, 'booking', user_id)
     
     await update.message.reply_text(
         "Операция отменена.",
@@ -559,13 +1519,99 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ConversationHandler.END
 
+# === Команды сотрудников: заявки из копии таблицы ===
+# Telegram id сотрудников через запятую; в служебной группе TELEGRAM_GROUP_ID команды доступны всем
+STAFF_USER_IDS = {int(user_id) for user_id in os.getenv('STAFF_USER_IDS', '').replace(' ', '').split(',') if user_id}
+# Запас до лимита длины сообщения Telegram (4096)
+STAFF_REPLY_LIMIT = 3800
+WEEK_DAYS = 7
+
+def is_staff(update: Update) -> bool:
+    user, chat = update.effective_user, update.effective_chat
+    if user and user.id in STAFF_USER_IDS:
+        return True
+    return bool(chat and TELEGRAM_GROUP_ID and str(chat.id) == str(TELEGRAM_GROUP_ID))
+
+def booking_line(row: list, slot, with_date: bool = False) -> str:
+    """Заявка одной строкой: «15:00 — Иван, +79001234567, Консультация (Телеграм)»"""
+    cells = list(row) + [''] * (8 - len(row))
+    if slot is None:
+        when = cells[3] or 'без даты'
+    else:
+        when = describe_slot(slot) if with_date else slot.strftime('%H:%M')
+    source = f" ({cells[6]})" if cells[6] else ''
+    return f"{when} — {cells[0]}, {cells[1]}, {cells[2]}{source}"
+
+def staff_reply_text(title: str, lines: list) -> str:
+    """Ответ сотруднику в пределах одного сообщения Telegram"""
+    if booking_mirror.synced_at is None:
+        return "Копия таблицы заявок ещё загружается, повторите через минуту."
+    text = title
+    for index, line in enumerate(lines):
+        if len(text) + len(line) + 1 > STAFF_REPLY_LIMIT:
+            return text + f"\n… и ещё {len(lines) - index}"
+        text += "\n" + line
+    return text
+
+def staff_day(args: list):
+    """Дата из аргументов команды («25.12», «завтра», «пятница»); без аргументов — сегодня"""
+    today = slot_calendar.now().date()
+    text = ' '.join(args or ()).lower().replace('ё', 'е')
+    return parse_date(text, today) if text else today
+
+async def find_bookings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/find <телефон> — заявки клиента"""
+    if not is_staff(update):
+        return
+    query = ' '.join(context.args or ())
+    if len(normalize_phone(query)) < 11:
+        await update.message.reply_text("Укажите телефон: /find +7 900 123-45-67")
+        return
+    found = booking_mirror.find_phone(query)
+    lines = [booking_line(row, slot, with_date=True) for _, row, slot in found]
+    await update.message.reply_text(staff_reply_text(f"Заявки по номеру {query}: {len(found)}", lines))
+
+async def day_bookings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/day [дата] — записи на день"""
+    if not is_staff(update):
+        return
+    day = staff_day(context.args)
+    if day is None:
+        await update.message.reply_text("Не удалось распознать дату. Пример: /day 25.12")
+        return
+    found = booking_mirror.on_date(day)
+    lines = [booking_line(row, slot) for _, row, slot in found]
+    title = f"Записи на {WEEKDAY_NAMES[day.weekday()]} {day:%d.%m.%Y}: {len(found)}"
+    await update.message.reply_text(staff_reply_text(title, lines))
+
+async def week_bookings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/week [дата] — записи на 7 дней начиная с даты (по умолчанию с сегодняшнего дня)"""
+    if not is_staff(update):
+        return
+    first = staff_day(context.args)
+    if first is None:
+        await update.message.reply_text("Не удалось распознать дату. Пример: /week 23.12")
+        return
+    days = booking_mirror.between(first, WEEK_DAYS)
+    lines = []
+    for day, found in days.items():
+        lines.append(f"\n{WEEKDAY_NAMES[day.weekday()]} {day:%d.%m}: {len(found)}")
+        lines.extend(booking_line(row, slot) for _, row, slot in found)
+    last = first + timedelta(days=WEEK_DAYS - 1)
+    total = sum(len(found) for found in days.values())
+    title = f"Записи {first:%d.%m}–{last:%d.%m.%Y}: {total}"
+    await update.message.reply_text(staff_reply_text(title, lines))
+
 # === Обработчик всех сообщений для отладки ===
 async def debug_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отладочный обработчик - показывает все входящие сообщения"""
+    # Срабатывает на каждое сообщение: пишет в лог только выборку при включённом логировании payload
+    if not logger.isEnabledFor(logging.DEBUG) or not log_settings.payload():
+        return
     user_id = update.effective_user.id
     message = update.message.text if update.message else "Нет текста"
-    logger.info(f"🔍 DEBUG: получено сообщение от user_id={user_id}, text='{message}'")
-    logger.info(f"🔍 DEBUG: состояние context.user_data={context.user_data}")
+    logger.debug("🔍 DEBUG: получено сообщение от user_id=%s, text='%s'", user_id, message)
+    logger.debug("🔍 DEBUG: состояние context.user_data=%s", context.user_data)
 
 # === Обработчик консультаций ===
 async def consultation_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -573,37 +1619,110 @@ async def consultation_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = update.effective_user.id
     message = update.message.text
     
-    logger.info(f"💬 Консультация от user_id={user_id}, message='{message}'")
+    logger.info("💬 Консультация от user_id=%s", user_id)
+    if log_settings.payload():
+        logger.info("Вопрос user_id=%s: '%s'", user_id, message)
     
+    # Слишком частые вопросы и перегрузка получают быстрый отказ, а не ждут в очереди.
+    # Проверка лимитов ходит в SQLite, поэтому выполняется в пуле, а не в цикле событий бота
+    decision = await assistant_pool.run_blocking(admit_assistant_request, user=user_id)
+    if not decision:
+        await update.message.reply_text(
+            f"⏳ Пожалуйста, подождите {math.ceil(decision.retry_after)} сек. и задайте вопрос снова."
+        )
+        return
+    
+    # Ответ Assistant готовится фоновой задачей пула, чтобы не задерживать другие updates.
+    # Быстрый ответ (из кэша) ждёт, пока уйдёт сообщение «Обрабатываю», иначе пришёл бы раньше него
+    placeholder_sent = asyncio.get_running_loop().create_future()
+    accepted = assistant_pool.submit(
+        user_id,
+        lambda: answer_consultation(update, user_id, message, decision.slot, placeholder_sent)
+    )
+    if not accepted:
+        await assistant_pool.run_blocking(admission.release, decision.slot)
+        await update.message.reply_text(
+            "⏳ Пожалуйста, дождитесь ответа на предыдущий вопрос."
+        )
+        return
+    
+    # Отправляем сообщение "печатает"
+    try:
+        await update.message.reply_text("⏳ Обрабатываю ваш вопрос...")
+    finally:
+        placeholder_sent.set_result(None)
+
+# user_id -> Future с thread первого сообщения, пока thread ещё не записан в сессию
+pending_user_threads = {}
+
+async def user_thread(user_id):
+    """Thread пользователя; если первое сообщение ещё создаёт thread — ждёт его"""
+    if user_id in pending_user_threads:
+        return await asyncio.shield(pending_user_threads[user_id])
+    thread_id = await assistant_pool.run_blocking(sessions.get, 'thread', user_id)
+    # Пока читали сессию, первое сообщение могло начать создавать thread
+    if thread_id is None and user_id in pending_user_threads:
+        thread_id = await asyncio.shield(pending_user_threads[user_id])
+    return thread_id
+
+async def answer_consultation(update: Update, user_id, message: str, slot: str = None, placeholder_sent=None):
+    """Получает ответ Assistant и отправляет его пользователю (выполняется в пуле).
+
+    placeholder_sent — Future, завершающаяся после отправки «Обрабатываю ваш вопрос»:
+    ответ отправляется не раньше неё.
+    """
+    pending = None
     try:
         # Получаем thread_id для пользователя или создаём новый
-        thread_id = user_threads.get(user_id)
-        logger.info(f"Thread ID для пользователя {user_id}: {thread_id}")
+        thread_id = await user_thread(user_id)
+        logger.debug("Thread ID для пользователя %s: %s", user_id, thread_id)
+        if thread_id is None:
+            # Сообщения, пришедшие во время первого run, ждут этот thread, а не создают свои
+            pending = pending_user_threads[user_id] = asyncio.get_running_loop().create_future()
         
-        # Отправляем сообщение "печатает"
-        await update.message.reply_text("⏳ Обрабатываю ваш вопрос...")
+        async def remember_thread(new_thread_id):
+            if pending is not None and not pending.done():
+                pending.set_result(new_thread_id)
+            await assistant_pool.run_blocking(sessions.set, 'thread', user_id, new_thread_id, ttl=THREAD_TTL)
         
         # Получаем ответ от OpenAI Assistant
-        logger.info("Отправляю запрос к OpenAI Assistant...")
-        answer, new_thread_id = get_assistant_response(message, thread_id, 'Телеграм')
-        user_threads[user_id] = new_thread_id
+        logger.debug("Отправляю запрос к OpenAI Assistant...")
+        answer, new_thread_id = await get_assistant_response_async(
+            message, thread_id, 'Телеграм', on_thread=remember_thread
+        )
+        await assistant_pool.run_blocking(sessions.set, 'thread', user_id, new_thread_id, ttl=THREAD_TTL)
+        if answer is None:
+            # На это сообщение ответит run вместе со следующим сообщением пользователя
+            return
         
-        logger.info(f"Получен ответ от OpenAI: длина {len(answer)} символов")
-        logger.info(f"Новый thread_id: {new_thread_id}")
+        logger.info("Получен ответ от OpenAI: длина %d символов, thread_id %s", len(answer), new_thread_id)
         
+        if placeholder_sent is not None:
+            await asyncio.shield(placeholder_sent)
         await update.message.reply_text(answer)
-        logger.info("Ответ отправлен пользователю")
+        logger.debug("Ответ отправлен пользователю")
         
     except Exception as e:
         logger.error(f"Ошибка в consultation_handler: {e}", exc_info=True)
+        if placeholder_sent is not None:
+            await asyncio.shield(placeholder_sent)
         await update.message.reply_text(
             "Извините, произошла ошибка при обработке вашего вопроса. Попробуйте ещё раз."
         )
+    finally:
+        if pending is not None:
+            # Thread не создан (ошибка) — ожидающие сообщения создадут свой
+            if not pending.done():
+                pending.set_result(None)
+            if pending_user_threads.get(user_id) is pending:
+                del pending_user_threads[user_id]
+        await asyncio.shield(assistant_pool.run_blocking(admission.release, slot))
 
 # === Экспорт для main.py ===
 __all__ = [
     'start', 'handle_mode_choice', 'get_name', 'get_phone', 'get_service',
     'get_date', 'get_documents', 'get_comment', 'cancel', 'consultation_handler',
     'STATE_NAME', 'STATE_PHONE', 'STATE_SERVICE', 'STATE_DATE', 'STATE_DOCUMENTS', 'STATE_COMMENT',
-    'bot', 'logger', 'NGROK_URL', 'save_application_to_sheets', 'get_assistant_response'
+    'bot', 'logger', 'NGROK_URL', 'save_application_to_sheets', 'get_assistant_response',
+    'get_assistant_response_async'
 ]
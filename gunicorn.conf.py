@@ -0,0 +1,37 @@
+# Конфигурация gunicorn: gunicorn -c gunicorn.conf.py wsgi:app
+import os
+import multiprocessing
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+timeout = 150
+
+# Каждый воркер импортирует приложение сам: SQLite-соединения и event loop не переживают fork
+preload_app = False
+
+raw_env = ['MULTIPROCESS=1']
+
+
+def on_starting(server):
+    """Устанавливает webhook один раз в мастер-процессе (без импорта main)"""
+    ngrok_url = os.getenv('NGROK_URL')
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not ngrok_url or not token:
+        return
+    import requests
+    response = requests.post(
+        f"{os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')}/bot{token}/setWebhook",
+        data={'url': f"{ngrok_url}/webhook"}
+    )
+    server.log.info(f"setWebhook: {response.status_code} {response.text}")
+
+
+def post_worker_init(worker):
+    """Запускает telegram_loop и запись очереди Google Sheets в каждом воркере"""
+    from main import start_worker
+    start_worker()
@@ -0,0 +1,179 @@
+import os
+import json
+import math
+import time
+import hashlib
+import logging
+import threading
+from collections import Counter
+
+from normalizer import normalize_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class Section:
+    """Раздел базы знаний: вопрос, ответ и частоты основ слов"""
+    __slots__ = ('key', 'question', 'answer', 'terms', 'question_terms', 'length')
+
+    def __init__(self, question: str, answer: str, question_weight: int):
+        self.key = section_key(question, answer)
+        self.question = question
+        self.answer = answer
+        self.question_terms = set(normalize_tokens(question))
+        terms = Counter(normalize_tokens(answer))
+        for term in normalize_tokens(question):
+            terms[term] += question_weight
+        self.terms = terms
+        self.length = sum(terms.values())
+
+    def as_passage(self) -> str:
+        return f"{self.question}\n{self.answer}" if self.question else self.answer
+
+
+def section_key(question: str, answer: str) -> str:
+    return hashlib.sha1(f"{question}\n{answer}".encode('utf-8')).hexdigest()
+
+
+def parse_sections(text: str):
+    """Разбивает базу знаний на пары (вопрос, ответ): JSON-список или абзацы через пустую строку"""
+    try:
+        items = json.loads(text)
+        return [(item.get('question', '').strip(), item.get('answer', '').strip())
+                for item in items if isinstance(item, dict)]
+    except ValueError:
+        sections = []
+        for block in text.split('\n\n'):
+            lines = [line.strip() for line in block.strip().splitlines() if line.strip()]
+            if lines:
+                sections.append((lines[0], ' '.join(lines[1:]) or lines[0]))
+        return sections
+
+
+class KnowledgeIndex:
+    """Инвертированный индекс BM25 по разделам knowledge.txt.
+
+    При изменении файла индекс перестраивается инкрементально: удаляются только
+    исчезнувшие разделы и добавляются новые. answer() возвращает раздел лишь при
+    уверенном совпадении с вопросом FAQ, иначе вопрос уходит в Assistant.
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75, question_weight: int = 2,
+                 min_score: float = 4.0, min_coverage: float = 0.75, min_margin: float = 1.3,
+                 check_interval: float = 1.0):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.question_weight = question_weight
+        self.min_score = min_score
+        self.min_coverage = min_coverage
+        self.min_margin = min_margin
+        self.check_interval = check_interval
+        self._sections = {}  # key -> Section
+        self._postings = {}  # term -> {key: tf}
+        self._total_length = 0
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.fast_answers = 0
+        self.refresh(force=True)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Перечитывает файл, если он изменился. Возвращает True, если индекс обновлён"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        with self._refresh_lock:
+            try:
+                stat = os.stat(self.path)
+            except OSError as e:
+                logger.error(f"База знаний недоступна: {e}")
+                return False
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature == self._signature:
+                return False
+
+            with open(self.path, encoding='utf-8') as f:
+                pairs = {section_key(q, a): (q, a) for q, a in parse_sections(f.read())}
+            # Токенизируем только новые разделы, неизменённые остаются в индексе как есть
+            added = [Section(q, a, self.question_weight) for key, (q, a) in pairs.items() if key not in self._sections]
+            with self._lock:
+                removed = [key for key in self._sections if key not in pairs]
+                for key in removed:
+                    self._remove(key)
+                for section in added:
+                    self._add(section)
+                self._signature = signature
+            logger.info(f"Индекс базы знаний обновлён: +{len(added)} / -{len(removed)}, всего {len(self._sections)} разделов")
+            return True
+
+    def _add(self, section: Section):
+        self._sections[section.key] = section
+        self._total_length += section.length
+        for term, tf in section.terms.items():
+            self._postings.setdefault(term, {})[section.key] = tf
+
+    def _remove(self, key: str):
+        section = self._sections.pop(key)
+        self._total_length -= section.length
+        for term in section.terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query: str, limit: int = 3) -> list:
+        """Возвращает до limit пар (score, Section) по убыванию релевантности"""
+        self.refresh()
+        terms = set(normalize_tokens(query))
+        if not terms:
+            return []
+        with self._lock:
+            count = len(self._sections)
+            if not count:
+                return []
+            avg_length = self._total_length / count
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, tf in postings.items():
+                    length = self._sections[key].length
+                    norm = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+                    scores[key] = scores.get(key, 0.0) + idf * norm
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+            return [(score, self._sections[key]) for key, score in best]
+
+    def answer(self, query: str):
+        """Раздел для быстрого ответа без Assistant или None, если совпадение неуверенное"""
+        results = self.search(query, limit=2)
+        if not results:
+            return None
+        score, section = results[0]
+        if score < self.min_score:
+            return None
+        if len(results) > 1 and score < results[1][0] * self.min_margin:
+            return None
+        # Вопрос пользователя должен в основном совпадать с вопросом раздела FAQ
+        terms = set(normalize_tokens(query))
+        coverage = len(terms & section.question_terms) / len(terms)
+        if coverage < self.min_coverage:
+            return None
+        self.fast_answers += 1
+        return section
+
+    def passages(self, query: str, limit: int = 3) -> list:
+        """Тексты наиболее подходящих разделов для передачи в Assistant"""
+        return [section.as_passage() for _, section in self.search(query, limit)]
+
+    def stats(self) -> dict:
+        return {
+            'sections': len(self._sections),
+            'terms': len(self._postings),
+            'fast_answers': self.fast_answers,
+        }
@@ -0,0 +1,429 @@
+import os
+import json
+import uuid
+import asyncio
+import hashlib
+import logging
+import threading
+import functools
+from types import SimpleNamespace
+
+from booking_extractor import BookingExtraction
+from knowledge_index import parse_sections
+from resilience import Deadline, RetryPolicy, call_with_retry_async, is_transient
+
+logger = logging.getLogger(__name__)
+
+# Поля сообщения, которые уходят в Chat Completions (id — только для истории)
+API_FIELDS = ('role', 'content', 'tool_calls', 'tool_call_id')
+WEEKDAY_TITLES = ('понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота', 'воскресенье')
+
+
+def text_message(message_id: str, role: str, text: str):
+    """Сообщение истории в том же виде, что сообщения thread Assistants API (id, role, content[].text.value)"""
+    content = [SimpleNamespace(type='text', text=SimpleNamespace(value=text))] if text else []
+    return SimpleNamespace(id=message_id, role=role, content=content)
+
+
+class StaticPrompt:
+    """Системный промпт из промпт.txt и базы знаний knowledge.txt.
+
+    Текст одинаков для всех диалогов, поэтому стоит в начале запроса и попадает
+    в кэш префиксов у провайдера. Файлы перечитываются, если изменились.
+    """
+
+    def __init__(self, prompt_path: str, knowledge_path: str = None):
+        self.prompt_path = prompt_path
+        self.knowledge_path = knowledge_path
+        self._mtimes = None
+        self._text = ''
+        self.version = ''
+        self._lock = threading.Lock()
+
+    def _current_mtimes(self) -> tuple:
+        return tuple(os.path.getmtime(path) if path and os.path.exists(path) else None
+                     for path in (self.prompt_path, self.knowledge_path))
+
+    @property
+    def text(self) -> str:
+        mtimes = self._current_mtimes()
+        if mtimes != self._mtimes:
+            with self._lock:
+                if mtimes != self._mtimes:
+                    self._text = self._build()
+                    self.version = hashlib.sha1(self._text.encode('utf-8')).hexdigest()[:12]
+                    self._mtimes = mtimes
+                    logger.info(f"Системный промпт собран: {len(self._text)} символов (версия {self.version})")
+        return self._text
+
+    def _build(self) -> str:
+        with open(self.prompt_path, encoding='utf-8') as f:
+            text = f.read().strip()
+        if self.knowledge_path and os.path.exists(self.knowledge_path):
+            with open(self.knowledge_path, encoding='utf-8') as f:
+                sections = parse_sections(f.read())
+            # Пары «вопрос — ответ» текстом: короче JSON и привычнее модели
+            knowledge = "\n\n".join(f"Вопрос: {question}\nОтвет: {answer}" if question else answer
+                                    for question, answer in sections if answer)
+            text += "\n\nБАЗА ЗНАНИЙ (отвечай по ней, без ссылок на источник):\n\n" + knowledge
+        return text
+
+
+class LocalThreads:
+    """Диалоги в хранилище сессий (пространство имён 'chat_history') вместо thread OpenAI.
+
+    Интерфейс тот же, что у AsyncAssistantClient: create_thread, add_message,
+    iter_messages, delete_thread, — поэтому планировщик run, извлечение данных записи
+    и перенос длинных диалогов работают с любым бэкендом. Подкласс реализует run().
+    Хранилище сессий (SQLite) вызывается в потоках executor, а не в event loop.
+    """
+
+    NAMESPACE = 'chat_history'
+
+    def __init__(self, sessions, ttl: float = 30 * 24 * 3600, executor=None):
+        self.sessions = sessions
+        self.ttl = ttl
+        self.executor = executor
+
+    async def _blocking(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def history(self, thread_id: str) -> list:
+        return await self._blocking(self.sessions.get, self.NAMESPACE, thread_id) or []
+
+    async def _save(self, thread_id: str, history: list):
+        await self._blocking(self.sessions.set, self.NAMESPACE, thread_id, history, ttl=self.ttl)
+
+    def _append_blocking(self, thread_id: str, messages: list):
+        history = self.sessions.get(self.NAMESPACE, thread_id) or []
+        for message in messages:
+            history.append({'id': f"msg_{uuid.uuid4().hex[:16]}", **message})
+        self.sessions.set(self.NAMESPACE, thread_id, history, ttl=self.ttl)
+
+    async def _append(self, thread_id: str, messages: list):
+        await self._blocking(self._append_blocking, thread_id, messages)
+
+    async def create_thread(self, messages=None, deadline: Deadline = None) -> str:
+        thread_id = f"chat_{uuid.uuid4().hex}"
+        await self._save(thread_id, [])
+        if messages:
+            await self._append(thread_id, [{'role': item['role'], 'content': item['content']} for item in messages])
+        return thread_id
+
+    async def delete_thread(self, thread_id: str):
+        await self._blocking(self.sessions.pop, self.NAMESPACE, thread_id)
+
+    async def add_message(self, thread_id: str, content: str, role: str = "user", deadline: Deadline = None):
+        await self._append(thread_id, [{'role': role, 'content': content}])
+
+    async def iter_messages(self, thread_id: str, after: str = None, page_size: int = 100):
+        """Сообщения клиента и ответы (без служебных сообщений функций) от старых к новым, после after"""
+        history = await self.history(thread_id)
+        ids = [message['id'] for message in history]
+        start = ids.index(after) + 1 if after in ids else 0
+        for message in history[start:]:
+            if message['role'] in ('user', 'assistant') and message.get('content'):
+                yield text_message(message['id'], message['role'], message['content'])
+
+    async def list_messages(self, thread_id: str):
+        """Сообщения от новых к старым"""
+        return list(reversed([message async for message in self.iter_messages(thread_id)]))
+
+    async def cancel_run(self, thread_id: str, run_id: str):
+        pass
+
+    async def _call_tools(self, tool_handler, tool_calls: list, executor=None) -> list:
+        """Выполняет функции модели в потоке пула: [(вызов, результат)]"""
+        results = []
+        for call in tool_calls:
+            try:
+                arguments = json.loads(call['arguments'] or '{}')
+            except ValueError:
+                arguments = {}
+            logger.info("Модель вызывает функцию: %s", call['name'])
+            logger.debug("Аргументы функции %s: %s", call['name'], arguments)
+            if tool_handler:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    executor, functools.partial(tool_handler, call['name'], arguments, call['id'])
+                )
+            else:
+                result = {"success": False, "message": f"Функция {call['name']} не поддерживается"}
+            results.append((call, result))
+        return results
+
+    @staticmethod
+    def saved_booking(results: list) -> bool:
+        """Все вызовы — успешная save_booking_data с готовым текстом для клиента (client_message).
+
+        Только тогда ответ даётся без второго запроса к модели: остальные результаты
+        (проверка времени, нехватка данных, занятое время) написаны для модели.
+        """
+        return bool(results) and all(
+            call['name'] == 'save_booking_data' and isinstance(result, dict)
+            and result.get('success') and result.get('client_message')
+            for call, result in results
+        )
+
+    async def _record_tools(self, thread_id: str, text: str, results: list):
+        """Записывает в историю вызовы функций и их результаты (для следующего запроса к модели)"""
+        messages = [{'role': 'assistant', 'content': text or None, 'tool_calls': [
+            {'id': call['id'], 'type': 'function', 'function': {'name': call['name'], 'arguments': call['arguments']}}
+            for call, _ in results
+        ]}]
+        messages.extend({'role': 'tool', 'tool_call_id': call['id'], 'content': json.dumps(result, ensure_ascii=False)}
+                        for call, result in results)
+        await self._append(thread_id, messages)
+
+    async def _finish(self, thread_id: str, text: str, results: list = ()) -> str:
+        """Записывает ответ в историю и возвращает текст, который увидел клиент.
+
+        results — успешные save_booking_data (saved_booking): клиенту уходят текст
+        модели и client_message из результатов.
+        """
+        replies = [result['client_message'] for _, result in results]
+        answer = "\n\n".join(([text] if text else []) + replies)
+        if results:
+            await self._record_tools(thread_id, text, results)
+            await self._append(thread_id, [{'role': 'assistant', 'content': "\n\n".join(replies)}])
+        elif text:
+            await self._append(thread_id, [{'role': 'assistant', 'content': text}])
+        return answer
+
+
+class ChatCompletionsBackend(LocalThreads):
+    """Ответ одним потоковым запросом Chat Completions вместо цепочки вызовов Assistants API.
+
+    Промпт собирается локально, история хранится у нас. Порядок сообщений
+    рассчитан на кэш префиксов провайдера: сначала неизменный системный промпт
+    (инструкции и база знаний) и описание функций, затем история в том же виде,
+    что и в прошлых запросах, и только перед новыми сообщениями клиента — то, что
+    меняется от запроса к запросу (текущая дата, фрагменты базы знаний).
+
+    Успешная save_booking_data завершает ответ без второго запроса (см.
+    LocalThreads.saved_booking); результаты остальных функций возвращаются модели
+    следующим запросом, не больше max_tool_rounds раз за ответ.
+    """
+
+    def __init__(self, sessions, api_key: str, model: str, prompt: StaticPrompt, tools: list = None, executor=None,
+                 breaker=None, retry: RetryPolicy = None, call_timeout: float = 30, run_timeout: float = 90,
+                 now=None, cache_key: str = 'tvoye-pravo', ttl: float = 30 * 24 * 3600, max_tool_rounds: int = 3):
+        super().__init__(sessions, ttl, executor)
+        self.api_key = api_key
+        self.model = model
+        self.prompt = prompt
+        self.tools = tools or []
+        self.breaker = breaker
+        self.retry = retry or RetryPolicy()
+        self.call_timeout = call_timeout
+        self.run_timeout = run_timeout
+        self.now = now
+        self.cache_key = cache_key
+        self.max_tool_rounds = max_tool_rounds
+        self.requests = 0
+        self.follow_ups = 0
+        self.tool_calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._client = None
+
+    @property
+    def client(self):
+        """AsyncOpenAI создаётся лениво, повторы SDK выключены (их делает call_with_retry_async)"""
+        if self._client is None:
+            import openai
+            self._client = openai.AsyncOpenAI(api_key=self.api_key, max_retries=0, timeout=self.call_timeout)
+        return self._client
+
+    def build_messages(self, history: list, additional_instructions: str = None) -> list:
+        """Сообщения запроса: постоянный префикс, история, изменчивый контекст, новые сообщения клиента"""
+        messages = [{'role': 'system', 'content': self.prompt.text}]
+        messages.extend({field: message[field] for field in API_FIELDS if field in message} for message in history)
+        context = []
+        if self.now:
+            now = self.now()
+            context.append(f"Сейчас {now:%d.%m.%Y %H:%M}, {WEEKDAY_TITLES[now.weekday()]}.")
+        if additional_instructions:
+            context.append(additional_instructions)
+        if context:
+            # Перед последними сообщениями клиента: префикс с историей остаётся прежним
+            position = len(messages)
+            while position > 1 and messages[position - 1]['role'] == 'user':
+                position -= 1
+            messages.insert(position, {'role': 'system', 'content': "\n\n".join(context)})
+        return messages
+
+    async def run(self, thread_id: str, tool_handler=None, on_delta=None, deadline: Deadline = None, on_usage=None,
+                  additional_instructions: str = None, **run_kwargs):
+        """Ответ модели потоковыми запросами; возвращает (status, text) как AsyncAssistantClient.run"""
+        deadline = deadline or Deadline(self.run_timeout)
+        parts = []  # тексты прошлых кругов, уже отправленные клиенту
+        streamed = []  # фрагменты текущего круга
+
+        async def delta_sink(delta: str):
+            # Текст нового круга отделяется от показанного раньше пустой строкой
+            if parts and not streamed:
+                delta = "\n\n" + delta
+            streamed.append(delta)
+            await on_delta(delta)
+
+        usage, calls = None, 0
+        for round_number in range(self.max_tool_rounds + 1):
+            streamed.clear()
+            request = self.build_messages(await self.history(thread_id), additional_instructions)
+            # В последнем круге модель должна ответить текстом, без новых вызовов функций
+            tool_choice = 'none' if round_number == self.max_tool_rounds else None
+            try:
+                text, tool_calls, usage = await self._request(
+                    request, delta_sink if on_delta else None, deadline, tool_choice
+                )
+            except TimeoutError:
+                logger.error(f"Ответ модели для {thread_id} не получен за отведённое время")
+                return 'timeout', None
+            if round_number:
+                self.follow_ups += 1
+            results = await self._call_tools(tool_handler, tool_calls, self.executor)
+            calls += len(results)
+            if results and not self.saved_booking(results):
+                # Результаты написаны для модели: клиенту она ответит следующим запросом
+                await self._record_tools(thread_id, text, results)
+                if text:
+                    parts.append(text)
+                continue
+            reply = await self._finish(thread_id, text, results)
+            if on_delta and reply != text:
+                await delta_sink(reply[len(text):])
+            parts.append(reply)
+            break
+        answer = "\n\n".join(part for part in parts if part)
+        self.tool_calls += calls
+        if on_usage and usage:
+            on_usage(usage)
+        logger.info("🏁 Ответ модели: %d символов, функций %d, токенов контекста %s (из кэша %s)",
+                    len(answer), calls, getattr(usage, 'prompt_tokens', None),
+                    getattr(getattr(usage, 'prompt_tokens_details', None), 'cached_tokens', None))
+        return ('completed' if answer else 'incomplete'), answer
+
+    async def _request(self, request: list, on_delta, deadline: Deadline, tool_choice: str = None):
+        """Один потоковый запрос с повторами и учётом токенов: (text, tool_calls, usage)"""
+        output = {}
+        # Повтор безопасен, только пока клиент не получил ни одного фрагмента ответа
+        policy = RetryPolicy(self.retry.attempts, self.retry.base_delay, self.retry.max_delay,
+                             retry_if=lambda e: not output and is_transient(e))
+        text, tool_calls, usage = await call_with_retry_async(
+            lambda: self._stream(request, on_delta, output, tool_choice), policy, self.breaker, deadline,
+            name='OpenAI chat.completions'
+        )
+        self.requests += 1
+        self.prompt_tokens += getattr(usage, 'prompt_tokens', None) or 0
+        self.cached_tokens += getattr(getattr(usage, 'prompt_tokens_details', None), 'cached_tokens', None) or 0
+        return text, tool_calls, usage
+
+    async def _stream(self, request: list, on_delta, output: dict, tool_choice: str = None):
+        options = {'tools': self.tools} if self.tools else {}
+        if self.tools and tool_choice:
+            options['tool_choice'] = tool_choice
+        if self.cache_key:
+            options['prompt_cache_key'] = f"{self.cache_key}-{self.prompt.version}"
+        stream = await self.client.chat.completions.create(
+            model=self.model, messages=request, stream=True, stream_options={'include_usage': True}, **options
+        )
+        parts = []
+        calls = {}  # индекс вызова -> {'id', 'name', 'arguments'} (аргументы приходят по частям)
+        usage = None
+        async for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            for choice in chunk.choices:
+                delta = choice.delta
+                if delta.content:
+                    parts.append(delta.content)
+                    output['started'] = True
+                    if on_delta:
+                        await on_delta(delta.content)
+                for call in delta.tool_calls or ():
+                    item = calls.setdefault(call.index, {'id': None, 'name': '', 'arguments': ''})
+                    item['id'] = call.id or item['id']
+                    if call.function:
+                        item['name'] += call.function.name or ''
+                        item['arguments'] += call.function.arguments or ''
+        return "".join(parts), [calls[index] for index in sorted(calls)], usage
+
+    def stats(self) -> dict:
+        return {
+            'model': self.model,
+            'prompt_version': self.prompt.version,
+            'requests': self.requests,
+            'follow_ups': self.follow_ups,
+            'tool_calls': self.tool_calls,
+            'prompt_tokens': self.prompt_tokens,
+            'cached_tokens': self.cached_tokens,
+            'cache_hit_ratio': round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else None,
+        }
+
+
+class FakeLLMBackend(LocalThreads):
+    """Детерминированная модель без сети — для тестов и локального запуска.
+
+    Ответ зависит только от истории диалога: answer(message) (например, база знаний)
+    или повтор вопроса. Когда в сообщениях клиента собраны имя, телефон, услуга
+    и дата (BookingExtraction), один раз вызывается save_booking_data; неуспешный
+    результат, как и у ChatCompletionsBackend, получает ответ следующим запросом.
+    """
+
+    def __init__(self, sessions, answer=None, chunks: int = 4, executor=None, ttl: float = 30 * 24 * 3600):
+        super().__init__(sessions, ttl, executor)
+        self.answer = answer
+        self.chunks = chunks
+        self.runs = 0
+
+    async def run(self, thread_id: str, tool_handler=None, on_delta=None, deadline: Deadline = None, on_usage=None,
+                  **run_kwargs):
+        self.runs += 1
+        history = await self.history(thread_id)
+        user_messages = [message['content'] for message in history if message['role'] == 'user']
+        if not user_messages:
+            return 'incomplete', None
+        extraction = BookingExtraction()
+        for message in user_messages:
+            extraction.feed(message)
+        booking = extraction.result()
+        tool_results = [json.loads(message['content']) for message in history if message['role'] == 'tool']
+
+        tool_calls = []
+        if history[-1]['role'] == 'tool':
+            # Ответ после результата функции (например, время занято)
+            text = "Не получилось оформить запись."
+            if tool_results[-1].get('free_slots'):
+                text += " Свободное время: " + ", ".join(tool_results[-1]['free_slots']) + "."
+        elif booking and booking['service'] and booking['date'] and not tool_results:
+            arguments = {'name': booking['name'], 'phone': booking['phone'], 'service': booking['service'],
+                         'datetime': booking['date'], 'documents': booking['documents'], 'comments': booking['comment']}
+            tool_calls.append({'id': f"call_{thread_id}_{len(history)}", 'name': 'save_booking_data',
+                               'arguments': json.dumps(arguments, ensure_ascii=False)})
+            text = "Все данные собраны, сохраняю вашу запись."
+        else:
+            question = user_messages[-1]
+            text = (self.answer(question) if self.answer else None) or f"Ответ на вопрос: {question}"
+
+        if on_delta:
+            step = max(1, len(text) // max(1, self.chunks))
+            for start in range(0, len(text), step):
+                await on_delta(text[start:start + step])
+        results = await self._call_tools(tool_handler, tool_calls, self.executor)
+        if results and not self.saved_booking(results):
+            # Как ChatCompletionsBackend: результат уходит модели, клиент получает её следующий ответ
+            await self._record_tools(thread_id, text, results)
+            if on_delta:
+                await on_delta("\n\n")
+            status, follow_up = await self.run(thread_id, on_delta=on_delta, on_usage=on_usage)
+            return status, f"{text}\n\n{follow_up}"
+        answer = await self._finish(thread_id, text, results)
+        if on_delta and answer != text:
+            await on_delta(answer[len(text):])
+        if on_usage:
+            chars = sum(len(message.get('content') or '') for message in history)
+            on_usage(SimpleNamespace(prompt_tokens=chars // 3, completion_tokens=len(answer) // 3))
+        return 'completed', answer
+
+    def stats(self) -> dict:
+        return {'runs': self.runs}
@@ -1,28 +1,50 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import telegram
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ConversationHandler
 import json
 import logging
 import asyncio
 import threading
+import queue
+import atexit
+import math
+import time
+import os
+from update_queue import UpdateQueue
+from persistence import SqlitePersistence, SharedConversationHandler
 from functions import (
     start, handle_mode_choice, get_name, get_phone, get_service,
     get_date, get_documents, get_comment, cancel, consultation_handler, debug_handler,
+    find_bookings_command, day_bookings_command, week_bookings_command,
     STATE_NAME, STATE_PHONE, STATE_SERVICE, STATE_DATE, STATE_DOCUMENTS, STATE_COMMENT,
-    logger, NGROK_URL, save_application_to_sheets, get_assistant_response,
-    TELEGRAM_BOT_TOKEN
+    logger, NGROK_URL, save_application_to_sheets, is_duplicate, booking_dedup, get_assistant_response_async,
+    assistant_pool, sheets_spool, notifier, send_telegram_notification, answer_cache,
+    knowledge_index, sessions, thread_scheduler, thread_prewarmer, metrics, sheets_health, TELEGRAM_BOT_TOKEN, TELEGRAM_API_URL,
+    admission, admit_assistant_request, release_after_run, breakers_health, warm_up_clients, clients_ready,
+    thread_rollover, llm_backend_health, slot_calendar, booking_mirror, start_bookings_sync, is_slot_taken, slot_unavailable_text, free_slot_texts, format_slot
 )
+from metrics import MetricsRegistry
+from structured_logging import request_id_var, new_request_id, bind_request_id, log_settings
 
 # Создаём Flask приложение
 app = Flask(__name__)
 CORS(app)  # Разрешаем CORS для веб-виджета
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+# Логирование настраивается в functions.py (structured_logging.setup_logging)
+# Токен для /admin/logging; без него переключение логирования во время работы недоступно
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# Многопроцессный режим (gunicorn/uWSGI): состояние диалогов FSM общее для всех воркеров
+MULTIPROCESS = os.getenv('MULTIPROCESS', '0') == '1'
+PERSIST_CONVERSATIONS = MULTIPROCESS or os.getenv('PERSIST_CONVERSATIONS', '0') == '1'
+conversation_store = SqlitePersistence(os.getenv('CONVERSATION_DB_PATH', 'conversations.db')) if PERSIST_CONVERSATIONS else None
 
 # Создаём глобальный Telegram Application
-application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+application_builder = Application.builder().token(TELEGRAM_BOT_TOKEN).base_url(f"{TELEGRAM_API_URL}/bot")
+if conversation_store:
+    application_builder = application_builder.persistence(conversation_store)
+application = application_builder.build()
 
 # Глобальная инициализация Application
 import asyncio
@@ -31,17 +53,61 @@ import threading
 # Глобальный event loop для Telegram
 telegram_loop = None
 telegram_thread = None
+# Устанавливается, когда application.initialize() и запуск фоновых задач завершены
+telegram_ready = threading.Event()
+telegram_init_error = None
+startup_seconds = None
+# Сколько ждать готовности telegram_loop при запуске воркера (сек)
+STARTUP_TIMEOUT = float(os.getenv('STARTUP_TIMEOUT', '30'))
+# Подготовка клиентов OpenAI и Sheets фоном при запуске; /ready ждёт её завершения
+WARM_UP_CLIENTS = os.getenv('WARM_UP_CLIENTS', '1') == '1'
+
+# Максимальное время ожидания ответа Assistant для /api/chat (сек)
+CHAT_TIMEOUT = float(os.getenv('CHAT_TIMEOUT', '120'))
+# За прокси (nginx, ngrok) IP клиента берётся из X-Forwarded-For, иначе — адрес соединения
+TRUST_PROXY = os.getenv('TRUST_PROXY', '0') == '1'
+
+# Режим webhook: 'sync' — ждать обработки update, 'ack' — сразу отвечать 200 и обрабатывать из очереди
+WEBHOOK_MODE = os.getenv('WEBHOOK_MODE', 'sync')
+update_queue = UpdateQueue(
+    maxsize=int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000')),
+    consumers=int(os.getenv('WEBHOOK_CONSUMERS', '4'))
+)
+
+# === Метрики HTTP и состояния процесса ===
+# Эндпоинты, для которых собирается гистограмма задержек (для стрима — время до начала ответа)
+METRIC_ENDPOINTS = {'/webhook', '/api/chat', '/api/chat/stream', '/api/booking'}
+http_request_seconds = metrics.histogram(
+    'http_request_seconds', 'Время обработки HTTP запроса', ['endpoint', 'status']
+)
+telegram_loop_up = metrics.gauge('telegram_loop_up', 'telegram_loop отвечает (1) или нет (0)')
+webhook_queue_depth = metrics.gauge('webhook_queue_depth', 'Updates в очереди webhook (режим ack)')
+sheets_spool_pending = metrics.gauge('sheets_spool_pending', 'Заявки, ещё не записанные в Google Sheets')
+assistant_pool_running = metrics.gauge('assistant_pool_running', 'Выполняющиеся запросы к Assistant')
+thread_pool_available = metrics.gauge('thread_pool_available', 'Готовые thread в запасе')
+assistant_inflight = metrics.gauge('assistant_inflight', 'Занятые слоты run Assistant (все процессы)')
+
+async def start_telegram(started_at: float):
+    """Инициализирует Application и фоновые задачи в текущем loop и отмечает готовность"""
+    global startup_seconds
+    await application.initialize()
+    await application.bot.initialize()
+    await notifier.start(application.bot)
+    await thread_prewarmer.start()
+    if WEBHOOK_MODE == 'ack':
+        await update_queue.start(application.process_update)
+    startup_seconds = round(time.perf_counter() - started_at, 3)
+    telegram_ready.set()
+    logger.info("Application и Bot инициализированы в постоянном loop за %.0f мс", startup_seconds * 1000)
 
-def run_telegram_loop():
+def run_telegram_loop(started_at: float):
     """Запускает постоянный event loop для Telegram в отдельном потоке"""
-    global telegram_loop
+    global telegram_loop, telegram_init_error
     telegram_loop = asyncio.new_event_loop()
     asyncio.set_event_loop(telegram_loop)
     
     async def init_and_run():
-        await application.initialize()
-        await application.bot.initialize()
-        logger.info("Application и Bot инициализированы в постоянном loop")
+        await start_telegram(started_at)
         # Держим loop открытым
         while True:
             await asyncio.sleep(1)
@@ -49,20 +115,102 @@ def run_telegram_loop():
     try:
         telegram_loop.run_until_complete(init_and_run())
     except Exception as e:
+        telegram_init_error = str(e)
         logger.error(f"Ошибка в telegram loop: {e}")
 
+def run_in_telegram_loop(coro, timeout=None):
+    """Выполняет корутину в telegram_loop и ждёт результат из потока Flask"""
+    future = asyncio.run_coroutine_threadsafe(bind_request_id(coro), telegram_loop)
+    return future.result(timeout=timeout)
+
+def telegram_loop_health(timeout: float = 2.0) -> dict:
+    """Проверяет, что telegram_loop жив и успевает выполнять задачи"""
+    if telegram_thread is None or not telegram_thread.is_alive() or not telegram_loop or not telegram_loop.is_running():
+        return {'alive': False, 'lag_ms': None}
+    if telegram_thread is threading.current_thread():
+        # Вызов из самого loop (асинхронный режим, asgi.py): ждать себя нельзя, раз выполняемся — жив
+        return {'alive': True, 'lag_ms': None}
+    started = time.perf_counter()
+    try:
+        run_in_telegram_loop(asyncio.sleep(0), timeout=timeout)
+    except Exception:
+        return {'alive': False, 'lag_ms': None}
+    return {'alive': True, 'lag_ms': round((time.perf_counter() - started) * 1000, 2)}
+
+telegram_loop_up.set_function(lambda: 1 if telegram_loop_health()['alive'] else 0)
+webhook_queue_depth.set_function(lambda: update_queue.depth)
+sheets_spool_pending.set_function(sheets_spool.pending)
+assistant_pool_running.set_function(lambda: assistant_pool.stats()['running'])
+thread_pool_available.set_function(lambda: thread_prewarmer.stats()['available'])
+assistant_inflight.set_function(lambda: admission.stats()['inflight'])
+
 def init_application():
-    """Запускаем Telegram в отдельном потоке с постоянным loop"""
+    """Запускаем Telegram в отдельном потоке с постоянным loop и ждём его готовности"""
     global telegram_thread
-    telegram_thread = threading.Thread(target=run_telegram_loop, daemon=True)
+    telegram_thread = threading.Thread(target=run_telegram_loop, args=(time.perf_counter(),), daemon=True)
     telegram_thread.start()
     
-    # Ждём инициализации
-    import time
-    time.sleep(2)
+    # Ждём события готовности; если loop упал при инициализации, ждать дальше незачем
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while not telegram_ready.wait(0.05):
+        if not telegram_thread.is_alive():
+            logger.error(f"❌ telegram_loop не запустился: {telegram_init_error}")
+            return False
+        if time.monotonic() >= deadline:
+            logger.error(f"❌ telegram_loop не готов за {STARTUP_TIMEOUT:.0f} с, продолжаем запуск")
+            return False
+    return True
+
+def start_worker():
+    """Запускает фоновые части процесса: telegram_loop и запись очереди Google Sheets"""
+    # В многопроцессном режиме вызывается в каждом воркере после fork (gunicorn.conf.py, wsgi.py)
+    # Клиенты OpenAI и Google Sheets создаются фоном, параллельно с запуском telegram_loop
+    if WARM_UP_CLIENTS:
+        threading.Thread(target=warm_up_clients, name='warm-up-clients', daemon=True).start()
+    init_application()
+    # Копия таблицы заявок и календарь записи загружаются фоном
+    start_bookings_sync()
+    
+    # Дописываем в Google Sheets заявки, оставшиеся в локальной очереди
+    sheets_spool.start()
+    atexit.register(shutdown_worker)
+
+def shutdown_worker():
+    """Останавливает фоновые части процесса при завершении"""
+    if telegram_loop is not None and telegram_loop.is_running():
+        try:
+            # Удаляем невыданные thread из запаса
+            run_in_telegram_loop(thread_prewarmer.shutdown(), timeout=10)
+        except Exception as e:
+            logger.error(f"Ошибка остановки запаса thread: {e}")
+    sheets_spool.stop()
+
+def set_webhook():
+    """Устанавливает webhook Telegram на NGROK_URL/webhook"""
+    try:
+        webhook_url = f"{NGROK_URL}/webhook"
+        
+        # Используем синхронный requests для установки webhook
+        import requests
+        telegram_api_url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/setWebhook"
+        response = requests.post(telegram_api_url, data={'url': webhook_url})
+        
+        if response.status_code == 200:
+            logger.info(f"✅ Telegram webhook установлен: {webhook_url}")
+        else:
+            logger.error(f"❌ Ошибка установки webhook: {response.text}")
+    except Exception as e:
+        logger.error(f"❌ Ошибка установки webhook: {e}")
 
 # === Настройка ConversationHandler ===
-conversation_handler = ConversationHandler(
+if conversation_store:
+    conversation_options = {'name': 'booking', 'persistent': True, 'store': conversation_store}
+    conversation_handler_class = SharedConversationHandler
+else:
+    conversation_options = {}
+    conversation_handler_class = ConversationHandler
+
+conversation_handler = conversation_handler_class(
     entry_points=[
         CommandHandler('start', start),
         MessageHandler(filters.Regex('^(Быстрая запись|Консультация)$'), handle_mode_choice)
@@ -76,33 +224,73 @@ conversation_handler = ConversationHandler(
         STATE_COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_comment)],
     },
     fallbacks=[CommandHandler('cancel', cancel)],
-    allow_reentry=True
+    allow_reentry=True,
+    **conversation_options
 )
 
+async def set_update_request_id(update, context):
+    """Id запроса для логов всех обработчиков update (и запущенных ими задач)"""
+    if isinstance(update, telegram.Update):
+        request_id_var.set(f"tg-{update.update_id}")
+
 # Добавляем handlers в Application
+application.add_handler(TypeHandler(object, set_update_request_id), group=-1)
+if conversation_store:
+    # Состояние диалога перечитывается из общего хранилища до проверки update обработчиком
+    application.add_handler(TypeHandler(telegram.Update, conversation_handler.refresh), group=-2)
 application.add_handler(conversation_handler)
+# Команды сотрудников (STAFF_USER_IDS и служебная группа); остальным не отвечают
+application.add_handler(CommandHandler('find', find_bookings_command))
+application.add_handler(CommandHandler('day', day_bookings_command))
+application.add_handler(CommandHandler('week', week_bookings_command))
 # Consultation handler должен быть ПЕРЕД debug handler
 application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, consultation_handler))
 application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, debug_handler))
 
 # === Flask Routes ===
 
+@app.before_request
+def start_request_timer():
+    request.started_at = time.perf_counter()
+    request_id_var.set(request.headers.get('X-Request-ID') or new_request_id())
+
+@app.after_request
+def observe_request(response):
+    if request.path in METRIC_ENDPOINTS and hasattr(request, 'started_at'):
+        http_request_seconds.observe(
+            time.perf_counter() - request.started_at, endpoint=request.path, status=response.status_code
+        )
+    response.headers['X-Request-ID'] = request_id_var.get()
+    return response
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Webhook endpoint для Telegram"""
     try:
-        logger.info('Telegram webhook получил запрос')
+        logger.debug('Telegram webhook получил запрос')
         
         # Получаем данные от Telegram
         data = request.get_json()
         if not data:
             logger.error('Нет данных в webhook запросе')
             return 'No data', 400
-            
-        logger.info(f'Webhook данные: {data}')
+        
+        # Полный update пишется в лог только при включённом логировании payload
+        if log_settings.payload():
+            logger.info('Webhook данные: %s', data)
         
         # Создаём Update объект
         update = telegram.Update.de_json(data, application.bot)
+        if update is None or not update.update_id:
+            logger.error('Некорректный update в webhook запросе')
+            return 'Bad update', 400
+        
+        # Режим ack: кладём update в очередь и сразу отвечаем Telegram
+        if WEBHOOK_MODE == 'ack':
+            if not update_queue.offer(update):
+                logger.warning('Очередь webhook переполнена (%d), update %s отклонён', update_queue.depth, update.update_id)
+                return 'Busy', 503, {'Retry-After': '5'}
+            return 'OK', 200
         
         # Обрабатываем update синхронно в telegram loop
         try:
@@ -113,18 +301,38 @@ def webhook():
             )
             future.result(timeout=10)  # Ждём результат максимум 10 сек
         except Exception as e:
-            logger.error(f"Ошибка обработки update: {e}")
+            logger.error("Ошибка обработки update: %s", e)
         
-        logger.info('Update обработан успешно')
+        logger.debug('Update обработан успешно')
         return 'OK', 200
         
     except Exception as e:
         logger.error(f'Ошибка в webhook: {e}', exc_info=True)
         return 'Error', 500
 
+def client_ip():
+    """IP клиента виджета для лимитов"""
+    if TRUST_PROXY and request.headers.get('X-Forwarded-For'):
+        return request.headers['X-Forwarded-For'].split(',')[0].strip()
+    return request.remote_addr
+
+def rate_limit_payload(decision):
+    """Тело и заголовки отказа 429 по решению admission"""
+    retry_after = max(1, math.ceil(decision.retry_after))
+    return {
+        'error': f'Слишком много запросов, повторите через {retry_after} сек.',
+        'retry_after': retry_after
+    }, {'Retry-After': str(retry_after)}
+
+def too_many_requests(decision):
+    """Быстрый отказ 429 с Retry-After вместо ожидания в очереди"""
+    payload, headers = rate_limit_payload(decision)
+    return jsonify(payload), 429, headers
+
 @app.route('/api/chat', methods=['POST'])
 def chat_api():
     """API для веб-виджета: консультации через OpenAI Assistant"""
+    slot = None
     try:
         data = request.get_json()
         message = data.get('message', '')
@@ -132,76 +340,283 @@ def chat_api():
         
         if not message:
             return jsonify({'error': 'Сообщение не может быть пустым'}), 400
+        
+        decision = admit_assistant_request(ip=client_ip(), thread=thread_id)
+        if not decision:
+            return too_many_requests(decision)
+        slot = decision.slot
             
-        # Получаем ответ от OpenAI Assistant
-        answer, new_thread_id = get_assistant_response(message, thread_id, 'Виджет')
+        # Получаем ответ от OpenAI Assistant (асинхронно, в telegram_loop).
+        # Слот освобождает сам run по завершении: после таймаута ожидания run ещё продолжается
+        future = asyncio.run_coroutine_threadsafe(bind_request_id(release_after_run(
+            assistant_pool.run(get_assistant_response_async(message, thread_id, 'Виджет')), slot
+        )), telegram_loop)
+        slot = None
+        answer, new_thread_id = future.result(timeout=CHAT_TIMEOUT)
         
+        # answer=None: сообщение объединено с более поздним, ответ придёт на него
         return jsonify({
             'response': answer,
-            'thread_id': new_thread_id
+            'thread_id': new_thread_id,
+            'merged': answer is None
         })
         
     except Exception as e:
         logger.error(f'Ошибка API чата: {e}')
         return jsonify({'error': 'Внутренняя ошибка сервера'}), 500
+    finally:
+        admission.release(slot)
+
+def sse_event(event: str, data: dict):
+    """Форматирует событие Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream_api():
+    """API для веб-виджета: ответ OpenAI Assistant по частям (Server-Sent Events)"""
+    data = request.get_json(silent=True) or {}
+    message = data.get('message', '')
+    thread_id = data.get('thread_id')
+    
+    if not message:
+        return jsonify({'error': 'Сообщение не может быть пустым'}), 400
+    
+    decision = admit_assistant_request(ip=client_ip(), thread=thread_id)
+    if not decision:
+        return too_many_requests(decision)
+    
+    # Фрагменты ответа передаются из telegram_loop в поток Flask через очередь
+    events = queue.Queue()
+    
+    async def on_delta(text):
+        events.put(('delta', {'text': text}))
+    
+    async def produce():
+        try:
+            answer, new_thread_id = await assistant_pool.run(
+                get_assistant_response_async(message, thread_id, 'Виджет', on_delta=on_delta)
+            )
+            events.put(('thread_id', {'thread_id': new_thread_id}))
+            events.put(('done', {'response': answer, 'merged': answer is None}))
+        except Exception as e:
+            logger.error(f'Ошибка стрима чата: {e}')
+            events.put(('error', {'error': 'Внутренняя ошибка сервера'}))
+        finally:
+            # Слот занят до конца run, даже если клиент уже закрыл соединение; SQLite — не в telegram_loop
+            await assistant_pool.run_blocking(admission.release, decision.slot)
+    
+    try:
+        asyncio.run_coroutine_threadsafe(bind_request_id(produce()), telegram_loop)
+    except Exception as e:
+        logger.error(f'Ошибка запуска стрима чата: {e}')
+        admission.release(decision.slot)
+        return jsonify({'error': 'Внутренняя ошибка сервера'}), 500
+    
+    def generate():
+        while True:
+            try:
+                event, payload = events.get(timeout=CHAT_TIMEOUT)
+            except queue.Empty:
+                yield sse_event('error', {'error': 'Превышено время ожидания ответа'})
+                return
+            yield sse_event(event, payload)
+            if event in ('done', 'error'):
+                return
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def parse_booking(data: dict):
+    """Проверяет заявку виджета. Возвращает (booking_data, None) или (None, текст ошибки)"""
+    # Валидация обязательных полей
+    required_fields = ['name', 'phone', 'service', 'date']
+    for field in required_fields:
+        if not data.get(field):
+            return None, f'Поле {field} обязательно для заполнения'
+    
+    # Подготавливаем данные для сохранения
+    return {
+        'name': data.get('name'),
+        'phone': data.get('phone'),
+        'service': data.get('service'),
+        'date': data.get('date'),
+        'documents': data.get('documents', ''),
+        'comment': data.get('comment', ''),
+        'source': 'Виджет'
+    }, None
+
+def booking_notification_text(booking_data: dict) -> str:
+    """Уведомление о заявке с сайта для служебного чата"""
+    return (
+        f"📋 Новая заявка с сайта:\n\n"
+        f"👤 Имя: {booking_data['name']}\n"
+        f"📞 Телефон: {booking_data['phone']}\n"
+        f"⚖️ Услуга: {booking_data['service']}\n"
+        f"📅 Дата: {booking_data['date']}\n"
+        f"📄 Документы: {booking_data['documents']}\n"
+        f"💬 Комментарий: {booking_data['comment']}"
+    )
+
+def booking_response(booking_data: dict, result):
+    """Ответ /api/booking по результату save_application_to_sheets: (dict, HTTP статус)"""
+    if is_duplicate(result):
+        return {'success': True, 'duplicate': True, 'message': 'Заявка уже принята'}, 200
+    if is_slot_taken(result):
+        return {
+            'error': slot_unavailable_text(result['status'], result['alternatives']),
+            'status': result['status'],
+            'alternatives': result['alternatives']
+        }, 409
+    if result:
+        # Отправляем уведомление в Telegram
+        send_telegram_notification(booking_notification_text(booking_data))
+        return {'success': True, 'message': 'Заявка успешно отправлена'}, 200
+    return {'error': 'Ошибка при сохранении заявки'}, 500
 
 @app.route('/api/booking', methods=['POST'])
 def booking_api():
     """API для веб-виджета: быстрая запись к адвокату"""
     try:
         data = request.get_json()
+        booking_data, error = parse_booking(data)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Валидация обязательных полей
-        required_fields = ['name', 'phone', 'service', 'date']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({'error': f'Поле {field} обязательно для заполнения'}), 400
-        
-        # Подготавливаем данные для сохранения
-        booking_data = {
-            'name': data.get('name'),
-            'phone': data.get('phone'),
-            'service': data.get('service'),
-            'date': data.get('date'),
-            'documents': data.get('documents', ''),
-            'comment': data.get('comment', ''),
-            'source': 'Виджет'
-        }
-        
-        # Сохраняем в Google Sheets
-        result = save_application_to_sheets(booking_data)
-        
-        if result:
-            # Отправляем уведомление в Telegram
-            from functions import send_telegram_notification
-            notification_text = (
-                f"📋 Новая заявка с сайта:\n\n"
-                f"👤 Имя: {booking_data['name']}\n"
-                f"📞 Телефон: {booking_data['phone']}\n"
-                f"⚖️ Услуга: {booking_data['service']}\n"
-                f"📅 Дата: {booking_data['date']}\n"
-                f"📄 Документы: {booking_data['documents']}\n"
-                f"💬 Комментарий: {booking_data['comment']}"
-            )
-            send_telegram_notification(notification_text, application.bot)
-            
-            return jsonify({'success': True, 'message': 'Заявка успешно отправлена'})
-        else:
-            return jsonify({'error': 'Ошибка при сохранении заявки'}), 500
+        # Сохраняем в Google Sheets; повтор запроса с тем же ключом (или той же заявки) не записывается
+        idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+        result = save_application_to_sheets(
+            booking_data, idempotency_key=f"api:{idempotency_key}" if idempotency_key else None
+        )
+        payload, status = booking_response(booking_data, result)
+        return jsonify(payload), status
             
     except Exception as e:
         logger.error(f'Ошибка API записи: {e}')
         return jsonify({'error': 'Внутренняя ошибка сервера'}), 500
 
+def slots_report(args):
+    """Свободное время для виджета: (dict, HTTP статус).
+
+    args — параметры запроса: datetime (проверить это время), after (искать после), count (1–20)
+    """
+    try:
+        count = max(1, min(20, int(args.get('count') or 5)))
+    except ValueError:
+        return {'error': 'Некорректный параметр count'}, 400
+    after = None
+    if args.get('after'):
+        after = slot_calendar.parse(args['after'] if ':' in args['after'] else f"{args['after']} 00:00")
+        if after is None:
+            return {'error': 'Не удалось распознать параметр after'}, 400
+    payload = {
+        'slot_minutes': slot_calendar.slot_minutes,
+        'working_hours': slot_calendar.working_hours_text(),
+        # false — календарь ещё загружается: status unknown, slots пустой
+        'calendar_loaded': slot_calendar.loaded,
+    }
+    if args.get('datetime'):
+        slot = slot_calendar.parse(args['datetime'])
+        if slot is None:
+            return {'error': 'Не удалось распознать дату и время'}, 400
+        payload['datetime'] = format_slot(slot)
+        payload['status'] = slot_calendar.check(slot)
+        after = after or slot
+    payload['slots'] = free_slot_texts(after, count)
+    return payload, 200
+
+@app.route('/api/slots', methods=['GET'])
+def slots_api():
+    """API для веб-виджета: свободное время записи и проверка выбранного времени"""
+    payload, status = slots_report(request.args)
+    return jsonify(payload), status
+
+def health_report(server: str = 'flask'):
+    """Состояние сервиса для /health: (dict, HTTP статус)"""
+    loop_health = telegram_loop_health()
+    sheets = sheets_health()
+    breakers = breakers_health()
+    if not loop_health['alive']:
+        status = 'DOWN'
+    elif sheets['client'] == 'ошибка' or any(b['state'] != 'closed' for b in breakers.values()):
+        status = 'DEGRADED'
+    else:
+        status = 'OK'
+    return {
+        'status': status,
+        'service': 'Твоё право - Адвокатские услуги',
+        'telegram_bot': 'активен' if loop_health['alive'] else 'не отвечает',
+        'telegram_loop': loop_health,
+        'flask_api': 'активен',
+        'server': server,
+        'google_sheets': sheets,
+        'webhook_mode': WEBHOOK_MODE,
+        'webhook_queue': update_queue.stats(),
+        'notifier': notifier.stats(),
+        'answer_cache': answer_cache.stats(),
+        'knowledge_index': knowledge_index.stats(),
+        'thread_scheduler': thread_scheduler.stats(),
+        'thread_pool': thread_prewarmer.stats(),
+        'booking_dedup': booking_dedup.stats(),
+        'admission': admission.stats(),
+        'slot_calendar': slot_calendar.stats(),
+        'thread_rollover': thread_rollover.stats(),
+        'llm_backend': llm_backend_health(),
+        'booking_mirror': booking_mirror.stats(),
+        'circuit_breakers': breakers,
+        'sessions': {
+            'booking': sessions.size('booking'),
+            'thread': sessions.size('thread'),
+            'extraction': sessions.size('extraction')
+        }
+    }, 200 if loop_health['alive'] else 503
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Проверка работоспособности сервиса"""
-    return jsonify({
-        'status': 'OK',
-        'service': 'Твоё право - Адвокатские услуги',
-        'telegram_bot': 'активен',
-        'flask_api': 'активен'
-    })
+    payload, status = health_report()
+    return jsonify(payload), status
+
+def readiness_report():
+    """Готовность принимать трафик: telegram_loop инициализирован и отвечает, клиенты подготовлены"""
+    clients = clients_ready.is_set() or not WARM_UP_CLIENTS
+    ready = clients and telegram_ready.is_set() and telegram_loop_health(timeout=1.0)['alive']
+    return {
+        'ready': ready,
+        'telegram_loop': telegram_ready.is_set(),
+        'clients': clients,
+        'startup_seconds': startup_seconds,
+        'error': telegram_init_error
+    }, 200 if ready else 503
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Готовность принимать трафик (readiness probe)"""
+    payload, status = readiness_report()
+    return jsonify(payload), status
+
+@app.route('/admin/logging', methods=['GET', 'POST'])
+def logging_settings():
+    """Переключение подробного логирования без перезапуска (только с ADMIN_TOKEN)"""
+    if not ADMIN_TOKEN or request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            log_settings.update(
+                payloads=data.get('payloads'), sample_rate=data.get('sample_rate'), level=data.get('level')
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f'Некорректные настройки: {e}'}), 400
+        logger.warning('Настройки логирования изменены: %s', log_settings.stats())
+    return jsonify(log_settings.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Метрики процесса в текстовом формате Prometheus"""
+    return Response(metrics.render(), content_type=MetricsRegistry.CONTENT_TYPE)
 
 @app.route('/api/services', methods=['GET'])
 def get_services():
@@ -217,9 +632,13 @@ def index():
         'telegram_bot': '@assist_jura_bot',
         'api_endpoints': {
             'chat': '/api/chat',
+            'chat_stream': '/api/chat/stream',
             'booking': '/api/booking', 
             'services': '/api/services',
-            'health': '/health'
+            'slots': '/api/slots',
+            'health': '/health',
+            'ready': '/ready',
+            'metrics': '/metrics'
         }
     })
 
@@ -228,23 +647,10 @@ if __name__ == '__main__':
     logger.info("🚀 Запуск системы 'Твоё право'...")
     
     # Инициализируем Application глобально
-    init_application()
+    start_worker()
     
     # Устанавливаем webhook для Telegram
-    try:
-        webhook_url = f"{NGROK_URL}/webhook"
-        
-        # Используем синхронный requests для установки webhook
-        import requests
-        telegram_api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/setWebhook"
-        response = requests.post(telegram_api_url, data={'url': webhook_url})
-        
-        if response.status_code == 200:
-            logger.info(f"✅ Telegram webhook установлен: {webhook_url}")
-        else:
-            logger.error(f"❌ Ошибка установки webhook: {response.text}")
-    except Exception as e:
-        logger.error(f"❌ Ошибка установки webhook: {e}")
+    set_webhook()
     
     # Запускаем Flask сервер
     logger.info("🌐 Запуск Flask API сервера на порту 5000...")
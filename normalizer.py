@@ -0,0 +1,44 @@
+import re
+
+# Слова без смысловой нагрузки для поиска (вежливые обороты, предлоги, местоимения).
+# Вопросительные слова (как, когда, где, кто, какой, можно) сюда не входят: «Как подать
+# на развод?» и «Когда можно подать на развод?» — разные вопросы с разными ответами
+STOP_WORDS = frozenset("""
+а б бы в вам вас ведь во вот все всё всего вы да даже для до его ее её ей ему если есть еще ещё же
+за здесь и из или им их к ли либо мне мной мы на над надо нам нас
+ним них но ну о об обо он она они оно от очень по под при про с со так также такой там те тем то тоже
+ту тут у уже хочу хотел хотела хотелось чем что чтобы эта эти это этот я
+могу могли пожалуйста подскажите скажите расскажите здравствуйте привет добрый день
+вечер утро спасибо
+""".split())
+
+# Окончания для упрощённого стемминга (от длинных к коротким)
+SUFFIXES = sorted("""
+ость ости остью ений ения ение ением ениям ениях ание ания анием аний
+иями иях иям ией ями ами ого его ому ему ыми ими ешь ете ите ишь ать ять ить еть уть ться тся
+ой ей ий ый ая яя ое ее ые ие ых их ую юю ов ев ам ям ах ях ом ем ия ии ию ья ье ью ет ут ют ит ат ят
+а я о е ы и у ю ь й
+""".split(), key=len, reverse=True)
+
+MIN_STEM_LENGTH = 3
+
+TOKEN_RE = re.compile(r"[a-zа-я0-9]+")
+
+
+def stem(word: str) -> str:
+    """Отрезает самое длинное подходящее окончание, оставляя основу не короче MIN_STEM_LENGTH"""
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_LENGTH:
+            return word[:-len(suffix)]
+    return word
+
+
+def normalize_tokens(text: str) -> list:
+    """Приводит текст к списку основ слов: регистр, ё, пунктуация, стоп-слова, окончания"""
+    text = text.lower().replace('ё', 'е')
+    return [stem(word) for word in TOKEN_RE.findall(text) if word not in STOP_WORDS]
+
+
+def question_key(text: str) -> str:
+    """Ключ вопроса, не зависящий от порядка слов, регистра и формы слов"""
+    return ' '.join(sorted(set(normalize_tokens(text))))
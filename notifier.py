@@ -0,0 +1,159 @@
+import time
+import asyncio
+import logging
+
+from telegram.error import RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+DIGEST_SEPARATOR = "\n\n———\n\n"
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Ждёт, пока появится токен, и забирает его"""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class TelegramNotifier:
+    """Постоянный отправщик уведомлений в служебный чат через telegram_loop.
+
+    Использует уже инициализированный application.bot (общий пул соединений),
+    соблюдает лимиты Telegram (общий и на чат) и, если за время ожидания лимита
+    в чат накопилось несколько уведомлений, отправляет их одним сводным сообщением.
+    """
+
+    def __init__(self, default_chat_id, global_rate: float = 30, chat_rate: float = 20 / 60,
+                 chat_burst: float = 3, max_queue: int = 1000, latency=None):
+        self.default_chat_id = default_chat_id
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_queue = max_queue
+        # Необязательная гистограмма времени отправки (observe(seconds, result=...))
+        self.latency = latency
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._queue = None
+        self._loop = None
+        self._bot = None
+        self._task = None
+        self.sent = 0
+        self.digests = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot):
+        """Запускает отправщик. Вызывается внутри telegram_loop после bot.initialize()"""
+        self._bot = bot
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = self._loop.create_task(self._run())
+        logger.info("Отправщик уведомлений Telegram запущен")
+
+    def notify(self, text: str, chat_id=None) -> bool:
+        """Ставит уведомление в очередь из любого потока. Возвращает False, если отправщик не запущен"""
+        if not self.running:
+            return False
+        self._loop.call_soon_threadsafe(self._put, chat_id or self.default_chat_id, text)
+        return True
+
+    def _put(self, chat_id, text):
+        try:
+            self._queue.put_nowait((chat_id, text))
+        except asyncio.QueueFull:
+            logger.error(f"Очередь уведомлений переполнена, уведомление для {chat_id} потеряно")
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _run(self):
+        while True:
+            first_chat, text = await self._queue.get()
+            # Пока ждём лимит чата, в очереди копятся новые уведомления — они уйдут сводкой
+            await self._chat_bucket(first_chat).acquire()
+            pending = {first_chat: [text]}
+            while not self._queue.empty():
+                chat_id, text = self._queue.get_nowait()
+                pending.setdefault(chat_id, []).append(text)
+
+            for chat_id, texts in pending.items():
+                for i, message in enumerate(self._compose(texts)):
+                    if chat_id != first_chat or i > 0:
+                        await self._chat_bucket(chat_id).acquire()
+                    await self._send(chat_id, message)
+
+    def _compose(self, texts: list) -> list:
+        """Одиночное уведомление отправляется как есть, несколько — сводкой (с разбиением по длине)"""
+        if len(texts) == 1:
+            return [texts[0][:MAX_MESSAGE_LENGTH]]
+
+        self.digests += 1
+        messages = []
+        current = f"📦 Сводка: {len(texts)} уведомлений"
+        for text in texts:
+            block = DIGEST_SEPARATOR + text
+            if len(current) + len(block) > MAX_MESSAGE_LENGTH:
+                messages.append(current)
+                current = text[:MAX_MESSAGE_LENGTH]
+            else:
+                current += block
+        messages.append(current)
+        return messages
+
+    async def _send(self, chat_id, text: str):
+        await self._global_bucket.acquire()
+        started = time.perf_counter()
+        result = 'error'
+        try:
+            for attempt in range(3):
+                try:
+                    await self._bot.send_message(chat_id=chat_id, text=text)
+                    self.sent += 1
+                    result = 'sent'
+                    logger.info("Уведомление отправлено в Telegram группу")
+                    return
+                except RetryAfter as e:
+                    logger.warning(f"Telegram ограничил отправку, повтор через {e.retry_after} сек")
+                    await asyncio.sleep(e.retry_after)
+                except TelegramError as e:
+                    logger.error(f"Ошибка отправки в Telegram: {e}")
+                    return
+            logger.error(f"Уведомление для {chat_id} не отправлено после повторов")
+        finally:
+            if self.latency is not None:
+                self.latency.observe(time.perf_counter() - started, result=result)
+
+    def stats(self) -> dict:
+        """Состояние отправщика для /health"""
+        return {
+            'running': self.running,
+            'queued': self._queue.qsize() if self._queue else 0,
+            'sent': self.sent,
+            'digests': self.digests,
+        }
@@ -0,0 +1,190 @@
+import json
+import asyncio
+import sqlite3
+import logging
+import threading
+
+import telegram
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Внутренние атрибуты ConversationHandler, на которые опирается SharedConversationHandler.
+# Проверены с python-telegram-bot 20.6 — версия закреплена в requirements.txt
+PTB_INTERNALS = ('_conversations', '_get_key', '_update_state')
+
+
+class SqlitePersistence(BasePersistence):
+    """Persistence PTB в локальном файле SQLite, общем для всех процессов-воркеров.
+
+    Хранит только состояния ConversationHandler: данные заявок лежат в хранилище
+    сессий (session_store), а user_data/chat_data/bot_data PTB бот не использует.
+    Состояния записываются сразу при смене шага (см. SharedConversationHandler),
+    поэтому периодический сброс Application не перезаписывает их устаревшими
+    значениями из памяти другого воркера.
+    """
+
+    def __init__(self, path: str, update_interval: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            " name TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " PRIMARY KEY (name, key))"
+        )
+
+    # === Прямой доступ к состояниям (используется SharedConversationHandler) ===
+    def load_state(self, name: str, key):
+        """Текущее состояние диалога или None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM conversations WHERE name = ? AND key = ?", (name, json.dumps(key))
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_state(self, name: str, key, state):
+        """Записывает состояние диалога; None удаляет диалог"""
+        with self._lock:
+            if state is None:
+                self._conn.execute(
+                    "DELETE FROM conversations WHERE name = ? AND key = ?", (name, json.dumps(key))
+                )
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                    (name, json.dumps(key), json.dumps(state))
+                )
+
+    # === Интерфейс BasePersistence ===
+    async def get_conversations(self, name: str):
+        with self._lock:
+            rows = self._conn.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        # Состояния уже записаны в save_state при смене шага
+        pass
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_user_data(self, user_id: int, data) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
+
+
+class SharedConversationHandler(ConversationHandler):
+    """ConversationHandler, состояние которого общее для всех процессов.
+
+    Перед проверкой update состояние диалога перечитывается из SqlitePersistence
+    (refresh — зарегистрируйте его TypeHandler в группе раньше обработчика),
+    а после смены шага записывается обратно, поэтому шаги одной заявки могут
+    обрабатываться разными воркерами gunicorn/uWSGI. Чтение и запись SQLite идут
+    в потоках executor, а не в event loop.
+
+    Публичный API persistence PTB читает состояния только при запуске Application,
+    поэтому класс использует внутренние атрибуты ConversationHandler (PTB_INTERNALS).
+    Если их нет (другая версия python-telegram-bot), обработчик не создаётся.
+    """
+
+    def __init__(self, *args, store: SqlitePersistence, **kwargs):
+        super().__init__(*args, **kwargs)
+        missing = [name for name in PTB_INTERNALS if not hasattr(self, name)]
+        if missing:
+            raise RuntimeError(f"SharedConversationHandler не поддерживает python-telegram-bot {telegram.__version__}: "
+                               f"нет {', '.join(missing)}")
+        self._store = store
+        self._writes = {}  # ключ диалога -> незавершённая запись состояния (Future)
+
+    def _conversation_key(self, update):
+        if not isinstance(update, Update) or not update.effective_chat or not update.effective_user:
+            return None
+        try:
+            return self._get_key(update)
+        except RuntimeError:
+            return None
+
+    async def refresh(self, update: object, context=None):
+        """Перечитывает состояние диалога update из общего хранилища"""
+        key = self._conversation_key(update)
+        if key is None:
+            return
+        write = self._writes.get(key)
+        if write is not None:
+            # Предыдущий шаг этого диалога в процессе ещё записывается
+            await asyncio.wait([write])
+        state = await asyncio.get_running_loop().run_in_executor(None, self._store.load_state, self.name, key)
+        if state is None:
+            self._conversations.pop(key, None)
+        elif self._conversations.get(key) != state:
+            self._conversations[key] = state
+
+    async def handle_update(self, update, *args, **kwargs):
+        result = await super().handle_update(update, *args, **kwargs)
+        write = self._writes.get(self._conversation_key(update))
+        if write is not None:
+            # Следующий шаг может прийти в другой воркер: update обработан, когда состояние записано
+            await asyncio.wait([write])
+        return result
+
+    def _update_state(self, new_state, key, handler=None) -> None:
+        super()._update_state(new_state, key, handler)
+        if new_state is None or isinstance(new_state, asyncio.Task):
+            return
+        write = asyncio.get_running_loop().run_in_executor(
+            None, self._store.save_state, self.name, key, self._conversations.get(key)
+        )
+        self._writes[key] = write
+
+        def done(future):
+            if self._writes.get(key) is future:
+                del self._writes[key]
+            if not future.cancelled() and future.exception() is not None:
+                logger.error(f"Не удалось записать состояние диалога {key}: {future.exception()}")
+
+        write.add_done_callback(done)
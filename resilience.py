@@ -0,0 +1,235 @@
+import sys
+import time
+import random
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# HTTP статусы, при которых повтор запроса имеет смысл
+TRANSIENT_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class DeadlineExceeded(TimeoutError):
+    """Общее время на операцию истекло"""
+
+
+class CircuitOpenError(RuntimeError):
+    """Предохранитель разомкнут: сервис недоступен, запрос не отправляется"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Сервис {name} временно недоступен, повтор через {retry_after:.0f} с")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def error_status(exc):
+    """HTTP статус ошибки OpenAI (status_code) или Google API (resp.status)"""
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(exc, 'resp', None), 'status', None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient(exc) -> bool:
+    """Временная ошибка: таймаут, обрыв соединения, 429 или 5xx"""
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    # Ошибка соединения OpenAI (модуль openai импортируется лениво, здесь его не загружаем)
+    openai = sys.modules.get('openai')
+    if openai is not None and isinstance(exc, openai.APIConnectionError):
+        return True
+    return error_status(exc) in TRANSIENT_STATUS
+
+
+class Deadline:
+    """Общий срок операции: сколько осталось и таймаут очередного вызова"""
+
+    def __init__(self, seconds: float = None):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def timeout(self, per_call: float = None):
+        """Таймаут вызова: не больше per_call и не больше остатка срока"""
+        remaining = self.remaining()
+        if remaining is None:
+            return per_call
+        return remaining if per_call is None else min(per_call, remaining)
+
+
+class RetryPolicy:
+    """Ограниченные повторы с экспоненциальной задержкой и full jitter"""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0, retry_if=is_transient):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_if = retry_if
+
+    def delay(self, attempt: int) -> float:
+        """Задержка перед повтором номер attempt (с 1): случайная в [0, base * 2^(attempt-1)]"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Предохранитель для внешнего сервиса.
+
+    После failure_threshold временных ошибок подряд размыкается: вызовы сразу
+    получают CircuitOpenError, не занимая потоки и слоты пула. Через
+    reset_timeout секунд пропускается пробный вызов (half_open): успех
+    замыкает предохранитель, ошибка снова размыкает его.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self.trips = 0
+        self._probe = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Пропускает вызов или бросает CircuitOpenError"""
+        with self._lock:
+            if self.state == self.OPEN:
+                waited = time.monotonic() - self.opened_at
+                if waited < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.reset_timeout - waited)
+                self.state = self.HALF_OPEN
+                self._probe = False
+            if self.state == self.HALF_OPEN:
+                if self._probe:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self._probe = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Предохранитель {self.name} замкнут: сервис снова отвечает")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                    logger.warning(f"Предохранитель {self.name} разомкнут после {self.failures} ошибок подряд")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe = False
+
+    def release(self):
+        """Снимает пробный вызов, прерванный без результата (отмена, KeyboardInterrupt)
+
+        Иначе предохранитель навсегда остался бы полуоткрытым: следующий
+        вызов считал бы, что проба ещё идёт, и отклонялся.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe = False
+
+    def record(self, exc):
+        """Учитывает результат вызова: только временные ошибки говорят о недоступности сервиса"""
+        if exc is None or not is_transient(exc):
+            self.record_success()
+        else:
+            self.record_failure()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'trips': self.trips,
+                'rejected': self.rejected,
+            }
+
+
+def call_with_retry(func, policy: RetryPolicy, breaker: CircuitBreaker = None, deadline: Deadline = None,
+                    name: str = 'call'):
+    """Вызывает func() с повторами временных ошибок в пределах deadline (синхронно)"""
+    attempt = 0
+    while True:
+        if deadline and deadline.expired:
+            raise DeadlineExceeded(f"{name}: истёк срок операции")
+        if breaker:
+            breaker.allow()
+        attempt += 1
+        try:
+            result = func()
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                if breaker:
+                    breaker.release()
+                raise
+            if breaker:
+                breaker.record(e)
+            if attempt >= policy.attempts or not policy.retry_if(e):
+                raise
+            delay = policy.delay(attempt)
+            if deadline and deadline.timeout(delay) < delay:
+                raise
+            logger.warning(f"{name}: временная ошибка ({e}), повтор {attempt} через {delay:.2f} с")
+            time.sleep(delay)
+        else:
+            if breaker:
+                breaker.record_success()
+            return result
+
+
+async def call_with_retry_async(factory, policy: RetryPolicy, breaker: CircuitBreaker = None,
+                                deadline: Deadline = None, timeout: float = None, name: str = 'call'):
+    """Ждёт await factory() с таймаутом попытки и повторами временных ошибок в пределах deadline"""
+    attempt = 0
+    while True:
+        call_timeout = deadline.timeout(timeout) if deadline else timeout
+        if call_timeout is not None and call_timeout <= 0:
+            raise DeadlineExceeded(f"{name}: истёк срок операции")
+        if breaker:
+            breaker.allow()
+        attempt += 1
+        try:
+            result = await asyncio.wait_for(factory(), call_timeout)
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                if breaker:
+                    breaker.release()
+                raise
+            if breaker:
+                breaker.record(e)
+            if attempt >= policy.attempts or not policy.retry_if(e):
+                raise
+            delay = policy.delay(attempt)
+            if deadline and deadline.timeout(delay) < delay:
+                raise
+            logger.warning(f"{name}: временная ошибка ({e}), повтор {attempt} через {delay:.2f} с")
+            await asyncio.sleep(delay)
+        else:
+            if breaker:
+                breaker.record_success()
+            return result
@@ -0,0 +1,207 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+
+class SessionEntry:
+    """Компактная запись сессии: значение и момент истечения"""
+    __slots__ = ('value', 'expires_at')
+
+    def __init__(self, value, expires_at: float):
+        self.value = value
+        self.expires_at = expires_at
+
+
+class SessionStore(ABC):
+    """Общий интерфейс хранилища сессий.
+
+    Данные разделены по пространствам имён (например 'booking' — черновик заявки,
+    'thread' — thread_id OpenAI), ключ — id пользователя. Значения должны
+    сериализоваться в JSON, чтобы хранилища были взаимозаменяемы.
+    """
+
+    def __init__(self, default_ttl: float = 24 * 3600):
+        self.default_ttl = default_ttl
+        self._eviction_thread = None
+        self._stopped = threading.Event()
+
+    @abstractmethod
+    def get(self, namespace: str, key, default=None):
+        ...
+
+    @abstractmethod
+    def set(self, namespace: str, key, value, ttl: float = None):
+        ...
+
+    @abstractmethod
+    def pop(self, namespace: str, key, default=None):
+        ...
+
+    @abstractmethod
+    def size(self, namespace: str = None) -> int:
+        ...
+
+    @abstractmethod
+    def evict_expired(self) -> int:
+        """Удаляет истёкшие сессии, возвращает их количество"""
+
+    def start_eviction(self, interval: float = 60.0):
+        """Запускает фоновую очистку истёкших сессий"""
+        if self._eviction_thread is not None:
+            return
+
+        def run():
+            while not self._stopped.wait(interval):
+                try:
+                    evicted = self.evict_expired()
+                    if evicted:
+                        logger.info(f"Удалено истёкших сессий: {evicted}")
+                except Exception as e:
+                    logger.error(f"Ошибка очистки сессий: {e}")
+
+        self._eviction_thread = threading.Thread(target=run, name='session-eviction', daemon=True)
+        self._eviction_thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _expires_at(self, ttl):
+        return time.time() + (self.default_ttl if ttl is None else ttl)
+
+
+class MemorySessionStore(SessionStore):
+    """Хранилище в памяти процесса: LRU с ограничением размера и TTL"""
+
+    def __init__(self, maxsize: int = 10000, default_ttl: float = 24 * 3600):
+        super().__init__(default_ttl)
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # (namespace, key) -> SessionEntry
+        self._counts = {}  # namespace -> количество записей
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key, default=None):
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            if entry is None:
+                return default
+            if entry.expires_at < time.time():
+                self._delete((namespace, key))
+                return default
+            self._data.move_to_end((namespace, key))
+            return entry.value
+
+    def set(self, namespace: str, key, value, ttl: float = None):
+        with self._lock:
+            if (namespace, key) not in self._data:
+                self._counts[namespace] = self._counts.get(namespace, 0) + 1
+            self._data[(namespace, key)] = SessionEntry(value, self._expires_at(ttl))
+            self._data.move_to_end((namespace, key))
+            while len(self._data) > self.maxsize:
+                (old_namespace, _), _ = self._data.popitem(last=False)
+                self._counts[old_namespace] -= 1
+
+    def pop(self, namespace: str, key, default=None):
+        with self._lock:
+            entry = self._delete((namespace, key))
+            if entry is None or entry.expires_at < time.time():
+                return default
+            return entry.value
+
+    def _delete(self, full_key):
+        entry = self._data.pop(full_key, None)
+        if entry is not None:
+            self._counts[full_key[0]] -= 1
+        return entry
+
+    def size(self, namespace: str = None) -> int:
+        if namespace is None:
+            return len(self._data)
+        return self._counts.get(namespace, 0)
+
+    def evict_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [full_key for full_key, entry in self._data.items() if entry.expires_at < now]
+            for full_key in expired:
+                self._delete(full_key)
+        return len(expired)
+
+
+class SqliteSessionStore(SessionStore):
+    """Хранилище в локальном файле SQLite: переживает перезапуск и общее для процессов"""
+
+    def __init__(self, path: str, maxsize: int = 100000, default_ttl: float = 24 * 3600):
+        super().__init__(default_ttl)
+        self.path = path
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires_at)")
+
+    def get(self, namespace: str, key, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM sessions WHERE namespace = ? AND key = ? AND expires_at >= ?",
+                (namespace, str(key), time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, namespace: str, key, value, ttl: float = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (namespace, str(key), json.dumps(value, ensure_ascii=False), self._expires_at(ttl), time.time())
+            )
+
+    def pop(self, namespace: str, key, default=None):
+        value = self.get(namespace, key, default)
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE namespace = ? AND key = ?", (namespace, str(key)))
+        return value
+
+    def size(self, namespace: str = None) -> int:
+        with self._lock:
+            if namespace is None:
+                return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE namespace = ?", (namespace,)
+            ).fetchone()[0]
+
+    def evict_expired(self) -> int:
+        with self._lock:
+            evicted = self._conn.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),)).rowcount
+            # Сверх лимита удаляем давно не обновлявшиеся сессии
+            overflow = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.maxsize
+            if overflow > 0:
+                evicted += self._conn.execute(
+                    "DELETE FROM sessions WHERE rowid IN (SELECT rowid FROM sessions ORDER BY updated_at LIMIT ?)",
+                    (overflow,)
+                ).rowcount
+        return evicted
+
+
+def create_session_store(backend: str = 'memory', path: str = 'sessions.db', maxsize: int = 10000,
+                         default_ttl: float = 24 * 3600) -> SessionStore:
+    """Создаёт хранилище сессий по имени: 'memory' или 'sqlite'"""
+    if backend == 'sqlite':
+        return SqliteSessionStore(path, maxsize=maxsize, default_ttl=default_ttl)
+    if backend == 'memory':
+        return MemorySessionStore(maxsize=maxsize, default_ttl=default_ttl)
+    raise ValueError(f"Неизвестное хранилище сессий: {backend}")
@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Урезанный discovery-документ Sheets API v4: только используемые методы spreadsheets.values
+DISCOVERY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'discovery', 'sheets.v4.json')
+DISCOVERY_METHODS = ('append', 'get')
+
+
+class LazySheetsClient:
+    """Клиент Google Sheets, создаваемый при первом обращении.
+
+    Импорт googleapiclient, чтение service account и разбор discovery-документа
+    не задерживают запуск процесса. Документ берётся из файла рядом с кодом
+    (без запроса к discovery API); если создать клиент не удалось, следующая
+    попытка — не раньше чем через retry_interval секунд.
+
+    httplib2.Http не потокобезопасен, а запросы идут из нескольких потоков (очередь
+    записи, синхронизация копии таблицы, пул Assistant): каждый поток выполняет
+    запросы через свой Http (execute).
+    """
+
+    def __init__(self, service_account_file: str, scopes: list, api_url: str = None, timeout: float = 20,
+                 discovery_path: str = DISCOVERY_PATH, retry_interval: float = 60):
+        self.service_account_file = service_account_file
+        self.scopes = scopes
+        self.api_url = api_url
+        self.timeout = timeout
+        self.discovery_path = discovery_path
+        self.retry_interval = retry_interval
+        self.init_seconds = None
+        self.error = None
+        self._failed_at = None
+        self._spreadsheets = None
+        self._credentials = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Ресурс spreadsheets(); RuntimeError, если клиент создать не удалось"""
+        spreadsheets = self._spreadsheets
+        if spreadsheets is not None:
+            return spreadsheets
+        with self._lock:
+            if self._spreadsheets is None:
+                if self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_interval:
+                    raise RuntimeError(f"Google Sheets не инициализирован: {self.error}")
+                self._spreadsheets = self._build()
+            return self._spreadsheets
+
+    def http(self):
+        """AuthorizedHttp текущего потока (создаётся при первом запросе из потока)"""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            from google_auth_httplib2 import AuthorizedHttp
+            import httplib2
+
+            # Таймаут запроса задаётся на уровне httplib2 (по умолчанию запрос может висеть бесконечно)
+            http = self._local.http = AuthorizedHttp(self._credentials, http=httplib2.Http(timeout=self.timeout))
+        return http
+
+    def execute(self, request):
+        """Выполняет запрос API (например, get().values().append(...)) через Http текущего потока"""
+        return request.execute(http=self.http())
+
+    def _build(self):
+        started = time.perf_counter()
+        try:
+            from google.auth.credentials import AnonymousCredentials
+            from google.oauth2 import service_account
+            from googleapiclient.discovery import build_from_document
+
+            if self.api_url and not os.path.exists(self.service_account_file):
+                # Заглушке не нужен service account
+                credentials = AnonymousCredentials()
+            else:
+                credentials = service_account.Credentials.from_service_account_file(
+                    self.service_account_file, scopes=self.scopes
+                )
+            self._credentials = credentials
+            with open(self.discovery_path, encoding='utf-8') as f:
+                document = f.read()
+            service = build_from_document(
+                document, http=self.http(),
+                client_options={'api_endpoint': self.api_url} if self.api_url else None
+            )
+            spreadsheets = service.spreadsheets()
+        except Exception as e:
+            self.error = str(e)
+            self._failed_at = time.monotonic()
+            logger.error(f"Ошибка инициализации Google Sheets: {e}")
+            raise RuntimeError(f"Google Sheets не инициализирован: {e}") from e
+        self.init_seconds = round(time.perf_counter() - started, 4)
+        self.error = None
+        self._failed_at = None
+        logger.info(f"Google Sheets API инициализирован за {self.init_seconds * 1000:.0f} мс")
+        return spreadsheets
+
+    @property
+    def state(self) -> str:
+        if self._spreadsheets is not None:
+            return 'инициализирован'
+        if self.error:
+            return 'ошибка'
+        return 'не создан'
+
+    def stats(self) -> dict:
+        return {'state': self.state, 'init_seconds': self.init_seconds, 'error': self.error}
+
+
+def trim_discovery_document(document: dict, methods=DISCOVERY_METHODS) -> dict:
+    """Оставляет в документе Sheets v4 только методы spreadsheets.values из methods и нужные им схемы"""
+    values = document['resources']['spreadsheets']['resources']['values']
+    trimmed_methods = {name: values['methods'][name] for name in methods}
+    document = dict(document)
+    document['resources'] = {'spreadsheets': {'resources': {'values': {'methods': trimmed_methods}}}}
+
+    # Схемы, на которые ссылаются оставленные методы (рекурсивно по $ref)
+    schemas = document['schemas']
+    needed = set()
+    pending = [json.dumps(trimmed_methods)]
+    while pending:
+        text = pending.pop()
+        for ref in _refs(text):
+            if ref not in needed:
+                needed.add(ref)
+                pending.append(json.dumps(schemas[ref]))
+    document['schemas'] = {name: schemas[name] for name in sorted(needed)}
+    return document
+
+
+def _refs(text: str):
+    marker = '"$ref": "'
+    start = text.find(marker)
+    while start != -1:
+        end = text.index('"', start + len(marker))
+        yield text[start + len(marker):end]
+        start = text.find(marker, end)
+
+
+def main():
+    """Пересобирает discovery/sheets.v4.json из документа, поставляемого с google-api-python-client"""
+    import googleapiclient
+
+    source = os.path.join(os.path.dirname(googleapiclient.__file__), 'discovery_cache', 'documents', 'sheets.v4.json')
+    with open(source, encoding='utf-8') as f:
+        document = trim_discovery_document(json.load(f), sys.argv[1:] or DISCOVERY_METHODS)
+    os.makedirs(os.path.dirname(DISCOVERY_PATH), exist_ok=True)
+    with open(DISCOVERY_PATH, 'w', encoding='utf-8') as f:
+        json.dump(document, f, ensure_ascii=False, indent=1, sort_keys=True)
+        f.write('\n')
+    print(f"{DISCOVERY_PATH}: методы {', '.join(document['resources']['spreadsheets']['resources']['values']['methods'])}, "
+          f"схем {len(document['schemas'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import json
+import time
+import random
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SheetsSpool:
+    """Локальная очередь записи заявок в Google Sheets (write-behind).
+
+    Строки сначала сохраняются в SQLite (режим WAL), вызывающий код сразу получает
+    подтверждение, а фоновый поток объединяет накопившиеся строки в один
+    values().append. Строка удаляется из очереди только после успешной записи,
+    при ошибке запись повторяется с экспоненциальной задержкой. Строки берутся
+    в работу с арендой (lease_until), поэтому несколько процессов с общим файлом
+    не отправят одну заявку дважды.
+    """
+
+    def __init__(self, path: str, append_rows, batch_size: int = 50, flush_interval: float = 2.0,
+                 linger: float = 0.5, lease: float = 60.0, max_backoff: float = 300.0):
+        self.path = path
+        self.append_rows = append_rows  # append_rows(list_of_rows) — прямая запись в таблицу
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.linger = linger
+        self.lease = lease
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        # Время последней успешной записи и последняя ошибка — для /health
+        self.last_success_at = None
+        self.last_error = None
+        self.last_error_at = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sheets_spool ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " row TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " lease_until REAL NOT NULL DEFAULT 0)"
+        )
+
+    def enqueue(self, row: list) -> int:
+        """Сохраняет строку в локальную очередь и возвращает её id"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO sheets_spool (row, created_at) VALUES (?, ?)",
+                (json.dumps(row, ensure_ascii=False), time.time())
+            )
+        self.start()
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def pending(self) -> int:
+        """Количество строк, ещё не записанных в таблицу"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sheets_spool").fetchone()[0]
+
+    def pending_rows(self) -> list:
+        """Строки, ещё не записанные в таблицу (в порядке постановки в очередь)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT row FROM sheets_spool ORDER BY id").fetchall()
+        return [json.loads(row) for row, in rows]
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self) -> dict:
+        """Состояние очереди для /health"""
+        return {
+            'running': self.running,
+            'pending': self.pending(),
+            'last_success_at': self.last_success_at,
+            'last_error': self.last_error,
+            'last_error_at': self.last_error_at,
+        }
+
+    def _claim(self):
+        """Берёт в работу очередную пачку строк, у которых истекла аренда"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, row, attempts FROM sheets_spool WHERE lease_until <= ? ORDER BY id LIMIT ?",
+                    (now, self.batch_size)
+                ).fetchall()
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE sheets_spool SET lease_until = ? WHERE id = ?",
+                        [(now + self.lease, row_id) for row_id, _, _ in rows]
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def flush(self) -> int:
+        """Отправляет одну пачку строк в таблицу. Возвращает количество записанных строк"""
+        rows = self._claim()
+        if not rows:
+            return 0
+
+        ids = [row_id for row_id, _, _ in rows]
+        try:
+            self.append_rows([json.loads(row) for _, row, _ in rows])
+        except Exception as e:
+            attempts = max(attempts for _, _, attempts in rows) + 1
+            delay = min(self.max_backoff, self.flush_interval * 2 ** attempts) * random.uniform(0.5, 1.0)
+            logger.error(f"Ошибка записи пачки из {len(ids)} заявок в Google Sheets (попытка {attempts}): {e}")
+            self.last_error = str(e)
+            self.last_error_at = time.time()
+            with self._lock:
+                self._conn.executemany(
+                    "UPDATE sheets_spool SET attempts = attempts + 1, lease_until = ? WHERE id = ?",
+                    [(time.time() + delay, row_id) for row_id in ids]
+                )
+            return 0
+
+        with self._lock:
+            self._conn.executemany("DELETE FROM sheets_spool WHERE id = ?", [(row_id,) for row_id in ids])
+        self.last_success_at = time.time()
+        logger.info(f"В Google Sheets записана пачка из {len(ids)} заявок")
+        return len(ids)
+
+    def start(self):
+        """Запускает фоновый поток записи (повторный вызов ничего не делает)"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='sheets-spool', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            woken = self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if woken:
+                # Даём накопиться заявкам из всплеска, чтобы отправить их одной пачкой
+                time.sleep(self.linger)
+            try:
+                while self.flush() == self.batch_size:
+                    pass
+            except Exception as e:
+                logger.error(f"Ошибка фоновой записи в Google Sheets: {e}")
+
+    def stop(self, drain: bool = True):
+        """Останавливает фоновый поток, по возможности дописав очередь"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        if drain:
+            try:
+                while self.flush():
+                    pass
+            except Exception as e:
+                logger.error(f"Не удалось дописать очередь Google Sheets при остановке: {e}")
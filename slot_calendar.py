@@ -0,0 +1,332 @@
+import re
+import time
+import bisect
+import logging
+import threading
+from datetime import datetime, date, timedelta
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+# Формат даты и времени записи в таблице и в сообщениях клиенту
+SLOT_FORMAT = '%d.%m.%Y %H:%M'
+# Отсчёт минутных ключей индекса
+EPOCH = datetime(2000, 1, 1)
+
+MONTHS = (
+    ('янв', 1), ('фев', 2), ('мар', 3), ('апр', 4), ('мая', 5), ('май', 5), ('июн', 6),
+    ('июл', 7), ('авг', 8), ('сен', 9), ('окт', 10), ('ноя', 11), ('дек', 12),
+)
+WEEKDAYS = (
+    ('понедельник', 0), ('вторник', 1), ('сред', 2), ('четверг', 3), ('пятниц', 4), ('суббот', 5), ('воскресен', 6),
+)
+WEEKDAY_NAMES = ('пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс')
+RELATIVE_DAYS = (('послезавтра', 2), ('завтра', 1), ('сегодня', 0))
+
+TIME_COLON_RE = re.compile(r'(?<!\d)([01]?\d|2[0-3]):([0-5]\d)(?!\d)')
+TIME_AT_RE = re.compile(r'(?:^|\s)в\s+([01]?\d|2[0-3])(?:[.\-]([0-5]\d))?(?!\d)(?:\s*(?:ч\b|час\w*))?')
+TIME_HOURS_RE = re.compile(r'(?<!\d)([01]?\d|2[0-3])\s*(?:ч\b|час\w*)')
+# «15.00» неотличимо от даты «15.10»: такое время принимается, только если в остатке текста есть дата
+TIME_DOT_RE = re.compile(r'(?<![\d.])([01]?\d|2[0-3])\.([0-5]\d)(?![\d.])')
+AFTERNOON_RE = re.compile(r'\b(?:дня|вечера|вечером|после обеда)\b')
+ISO_DATE_RE = re.compile(r'(?<!\d)(\d{4})-(\d{1,2})-(\d{1,2})(?!\d)')
+NUMERIC_DATE_RE = re.compile(r'(?<!\d)(\d{1,2})[./](\d{1,2})(?:[./](\d{4}|\d{2}))?(?!\d)')
+TEXT_DATE_RE = re.compile(r'(?<!\d)(\d{1,2})\s+([а-яё]+)(?:\s+(\d{4}))?')
+
+
+def time_candidates(text: str):
+    """Варианты времени в тексте: (часы, минуты, остаток текста без времени), от надёжных к сомнительным"""
+    for regex in (TIME_COLON_RE, TIME_AT_RE, TIME_HOURS_RE, TIME_DOT_RE):
+        for match in regex.finditer(text):
+            hour = int(match.group(1))
+            minute = int(match.group(2) or 0) if regex is not TIME_HOURS_RE else 0
+            if hour < 12 and AFTERNOON_RE.search(text):
+                hour += 12
+            yield hour, minute, text[:match.start()] + ' ' + text[match.end():]
+
+
+def parse_date(text: str, today: date):
+    """Дата из текста (числом, словами, «завтра», день недели) или None. Год без указания — ближайший"""
+    match = ISO_DATE_RE.search(text)
+    if match:
+        return _make_date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+
+    match = NUMERIC_DATE_RE.search(text)
+    if match:
+        year = match.group(3)
+        if year:
+            return _make_date(int(year) + (2000 if len(year) == 2 else 0), int(match.group(2)), int(match.group(1)))
+        return _nearest(today, int(match.group(2)), int(match.group(1)))
+
+    for match in TEXT_DATE_RE.finditer(text):
+        month = next((number for prefix, number in MONTHS if match.group(2).startswith(prefix)), None)
+        if month:
+            if match.group(3):
+                return _make_date(int(match.group(3)), month, int(match.group(1)))
+            return _nearest(today, month, int(match.group(1)))
+
+    for word, days in RELATIVE_DAYS:
+        if word in text:
+            return today + timedelta(days=days)
+
+    for prefix, weekday in WEEKDAYS:
+        if prefix in text:
+            return today + timedelta(days=(weekday - today.weekday()) % 7 or 7)
+    return None
+
+
+def _make_date(year: int, month: int, day: int):
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _nearest(today: date, month: int, day: int):
+    """Ближайшая дата с таким днём и месяцем, не раньше сегодняшней"""
+    result = _make_date(today.year, month, day)
+    if result is not None and result < today:
+        result = _make_date(today.year + 1, month, day)
+    return result
+
+
+def parse_slot(text: str, now: datetime):
+    """Дата и время записи из свободного текста («25.12 15:00», «завтра в 11», «в пятницу 16:30»).
+
+    Возвращает datetime (без часового пояса, местное время) или None, если в тексте нет даты или времени.
+    """
+    text = (text or '').lower().replace('ё', 'е')
+    for hour, minute, rest in time_candidates(text):
+        day = parse_date(rest, now.date())
+        if day is not None:
+            return datetime(day.year, day.month, day.day, hour, minute)
+    return None
+
+
+def format_slot(slot: datetime) -> str:
+    return slot.strftime(SLOT_FORMAT)
+
+
+def describe_slot(slot: datetime) -> str:
+    """Время для клиента: «пт 27.12.2024 15:00»"""
+    return f"{WEEKDAY_NAMES[slot.weekday()]} {format_slot(slot)}"
+
+
+def _key(slot: datetime) -> int:
+    return int((slot - EPOCH).total_seconds() // 60)
+
+
+class SlotCalendar:
+    """Календарь записи к адвокату: занятые интервалы в отсортированном списке.
+
+    Запись занимает slot_minutes минут от начала; время свободно, если с ним
+    пересекается меньше capacity записей (число адвокатов на приём).
+    Проверка — два bisect по списку начал, то есть O(log n). Индекс загружается
+    из таблицы и очереди записи один раз и дополняется при каждой заявке;
+    заявки, принятые во время перезагрузки, не теряются.
+
+    Индекс — в памяти процесса, поэтому reserve дополнительно занимает время
+    в общем для воркеров хранилище shared (claim_slot/release_slot, например
+    BookingDedupIndex); полная перезагрузка пересобирает shared по таблице
+    (sync_slots). До первой загрузки индекс пуст: check возвращает unknown,
+    free_slots — пустой список, reserve проверяет время только по shared.
+    """
+
+    FREE, BUSY, CLOSED, PAST, UNKNOWN = 'free', 'busy', 'closed', 'past', 'unknown'
+
+    def __init__(self, slot_minutes: int = 60, open_hour: int = 10, close_hour: int = 19,
+                 workdays=(0, 1, 2, 3, 4), capacity: int = 1, lead_minutes: int = 60, horizon_days: int = 60,
+                 timezone: str = 'Europe/Moscow', shared=None):
+        self.slot_minutes = slot_minutes
+        self.open_hour = open_hour
+        self.close_hour = close_hour
+        self.workdays = set(workdays)
+        self.capacity = capacity
+        self.lead_minutes = lead_minutes
+        self.horizon_days = horizon_days
+        self.timezone = pytz.timezone(timezone)
+        self.shared = shared
+        self.loaded_at = None
+        self.load_seconds = None
+        self.load_error = None
+        self.conflicts = 0
+        self._starts = []  # минутные ключи начала записей, по возрастанию
+        self._journal = None  # изменения во время перезагрузки
+        self._load_started = None  # time.time() начала перезагрузки
+        self._lock = threading.Lock()
+
+    def now(self) -> datetime:
+        return datetime.now(self.timezone).replace(tzinfo=None, second=0, microsecond=0)
+
+    def parse(self, text: str, now: datetime = None):
+        return parse_slot(text, now or self.now())
+
+    def _overlapping(self, key: int) -> int:
+        """Сколько записей пересекается с интервалом [key, key + slot_minutes) (под блокировкой)"""
+        return (bisect.bisect_left(self._starts, key + self.slot_minutes)
+                - bisect.bisect_right(self._starts, key - self.slot_minutes))
+
+    def is_working_time(self, slot: datetime) -> bool:
+        end = slot + timedelta(minutes=self.slot_minutes)
+        return (slot.weekday() in self.workdays and slot.hour >= self.open_hour
+                and (end.hour, end.minute) <= (self.close_hour, 0) and end.date() == slot.date())
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def check(self, slot: datetime, now: datetime = None) -> str:
+        """free, busy (время занято), closed (нерабочее время), past (уже прошло) или unknown (не загружен)"""
+        if slot < (now or self.now()):
+            return self.PAST
+        if not self.is_working_time(slot):
+            return self.CLOSED
+        with self._lock:
+            if not self.loaded:
+                return self.UNKNOWN
+            return self.FREE if self._overlapping(_key(slot)) < self.capacity else self.BUSY
+
+    def reserve(self, slot: datetime, now: datetime = None) -> str:
+        """Проверяет и занимает время одним действием: результат check или unknown (индекс не загружен)"""
+        now = now or self.now()
+        if slot < now:
+            return self.PAST
+        if not self.is_working_time(slot):
+            return self.CLOSED
+        key = _key(slot)
+        with self._lock:
+            loaded = self.loaded_at is not None
+            if (loaded and self._overlapping(key) >= self.capacity) or not self._claim_shared(key, now, self.capacity):
+                self.conflicts += 1
+                return self.BUSY
+            self._insert(key)
+        return self.FREE if loaded else self.UNKNOWN
+
+    def _claim_shared(self, key: int, now: datetime, capacity) -> bool:
+        if self.shared is None:
+            return True
+        try:
+            return self.shared.claim_slot(key, self.slot_minutes, capacity, expired_before=_key(now))
+        except Exception as e:
+            # Без общего хранилища время проверяется только по индексу процесса
+            logger.error(f"Ошибка общей записи времени: {e}")
+            return True
+
+    def add(self, slot: datetime):
+        """Добавляет уже принятую запись без проверки"""
+        key = _key(slot)
+        with self._lock:
+            self._claim_shared(key, self.now(), None)
+            self._insert(key)
+
+    def release(self, slot: datetime):
+        """Освобождает время (заявка не записана)"""
+        key = _key(slot)
+        if self.shared is not None:
+            self.shared.release_slot(key)
+        with self._lock:
+            index = bisect.bisect_left(self._starts, key)
+            if index < len(self._starts) and self._starts[index] == key:
+                del self._starts[index]
+            if self._journal is not None:
+                self._journal.append((key, -1))
+
+    def _insert(self, key: int):
+        bisect.insort(self._starts, key)
+        if self._journal is not None:
+            self._journal.append((key, 1))
+
+    def free_slots(self, after: datetime = None, count: int = 3) -> list:
+        """Ближайшие count свободных начал приёма по сетке slot_minutes, не раньше after (до загрузки — [])"""
+        if not self.loaded:
+            return []
+        now = self.now()
+        earliest = now + timedelta(minutes=self.lead_minutes)
+        start = max(after, earliest) if after else earliest
+        day = start.date()
+        result = []
+        with self._lock:
+            for _ in range(self.horizon_days):
+                if day.weekday() in self.workdays:
+                    slot = datetime(day.year, day.month, day.day, self.open_hour)
+                    while self.is_working_time(slot) and len(result) < count:
+                        if slot >= start and self._overlapping(_key(slot)) < self.capacity:
+                            result.append(slot)
+                        slot += timedelta(minutes=self.slot_minutes)
+                if len(result) >= count:
+                    break
+                day += timedelta(days=1)
+        return result
+
+    def begin_load(self):
+        """Начало перезагрузки: заявки до load() попадут и в новый индекс"""
+        with self._lock:
+            self._journal = []
+            self._load_started = time.time()
+
+    def load(self, slots, started: float = None, full: bool = False):
+        """Заменяет индекс записями из таблицы (slots — datetime начала).
+
+        full — таблица прочитана целиком: занятое время в shared пересобирается по ней.
+        """
+        keys = sorted(_key(slot) for slot in slots)
+        if full and self.shared is not None and self._load_started is not None:
+            try:
+                self.shared.sync_slots(keys, self._load_started)
+            except Exception as e:
+                logger.error(f"Ошибка пересборки общего занятого времени: {e}")
+        with self._lock:
+            for key, delta in self._journal or ():
+                if delta > 0:
+                    bisect.insort(keys, key)
+                else:
+                    index = bisect.bisect_left(keys, key)
+                    if index < len(keys) and keys[index] == key:
+                        del keys[index]
+            self._starts = keys
+            self._journal = None
+            self._load_started = None
+            self.loaded_at = time.time()
+            self.load_error = None
+            if started is not None:
+                self.load_seconds = round(time.perf_counter() - started, 3)
+
+    def load_failed(self, error):
+        with self._lock:
+            self._journal = None
+            self._load_started = None
+            self.load_error = str(error)
+
+    def working_hours_text(self) -> str:
+        """Часы приёма для клиента: «пн–пт 10:00–19:00»"""
+        days = sorted(self.workdays)
+        if days and days == list(range(days[0], days[-1] + 1)) and len(days) > 2:
+            day_text = f"{WEEKDAY_NAMES[days[0]]}–{WEEKDAY_NAMES[days[-1]]}"
+        else:
+            day_text = ', '.join(WEEKDAY_NAMES[day] for day in days)
+        return f"{day_text} {self.open_hour:02d}:00–{self.close_hour:02d}:00"
+
+    @property
+    def size(self) -> int:
+        return len(self._starts)
+
+    def stats(self) -> dict:
+        return {
+            'bookings': self.size,
+            'loaded_at': self.loaded_at,
+            'load_seconds': self.load_seconds,
+            'load_error': self.load_error,
+            'conflicts': self.conflicts,
+            'slot_minutes': self.slot_minutes,
+            'capacity': self.capacity,
+        }
+
+
+def parse_workdays(spec: str) -> tuple:
+    """Рабочие дни из строки вида '0-4' или '0,1,2,3,4,5' (0 — понедельник)"""
+    days = set()
+    for part in spec.split(','):
+        first, _, last = part.strip().partition('-')
+        days.update(range(int(first), int(last or first) + 1))
+    return tuple(sorted(days))
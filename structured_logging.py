@@ -0,0 +1,164 @@
+import os
+import sys
+import copy
+import json
+import queue
+import random
+import atexit
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Id текущего запроса: HTTP запроса Flask или Telegram update
+request_id_var = contextvars.ContextVar('request_id', default='-')
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(request_id)s] %(message)s'
+
+# Атрибуты LogRecord, которые не считаются дополнительными полями записи
+STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет в запись id запроса (выполняется в потоке, где вызван логгер)"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, логгер, сообщение, id запроса и поля из extra"""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler, который не форматирует запись в вызывающем потоке.
+
+    Стандартный QueueHandler.prepare() подставляет аргументы в сообщение до
+    постановки в очередь; здесь это делает поток QueueListener, а вызывающий
+    поток только копирует запись.
+    """
+
+    def prepare(self, record):
+        return copy.copy(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Лучше потерять запись лога, чем задержать ответ пользователю
+            log_settings.dropped += 1
+
+
+class LogSettings:
+    """Переключатели подробного логирования, меняются во время работы (/admin/logging)"""
+
+    def __init__(self, payloads: bool = False, sample_rate: float = 1.0):
+        self.payloads = payloads  # логировать содержимое updates и сообщений
+        self.sample_rate = sample_rate  # доля событий payload, попадающих в лог
+        self.dropped = 0  # записи, не поместившиеся в очередь
+        self.sampled_out = 0  # события payload, пропущенные выборкой
+
+    def payload(self) -> bool:
+        """Нужно ли логировать очередное событие с содержимым сообщений"""
+        if not self.payloads:
+            return False
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+    def update(self, payloads=None, sample_rate=None, level=None):
+        if payloads is not None:
+            self.payloads = bool(payloads)
+        if sample_rate is not None:
+            self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        if level is not None:
+            logging.getLogger().setLevel(str(level).upper())
+
+    def stats(self) -> dict:
+        return {
+            'payloads': self.payloads,
+            'sample_rate': self.sample_rate,
+            'level': logging.getLevelName(logging.getLogger().level),
+            'dropped': self.dropped,
+            'sampled_out': self.sampled_out,
+        }
+
+
+log_settings = LogSettings()
+_listener = None
+_configured = False
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level='INFO', fmt: str = 'text', use_queue: bool = True, queue_size: int = 10000,
+                  payloads: bool = False, sample_rate: float = 1.0, stream=None):
+    """Настраивает корневой логгер процесса (повторный вызов ничего не делает).
+
+    fmt — 'text' или 'json'. use_queue — записи передаются в фоновый поток
+    через очередь, вызывающий поток не ждёт форматирования и вывода.
+    """
+    global _listener, _configured
+    with _setup_lock:
+        if _configured:
+            return
+        _configured = True
+
+        log_settings.update(payloads=payloads, sample_rate=sample_rate)
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+        if use_queue:
+            handler = DeferredQueueHandler(queue.Queue(maxsize=queue_size))
+            _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+            _listener.start()
+            atexit.register(stop_logging)
+        else:
+            handler = output
+        handler.addFilter(RequestIdFilter())
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(str(level).upper())
+
+
+def stop_logging():
+    """Дописывает очередь логов (вызывается при завершении процесса)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def new_request_id() -> str:
+    return os.urandom(6).hex()
+
+
+async def with_request_id(coro, request_id: str):
+    request_id_var.set(request_id)
+    return await coro
+
+
+def bind_request_id(coro):
+    """Переносит id текущего запроса в корутину, выполняемую в другом потоке (telegram_loop)"""
+    return with_request_id(coro, request_id_var.get())
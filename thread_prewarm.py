@@ -0,0 +1,104 @@
+import time
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadPrewarmer:
+    """Запас заранее созданных thread OpenAI для новых диалогов.
+
+    Новый диалог берёт готовый thread из запаса вместо вызова threads.create(),
+    фоновая задача в telegram_loop пополняет запас до size. Thread старше max_age
+    не выдаются и удаляются; при остановке удаляются все невыданные thread.
+    """
+
+    def __init__(self, create_thread, delete_thread, size: int = 3, max_age: float = 3600,
+                 refill_interval: float = 30):
+        self.create_thread = create_thread  # корутина () -> thread_id
+        self.delete_thread = delete_thread  # корутина (thread_id) -> None
+        self.size = size
+        self.max_age = max_age
+        self.refill_interval = refill_interval
+        self._threads = deque()  # (thread_id, created_at), старые слева
+        self._wakeup = None
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self):
+        """Запускает пополнение запаса. Вызывается внутри telegram_loop"""
+        if self.size <= 0:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._refill_loop())
+        logger.info(f"Запас thread OpenAI: размер {self.size}, максимальный возраст {self.max_age} сек")
+
+    def acquire(self):
+        """Выдаёт готовый thread_id или None, если запас пуст"""
+        now = time.monotonic()
+        while self._threads:
+            thread_id, created_at = self._threads.popleft()
+            if now - created_at <= self.max_age:
+                self.hits += 1
+                self._request_refill()
+                return thread_id
+            self._discard(thread_id)
+        self.misses += 1
+        self._request_refill()
+        return None
+
+    def _request_refill(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _discard(self, thread_id: str):
+        """Удаляет устаревший thread в фоне"""
+        asyncio.get_running_loop().create_task(self._delete(thread_id))
+
+    async def _delete(self, thread_id: str):
+        try:
+            await self.delete_thread(thread_id)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить thread {thread_id}: {e}")
+
+    async def _refill_loop(self):
+        while True:
+            # Удаляем устаревшие thread из начала очереди
+            now = time.monotonic()
+            while self._threads and now - self._threads[0][1] > self.max_age:
+                self._discard(self._threads.popleft()[0])
+
+            while len(self._threads) < self.size:
+                try:
+                    thread_id = await self.create_thread()
+                except Exception as e:
+                    logger.warning(f"Не удалось пополнить запас thread: {e}")
+                    break
+                self._threads.append((thread_id, time.monotonic()))
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def shutdown(self):
+        """Останавливает пополнение и удаляет невыданные thread"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        threads = [thread_id for thread_id, _ in self._threads]
+        self._threads.clear()
+        if threads:
+            await asyncio.gather(*(self._delete(thread_id) for thread_id in threads))
+            logger.info(f"Удалено невыданных thread: {len(threads)}")
+
+    def stats(self) -> dict:
+        return {
+            'available': len(self._threads),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,133 @@
+import threading
+
+from booking_extractor import BookingExtraction
+
+# Подписи полей записи в кратком содержании диалога
+FIELD_TITLES = (('name', 'имя'), ('phone', 'телефон'), ('service', 'услуга'), ('date', 'дата и время'))
+ROLE_TITLES = {'user': 'Клиент', 'assistant': 'Ассистент'}
+
+
+class ThreadRollover:
+    """Перенос длинного диалога в новый thread с кратким содержанием.
+
+    Каждый run заново обрабатывает всю историю thread, поэтому задержка и цена
+    ответа растут с возрастом диалога. Когда в thread больше max_messages
+    сообщений или контекст run превысил max_tokens токенов, следующее сообщение
+    уходит в новый thread, который начинается с краткого содержания: уже
+    собранные данные записи и последние keep_messages сообщений.
+
+    Учёт thread — dict в хранилище сессий (record_run); здесь же средние длина
+    thread, токены и время run до и после переноса для /health.
+    """
+
+    def __init__(self, max_messages: int = 40, max_tokens: int = 12000, keep_messages: int = 6,
+                 max_message_chars: int = 600, chars_per_token: float = 3.0):
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.keep_messages = keep_messages
+        self.max_message_chars = max_message_chars
+        self.chars_per_token = chars_per_token
+        self.rollovers = 0
+        self.failures = 0
+        self._totals = {'before': [0, 0, 0, 0.0], 'after': [0, 0, 0, 0.0]}  # число, сообщения, токены, run
+        self._lock = threading.Lock()
+
+    def record_run(self, usage: dict, messages: int, chars: int, run_seconds: float, prompt_tokens: int = None) -> dict:
+        """Учёт thread после run: messages новых сообщений (вместе с ответом) и chars символов в них.
+
+        prompt_tokens — контекст run по данным OpenAI; без него оценивается по числу символов.
+        Возвращает обновлённый учёт.
+        """
+        usage = dict(usage or {})
+        usage['messages'] = usage.get('messages', 0) + messages
+        usage['chars'] = usage.get('chars', 0) + chars
+        usage['prompt_tokens'] = prompt_tokens or int(usage['chars'] / self.chars_per_token)
+        usage['run_seconds'] = round(run_seconds, 3)
+        if usage.pop('rolled_over', False):
+            # Первый run после переноса — замер «после»
+            self._add('after', usage)
+        return usage
+
+    def due(self, usage: dict) -> bool:
+        """Пора ли переносить диалог в новый thread"""
+        if not usage:
+            return False
+        return ((self.max_messages > 0 and usage.get('messages', 0) >= self.max_messages)
+                or (self.max_tokens > 0 and usage.get('prompt_tokens', 0) >= self.max_tokens))
+
+    def summary(self, extraction: BookingExtraction, history: list) -> str:
+        """Краткое содержание диалога: данные записи и последние сообщения.
+
+        history — [(role, text)] от старых к новым.
+        """
+        lines = ["Краткое содержание предыдущей части диалога с клиентом (история перенесена автоматически)."]
+        known, missing, seen = [], [], set()
+        for field, title in FIELD_TITLES:
+            value = extraction.fields[field]
+            # Эвристики извлечения могут отнести одно сообщение к двум полям (имя и услуга)
+            if value and value not in seen:
+                known.append(f"{title} — {value}")
+                seen.add(value)
+            elif not value:
+                missing.append(title)
+        if known:
+            lines.append("Данные для записи, уже сообщённые клиентом: " + "; ".join(known) + ".")
+            if missing:
+                lines.append("Ещё не сообщено: " + ", ".join(missing) + ".")
+        if extraction.documents and extraction.documents != 'нет':
+            lines.append(f"Документы: {extraction.documents}.")
+        if extraction.comments:
+            lines.append("Подробности от клиента: " + "; ".join(self._clip(text) for text in extraction.comments[-3:]) + ".")
+        tail = [(role, text) for role, text in history if text][-self.keep_messages:]
+        if tail:
+            lines.append("Последние сообщения:")
+            lines.extend(f"{ROLE_TITLES.get(role, role)}: {self._clip(text)}" for role, text in tail)
+        return "\n".join(lines)
+
+    def _clip(self, text: str) -> str:
+        text = ' '.join(text.split())
+        return text if len(text) <= self.max_message_chars else text[:self.max_message_chars - 1] + '…'
+
+    def rolled_over(self, usage: dict, summary: str) -> dict:
+        """Учёт старого thread — в замер «до»; возвращает учёт нового thread"""
+        self._add('before', usage)
+        with self._lock:
+            self.rollovers += 1
+        return {
+            'messages': 1,
+            'chars': len(summary),
+            'prompt_tokens': int(len(summary) / self.chars_per_token),
+            'generation': usage.get('generation', 0) + 1,
+            'rolled_over': True,
+        }
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+
+    def _add(self, stage: str, usage: dict):
+        with self._lock:
+            totals = self._totals[stage]
+            totals[0] += 1
+            totals[1] += usage.get('messages', 0)
+            totals[2] += usage.get('prompt_tokens', 0)
+            totals[3] += usage.get('run_seconds', 0.0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            averages = {
+                stage: {
+                    'threads': count,
+                    'avg_messages': round(messages / count, 1) if count else None,
+                    'avg_prompt_tokens': round(tokens / count) if count else None,
+                    'avg_run_seconds': round(seconds / count, 3) if count else None,
+                }
+                for stage, (count, messages, tokens, seconds) in self._totals.items()
+            }
+            return {
+                'rollovers': self.rollovers,
+                'failures': self.failures,
+                'max_messages': self.max_messages,
+                'max_tokens': self.max_tokens,
+                **averages,
+            }
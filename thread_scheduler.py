@@ -0,0 +1,66 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadRunScheduler:
+    """Последовательные run по каждому thread_id с объединением сообщений.
+
+    OpenAI не принимает новые сообщения и run в thread, где уже идёт run.
+    Поэтому сообщения, пришедшие во время run, копятся и отправляются
+    следующей пачкой, на которую отвечает один run. Результат получают все
+    ожидающие, но ответом считается только последнее сообщение пачки —
+    остальные помечаются как объединённые (merged).
+    """
+
+    def __init__(self):
+        self._pending = {}  # thread_id -> [(payload, future)]
+        self._workers = {}  # thread_id -> задача, обрабатывающая пачки
+        self.runs = 0
+        self.merged = 0
+
+    async def submit(self, thread_id: str, payload, run_batch):
+        """Ставит сообщение в очередь thread и ждёт результата.
+
+        run_batch(thread_id, payloads) — корутина, выполняющая один run для пачки.
+        Возвращает (result, merged), где merged=True, если ответ относится к более
+        позднему сообщению той же пачки.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(thread_id, []).append((payload, future))
+        if thread_id not in self._workers:
+            self._workers[thread_id] = asyncio.get_running_loop().create_task(self._drain(thread_id, run_batch))
+        return await future
+
+    async def _drain(self, thread_id: str, run_batch):
+        try:
+            while self._pending.get(thread_id):
+                batch = self._pending.pop(thread_id)
+                if len(batch) > 1:
+                    logger.info(f"Thread {thread_id}: объединено {len(batch)} сообщений в один run")
+                    self.merged += len(batch) - 1
+                self.runs += 1
+                try:
+                    result = await run_batch(thread_id, [payload for payload, _ in batch])
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for i, (_, future) in enumerate(batch):
+                    if not future.done():
+                        future.set_result((result, i < len(batch) - 1))
+        finally:
+            self._workers.pop(thread_id, None)
+
+    def busy(self, thread_id: str) -> bool:
+        """Идёт ли run в thread (или ждут сообщения)"""
+        return thread_id in self._workers
+
+    def stats(self) -> dict:
+        return {
+            'active_threads': len(self._workers),
+            'runs': self.runs,
+            'merged_messages': self.merged,
+        }
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateQueue:
+    """Ограниченная очередь Telegram updates для режима «сначала ответить 200».
+
+    Flask кладёт update в очередь и сразу отвечает Telegram, а N обработчиков
+    в telegram_loop разбирают очередь через application.process_update.
+    Updates одного чата всегда попадают к одному обработчику — так шаги FSM
+    не обгоняют друг друга. Размер очереди считается под threading.Lock,
+    чтобы переполнение было видно из потока Flask до передачи update в loop.
+    """
+
+    def __init__(self, maxsize: int = 1000, consumers: int = 4):
+        self.maxsize = maxsize
+        self.consumers = consumers
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._dropped = 0
+        self._queues = []
+        self._loop = None
+        self._tasks = []
+
+    async def start(self, process_update):
+        """Запускает обработчиков очереди. Вызывается внутри telegram_loop"""
+        self._loop = asyncio.get_running_loop()
+        for i in range(self.consumers):
+            queue = asyncio.Queue()
+            self._queues.append(queue)
+            self._tasks.append(self._loop.create_task(self._consume(i, queue, process_update)))
+        logger.info(f"Очередь webhook запущена: {self.consumers} обработчиков, лимит {self.maxsize}")
+
+    def offer(self, update) -> bool:
+        """Кладёт update в очередь из любого потока. Возвращает False, если очередь полна"""
+        if self._loop is None:
+            return False
+        with self._lock:
+            if self._depth >= self.maxsize:
+                self._dropped += 1
+                return False
+            self._depth += 1
+        queue = self._queues[self._route(update)]
+        self._loop.call_soon_threadsafe(queue.put_nowait, update)
+        return True
+
+    def _route(self, update) -> int:
+        """Номер обработчика для update: по чату, иначе по update_id"""
+        chat = update.effective_chat
+        key = chat.id if chat else update.update_id
+        return hash(key) % self.consumers
+
+    async def _consume(self, index: int, queue, process_update):
+        while True:
+            update = await queue.get()
+            try:
+                await process_update(update)
+            except Exception as e:
+                logger.error(f"Ошибка обработки update в очереди (обработчик {index}): {e}")
+            finally:
+                with self._lock:
+                    self._depth -= 1
+                queue.task_done()
+
+    @property
+    def depth(self) -> int:
+        """Количество updates, ожидающих или проходящих обработку"""
+        return self._depth
+
+    def stats(self) -> dict:
+        """Состояние очереди для /health"""
+        return {
+            'depth': self._depth,
+            'maxsize': self.maxsize,
+            'consumers': self.consumers,
+            'dropped': self._dropped,
+        }
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class AssistantWorkerPool:
+    """Ограниченный пул для работы с Assistant вне обработки Telegram updates.
+
+    Ответы Assistant выполняются фоновыми задачами в telegram_loop, поэтому
+    обработчик update возвращается сразу и loop продолжает обслуживать другие чаты.
+    Блокирующие вызовы (Google Sheets, разбор thread) уходят в отдельный пул потоков.
+    """
+
+    def __init__(self, max_concurrent: int = 8, max_per_user: int = 1,
+                 max_pending: int = 100, max_threads: int = 8):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='assistant')
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._user_active = {}  # user_id -> количество задач пользователя
+        self._tasks = set()
+        self._running = 0
+
+    def submit(self, user_id, coro_factory) -> bool:
+        """Ставит задачу пользователя в пул. Возвращает False, если превышен лимит"""
+        if self._user_active.get(user_id, 0) >= self.max_per_user:
+            logger.info(f"Пул Assistant: у user_id={user_id} достигнут лимит одновременных запросов")
+            return False
+        if len(self._tasks) >= self.max_pending:
+            logger.warning(f"Пул Assistant переполнен: {len(self._tasks)} задач в очереди")
+            return False
+
+        self._user_active[user_id] = self._user_active.get(user_id, 0) + 1
+        task = asyncio.get_running_loop().create_task(self._run_user_task(user_id, coro_factory))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run_user_task(self, user_id, coro_factory):
+        try:
+            await self.run(coro_factory())
+        except Exception as e:
+            logger.error(f"Ошибка задачи Assistant для user_id={user_id}: {e}", exc_info=True)
+        finally:
+            count = self._user_active.get(user_id, 1) - 1
+            if count > 0:
+                self._user_active[user_id] = count
+            else:
+                self._user_active.pop(user_id, None)
+
+    async def run(self, coro):
+        """Выполняет корутину с учётом общего лимита одновременных запросов к Assistant"""
+        async with self._semaphore:
+            self._running += 1
+            try:
+                return await coro
+            finally:
+                self._running -= 1
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """Выполняет блокирующую функцию в пуле потоков, не занимая event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def stats(self) -> dict:
+        """Текущая загрузка пула"""
+        return {
+            'running': self._running,
+            'pending': len(self._tasks),
+            'users': len(self._user_active),
+            'max_concurrent': self.max_concurrent,
+        }
+
+    async def shutdown(self):
+        """Дожидается фоновых задач и останавливает пул потоков"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False)
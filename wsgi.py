@@ -0,0 +1,18 @@
+# Точка входа WSGI для многопроцессного режима (gunicorn/uWSGI).
+# Воркеры должны импортировать приложение сами (без preload/с lazy-apps):
+# SQLite-соединения и telegram_loop нельзя переносить через fork.
+import os
+
+os.environ.setdefault('MULTIPROCESS', '1')
+
+from main import app, start_worker  # noqa: E402
+
+# uWSGI с lazy-apps импортирует приложение уже в воркере — запускаем фоновые части сразу.
+# Для gunicorn это делает хук post_worker_init в gunicorn.conf.py
+try:
+    import uwsgi  # noqa: F401
+    start_worker()
+except ImportError:
+    pass
+
+application = app